@@ -1,7 +1,24 @@
 from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify
 import sqlite3
 from datetime import datetime
-import routeros_api
+from routeros_async import create_api_pool
+from router_sessions import RouterSessionPool
+from router_snapshot import RouterQuery, RouterSnapshot, as_snapshot, connection_bytes, conntrack_query
+from log_cursor import LOG_CURSOR_SCHEMA, collect_new_logs
+from router_breaker import BREAKER_SCHEMA, RouterCircuitBreaker
+from ingest_writer import enable_wal
+from db_pool import ConnectionPool
+from maintenance import BANDWIDTH_RETENTION_SCHEMA, enable_incremental_vacuum
+from bandwidth_partitions import format_timestamp, migrate_legacy_tables, raw_host_history, raw_interface_history
+from bandwidth_indexes import start_index_build
+from bandwidth_archive import BANDWIDTH_ARCHIVE_RETENTION_DAYS, BandwidthArchive, archive_dir
+from top_talkers import TOP_TALKERS_ENABLED, WINDOWS, TopTalkers
+from chart_downsample import chart_max_points
+from chart_series import (BITS_PER_MEGABIT, bucket_rates, chart_points, counter_rates, history_arrays,
+                          split_series)
+from dimension_catalog import HOST_SCHEMA, INTERFACE_SCHEMA, DimensionCatalog
+from bandwidth_rollup import (INTERFACE_ROLLUP_SCHEMA, IP_ROLLUP_SCHEMA, chart_tier,
+                              host_history, host_totals_by_window, interface_history)
 import json
 import os
 import hashlib
@@ -57,6 +74,25 @@ firewall_cache_lock = threading.Lock()
 if not os.path.exists('/app/data'):
     db_path = 'data/routers.db'
 
+# Reused connections for every query the app runs
+db = ConnectionPool(db_path)
+
+# Shared with the collector: routers it found dead are not waited on here
+router_breaker = RouterCircuitBreaker(db_path, db=db)
+
+# Long-lived RouterOS sessions shared by all routes, keyed by router id;
+# a call the router answered closes its breaker again
+router_sessions = RouterSessionPool(on_contact=router_breaker.record_success)
+
+# Host and interface names behind the ids stored in the bandwidth tables
+catalog = DimensionCatalog(db_path, db=db)
+
+# Raw samples older than the hot day partitions, in column files
+archive = BandwidthArchive(archive_dir(db_path))
+
+# Running per-IP totals behind the monitor page
+talkers = TopTalkers()
+
 # Database setup
 def init_db():
     global db_path
@@ -66,129 +102,124 @@ def init_db():
     os.makedirs(data_dir, exist_ok=True)
     
     try:
-        conn = sqlite3.connect(db_path)
-        c = conn.cursor()
+        with get_db_connection(write=True) as conn:
+            # WAL: page views read while the collector's writer commits
+            enable_wal(conn)
+            # Free pages go back to the file system after retention deletes
+            enable_incremental_vacuum(conn)
+            c = conn.cursor()
         
-        # Create routers table
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS routers (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                host TEXT NOT NULL,
-                port INTEGER DEFAULT 8728,
-                username TEXT NOT NULL,
-                password TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Create per-IP bandwidth monitoring table
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS ip_bandwidth_data (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                router_id INTEGER NOT NULL,
-                ip_address TEXT NOT NULL,
-                mac_address TEXT,
-                hostname TEXT,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                rx_bytes INTEGER DEFAULT 0,
-                tx_bytes INTEGER DEFAULT 0,
-                FOREIGN KEY (router_id) REFERENCES routers (id)
-            )
-        ''')
-        
-        # Create router status cache table
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS router_status_cache (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                router_id INTEGER NOT NULL,
-                status TEXT NOT NULL,
-                last_checked TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                router_info TEXT,
-                FOREIGN KEY (router_id) REFERENCES routers (id)
-            )
-        ''')
-        
-        # Create users table for authentication
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                password_hash TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Create default admin user if not exists
-        password_hash = hashlib.sha256(DEFAULT_PASSWORD.encode()).hexdigest()
-        try:
-            c.execute('INSERT OR IGNORE INTO users (username, password_hash) VALUES (?, ?)', 
-                     (DEFAULT_USERNAME, password_hash))
-        except sqlite3.IntegrityError:
-            pass  # User already exists
+            # Create routers table
+            c.execute('''
+                CREATE TABLE IF NOT EXISTS routers (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT NOT NULL,
+                    host TEXT NOT NULL,
+                    port INTEGER DEFAULT 8728,
+                    username TEXT NOT NULL,
+                    password TEXT NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+                
+            # Create router status cache table
+            c.execute('''
+                CREATE TABLE IF NOT EXISTS router_status_cache (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    router_id INTEGER NOT NULL,
+                    status TEXT NOT NULL,
+                    last_checked INTEGER,
+                    router_info TEXT,
+                    FOREIGN KEY (router_id) REFERENCES routers (id)
+                )
+            ''')
+        
+            # Create users table for authentication
+            c.execute('''
+                CREATE TABLE IF NOT EXISTS users (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    username TEXT UNIQUE NOT NULL,
+                    password_hash TEXT NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+        
+            # Create default admin user if not exists
+            password_hash = hashlib.sha256(DEFAULT_PASSWORD.encode()).hexdigest()
+            try:
+                c.execute('INSERT OR IGNORE INTO users (username, password_hash) VALUES (?, ?)', 
+                         (DEFAULT_USERNAME, password_hash))
+            except sqlite3.IntegrityError:
+                pass  # User already exists
         
-        # Check if router_info column exists (for backward compatibility)
-        try:
-            c.execute("SELECT router_info FROM router_status_cache LIMIT 1")
-            print("Using existing router_info column")
-        except sqlite3.OperationalError:
-            # router_info column doesn't exist, check for info_json
+            # Check if router_info column exists (for backward compatibility)
             try:
-                c.execute("SELECT info_json FROM router_status_cache LIMIT 1")
-                print("Using existing info_json column")
+                c.execute("SELECT router_info FROM router_status_cache LIMIT 1")
+                print("Using existing router_info column")
             except sqlite3.OperationalError:
-                # Neither column exists, add router_info column
-                c.execute("ALTER TABLE router_status_cache ADD COLUMN router_info TEXT")
-                print("Added router_info column to router_status_cache table")
+                # router_info column doesn't exist, check for info_json
+                try:
+                    c.execute("SELECT info_json FROM router_status_cache LIMIT 1")
+                    print("Using existing info_json column")
+                except sqlite3.OperationalError:
+                    # Neither column exists, add router_info column
+                    c.execute("ALTER TABLE router_status_cache ADD COLUMN router_info TEXT")
+                    print("Added router_info column to router_status_cache table")
+        
+            # Create system logs table for storing router logs
+            c.execute('''
+                CREATE TABLE IF NOT EXISTS router_logs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    router_id INTEGER NOT NULL,
+                    timestamp TEXT NOT NULL,
+                    topics TEXT,
+                    message TEXT NOT NULL,
+                    severity TEXT,
+                    stored_at INTEGER,
+                    FOREIGN KEY (router_id) REFERENCES routers (id)
+                )
+            ''')
+        
+            # Per-router position in the RouterOS log buffer
+            c.execute(LOG_CURSOR_SCHEMA)
+        
+            # Per-router circuit breaker state
+            c.execute(BREAKER_SCHEMA)
+        
+            # Per-router raw bandwidth retention overrides
+            c.execute(BANDWIDTH_RETENTION_SCHEMA)
+        
+            # Hosts and interface names, referenced by id from the bandwidth tables
+            c.execute(HOST_SCHEMA)
+            c.execute(INTERFACE_SCHEMA)
+        
+            # Raw bandwidth samples live in day partitions; migrate the old tables (and text timestamps) in place
+            moved = migrate_legacy_tables(c)
+            if moved:
+                print(f"Moved {moved} raw bandwidth rows into day partitions")
+        
+            # Bandwidth rollup tiers (filled by the collector)
+            c.execute(IP_ROLLUP_SCHEMA)
+            c.execute(INTERFACE_ROLLUP_SCHEMA)
+                
+            # Create log retention settings table
+            c.execute('''
+                CREATE TABLE IF NOT EXISTS log_retention_settings (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    router_id INTEGER NOT NULL,
+                    retention_days INTEGER DEFAULT 7,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (router_id) REFERENCES routers (id)
+                )
+            ''')
+        
+            # Create index for faster queries
+            c.execute('CREATE INDEX IF NOT EXISTS idx_router_status_time ON router_status_cache (last_checked)')
+            c.execute('CREATE INDEX IF NOT EXISTS idx_router_logs_time ON router_logs (router_id, timestamp)')
+            # Retention deletes by storage time
+            c.execute('CREATE INDEX IF NOT EXISTS idx_router_logs_stored ON router_logs (router_id, stored_at)')
+            c.execute('CREATE INDEX IF NOT EXISTS idx_router_logs_severity ON router_logs (severity)')
         
-        # Create system logs table for storing router logs
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS router_logs (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                router_id INTEGER NOT NULL,
-                timestamp TEXT NOT NULL,
-                topics TEXT,
-                message TEXT NOT NULL,
-                severity TEXT,
-                stored_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (router_id) REFERENCES routers (id)
-            )
-        ''')
-        
-        # Create interface bandwidth data table
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS interface_bandwidth_data (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                router_id INTEGER NOT NULL,
-                interface_name TEXT NOT NULL,
-                rx_bytes INTEGER DEFAULT 0,
-                tx_bytes INTEGER DEFAULT 0,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (router_id) REFERENCES routers (id)
-            )
-        ''')
-        
-        # Create log retention settings table
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS log_retention_settings (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                router_id INTEGER NOT NULL,
-                retention_days INTEGER DEFAULT 7,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (router_id) REFERENCES routers (id)
-            )
-        ''')
-        
-        # Create index for faster queries
-        c.execute('CREATE INDEX IF NOT EXISTS idx_ip_bandwidth_router_time ON ip_bandwidth_data (router_id, timestamp)')
-        c.execute('CREATE INDEX IF NOT EXISTS idx_ip_bandwidth_ip ON ip_bandwidth_data (ip_address)')
-        c.execute('CREATE INDEX IF NOT EXISTS idx_ip_bandwidth_mac ON ip_bandwidth_data (mac_address)')
-        c.execute('CREATE INDEX IF NOT EXISTS idx_router_status_time ON router_status_cache (last_checked)')
-        c.execute('CREATE INDEX IF NOT EXISTS idx_router_logs_time ON router_logs (router_id, timestamp)')
-        c.execute('CREATE INDEX IF NOT EXISTS idx_router_logs_severity ON router_logs (severity)')
-        
-        conn.commit()
-        conn.close()
         print(f"Database initialized successfully at {db_path}")
         
     except Exception as e:
@@ -196,18 +227,29 @@ def init_db():
         raise
 
 # MikroTik API connection helper
-def connect_to_router(host, port, username, password):
-    """Safe connection with auto cleanup - TESTED ON 1000+ ROUTERS"""
+def connect_to_router(host, port, username, password, router_id=None):
+    """Safe connection with auto cleanup - TESTED ON 1000+ ROUTERS
+
+    With a ``router_id`` the session comes from the shared session pool and
+    ``connection.disconnect()`` hands it back instead of closing it, and the
+    router's circuit breaker is consulted so a dead router fails fast.
+    """
+    if router_id is not None and not router_breaker.allow(router_id):
+        retry_at = router_breaker.state(router_id)['retry_at']
+        wait = max(0, int((retry_at or time.time()) - time.time()))
+        return None, None, f"Router {host} is unreachable; next connection attempt in {wait}s."
     try:
+        if router_id is not None:
+            try:
+                api, connection = router_sessions.acquire(router_id, host, port, username, password)
+            except Exception as e:
+                router_breaker.record_failure(router_id, e)
+                raise
+            return api, connection, None
+        
         # Use EXACT, TESTED connection pattern that NEVER fails
-        connection = routeros_api.RouterOsApiPool(
-            host=host,
-            port=port,
-            username=username,
-            password=password,
-            plaintext_login=True,
-            use_ssl=False
-        )
+        # (or the asyncio engine when ROUTEROS_ENGINE=async)
+        connection = create_api_pool(host, port, username, password)
         api = connection.get_api()
         return api, connection, None
     except Exception as e:
@@ -225,14 +267,13 @@ def connect_to_router(host, port, username, password):
             return None, None, f"Connection failed: {error_msg}"
 
 def get_router_info(api):
+    snapshot = as_snapshot(api)
     try:
         # Get system identity
-        identity = api.get_resource('/system/identity')
-        router_name = identity.get()[0]['name'] if identity.get() else 'N/A'
+        router_name = snapshot.first('/system/identity').get('name', 'N/A')
         
         # Get system resources
-        resources = api.get_resource('/system/resource')
-        resource_data = resources.get()[0] if resources.get() else {}
+        resource_data = snapshot.first('/system/resource')
         
         # Debug log the available resource fields
         print(f"Available resource fields: {list(resource_data.keys())}")
@@ -336,21 +377,20 @@ def get_router_info(api):
         return {'error': str(e)}
 
 def get_detailed_router_info(api):
+    snapshot = as_snapshot(api)
     try:
         detailed_info = {}
         
         # Get system identity
         try:
-            identity = api.get_resource('/system/identity')
-            detailed_info['identity'] = identity.get()[0] if identity.get() else {}
+            detailed_info['identity'] = snapshot.first('/system/identity')
         except Exception as e:
             detailed_info['identity'] = {}
             print(f"Warning: Could not get system identity: {e}")
         
         # Get system resources
         try:
-            resources = api.get_resource('/system/resource')
-            resource_data = resources.get()[0] if resources.get() else {}
+            resource_data = snapshot.first('/system/resource')
             
             # Debug log available resource fields
             print(f"Detailed router info - Available resource fields: {list(resource_data.keys())}")
@@ -430,8 +470,7 @@ def get_detailed_router_info(api):
         
         # Get system clock and timezone
         try:
-            clock = api.get_resource('/system/clock')
-            clock_data = clock.get()[0] if clock.get() else {}
+            clock_data = snapshot.first('/system/clock')
             
             # Debug log available clock fields
             print(f"Available clock fields: {list(clock_data.keys())}")
@@ -454,24 +493,21 @@ def get_detailed_router_info(api):
         
         # Get IP addresses
         try:
-            ip_addresses = api.get_resource('/ip/address')
-            detailed_info['ip_addresses'] = ip_addresses.get() if ip_addresses.get() else []
+            detailed_info['ip_addresses'] = snapshot.get('/ip/address')
         except Exception as e:
             detailed_info['ip_addresses'] = []
             print(f"Warning: Could not get IP addresses: {e}")
         
         # Get interfaces
         try:
-            interfaces = api.get_resource('/interface')
-            detailed_info['interfaces'] = interfaces.get() if interfaces.get() else []
+            detailed_info['interfaces'] = snapshot.get('/interface')
         except Exception as e:
             detailed_info['interfaces'] = []
             print(f"Warning: Could not get interfaces: {e}")
         
         # Get DHCP leases (connected IPs)
         try:
-            dhcp_leases = api.get_resource('/ip/dhcp-server/lease')
-            detailed_info['dhcp_leases'] = dhcp_leases.get() if dhcp_leases.get() else []
+            detailed_info['dhcp_leases'] = snapshot.get('/ip/dhcp-server/lease')
             print(f"DHCP leases found: {len(detailed_info['dhcp_leases'])}")
             if detailed_info['dhcp_leases']:
                 print(f"Sample DHCP lease: {detailed_info['dhcp_leases'][0]}")
@@ -481,8 +517,7 @@ def get_detailed_router_info(api):
         
         # Get ARP table for MAC addresses and hostnames
         try:
-            arp = api.get_resource('/ip/arp')
-            arp_data = arp.get() if arp.get() else []
+            arp_data = snapshot.get('/ip/arp')
             detailed_info['arp_table'] = arp_data
             print(f"ARP entries found: {len(detailed_info['arp_table'])}")
             if detailed_info['arp_table']:
@@ -493,24 +528,21 @@ def get_detailed_router_info(api):
         
         # Get system health
         try:
-            health = api.get_resource('/system/health')
-            detailed_info['health'] = health.get()[0] if health.get() else {}
+            detailed_info['health'] = snapshot.first('/system/health')
         except Exception as e:
             detailed_info['health'] = {}
             print(f"Warning: Could not get system health: {e}")
         
         # Get license information
         try:
-            license_info = api.get_resource('/system/license')
-            detailed_info['license'] = license_info.get()[0] if license_info.get() else {}
+            detailed_info['license'] = snapshot.first('/system/license')
         except Exception as e:
             detailed_info['license'] = {}
             print(f"Warning: Could not get license information: {e}")
         
         # Get system logs
         try:
-            logs = api.get_resource('/log')
-            detailed_info['logs'] = logs.get() if logs.get() else []
+            detailed_info['logs'] = snapshot.get('/log')
             print(f"System logs found: {len(detailed_info['logs'])}")
         except Exception as e:
             detailed_info['logs'] = []
@@ -562,59 +594,13 @@ def get_log_statistics(logs):
     
     return stats
 
-def save_router_logs(router_id, logs):
-    """Save router logs to database"""
-    conn = sqlite3.connect(db_path)
-    c = conn.cursor()
-    
-    saved_count = 0
-    for log in logs:
-        timestamp = log.get('time', '')
-        topics = log.get('topics', '')
-        message = log.get('message', '')
-        
-        # Determine severity
-        message_lower = message.lower()
-        if 'critical' in message_lower or 'fatal' in message_lower or 'emergency' in message_lower:
-            severity = 'critical'
-        elif 'warning' in message_lower or 'warn' in message_lower:
-            severity = 'warning'
-        elif 'error' in message_lower or 'err' in message_lower:
-            severity = 'error'
-        elif 'info' in message_lower:
-            severity = 'info'
-        elif 'debug' in message_lower:
-            severity = 'debug'
-        else:
-            severity = 'other'
-        
-        # Check if log already exists (based on timestamp and message)
-        c.execute('SELECT id FROM router_logs WHERE router_id = ? AND timestamp = ? AND message = ?',
-                 (router_id, timestamp, message))
-        existing = c.fetchone()
-        
-        if not existing:
-            c.execute('''
-                INSERT INTO router_logs (router_id, timestamp, topics, message, severity)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (router_id, timestamp, topics, message, severity))
-            saved_count += 1
-    
-    conn.commit()
-    conn.close()
-    
-    print(f"Saved {saved_count} new logs for router {router_id}")
-    return saved_count
-
 def get_log_retention_settings(router_id):
     """Get log retention settings for a router"""
-    conn = sqlite3.connect(db_path)
-    c = conn.cursor()
-    
-    c.execute('SELECT retention_days FROM log_retention_settings WHERE router_id = ?', (router_id,))
-    result = c.fetchone()
+    with get_db_connection() as conn:
+        c = conn.cursor()
     
-    conn.close()
+        c.execute('SELECT retention_days FROM log_retention_settings WHERE router_id = ?', (router_id,))
+        result = c.fetchone()
     
     if result:
         return result[0]
@@ -624,73 +610,59 @@ def get_log_retention_settings(router_id):
 
 def update_log_retention_settings(router_id, retention_days):
     """Update log retention settings for a router"""
-    conn = sqlite3.connect(db_path)
-    c = conn.cursor()
-    
-    c.execute('''
-        INSERT OR REPLACE INTO log_retention_settings (router_id, retention_days)
-        VALUES (?, ?)
-    ''', (router_id, retention_days))
+    with get_db_connection(write=True) as conn:
+        c = conn.cursor()
     
-    conn.commit()
-    conn.close()
+        c.execute('''
+            INSERT OR REPLACE INTO log_retention_settings (router_id, retention_days)
+            VALUES (?, ?)
+        ''', (router_id, retention_days))
     
     print(f"Updated log retention to {retention_days} days for router {router_id}")
 
 def cleanup_old_logs(router_id):
     """Delete logs older than retention period"""
-    import datetime
-    
     retention_days = get_log_retention_settings(router_id)
-    cutoff_date = datetime.datetime.now() - datetime.timedelta(days=retention_days)
-    
-    conn = sqlite3.connect(db_path)
-    c = conn.cursor()
-    
-    # Convert cutoff_date to string format for comparison
-    cutoff_str = cutoff_date.strftime('%Y-%m-%d %H:%M:%S')
+    # stored_at is epoch seconds
+    cutoff = int(time.time() - retention_days * 86400)
     
-    c.execute('DELETE FROM router_logs WHERE router_id = ? AND stored_at < ?', 
-              (router_id, cutoff_str))
-    deleted_count = c.rowcount
-    
-    conn.commit()
-    conn.close()
+    with get_db_connection(write=True) as conn:
+        c = conn.cursor()
+        c.execute('DELETE FROM router_logs WHERE router_id = ? AND stored_at < ?', (router_id, cutoff))
+        deleted_count = c.rowcount
     
     print(f"Cleaned up {deleted_count} old logs for router {router_id} (retention: {retention_days} days)")
     return deleted_count
 
 def get_paginated_logs(router_id, page=1, per_page=50, severity_filter=None, search_term=None):
     """Get paginated logs with optional filtering"""
-    conn = sqlite3.connect(db_path)
-    c = conn.cursor()
-    
-    # Build query with filters
-    query = 'SELECT * FROM router_logs WHERE router_id = ?'
-    params = [router_id]
+    with get_db_connection() as conn:
+        c = conn.cursor()
     
-    if severity_filter and severity_filter != 'all':
-        query += ' AND severity = ?'
-        params.append(severity_filter)
+        # Build query with filters
+        query = 'SELECT * FROM router_logs WHERE router_id = ?'
+        params = [router_id]
     
-    if search_term:
-        query += ' AND (message LIKE ? OR topics LIKE ?)'
-        params.extend([f'%{search_term}%', f'%{search_term}%'])
+        if severity_filter and severity_filter != 'all':
+            query += ' AND severity = ?'
+            params.append(severity_filter)
     
-    # Get total count
-    count_query = query.replace('SELECT *', 'SELECT COUNT(*)')
-    c.execute(count_query, params)
-    total_logs = c.fetchone()[0]
+        if search_term:
+            query += ' AND (message LIKE ? OR topics LIKE ?)'
+            params.extend([f'%{search_term}%', f'%{search_term}%'])
     
-    # Add ordering and pagination
-    query += ' ORDER BY timestamp DESC LIMIT ? OFFSET ?'
-    offset = (page - 1) * per_page
-    params.extend([per_page, offset])
+        # Get total count
+        count_query = query.replace('SELECT *', 'SELECT COUNT(*)')
+        c.execute(count_query, params)
+        total_logs = c.fetchone()[0]
     
-    c.execute(query, params)
-    logs = c.fetchall()
+        # Add ordering and pagination
+        query += ' ORDER BY timestamp DESC LIMIT ? OFFSET ?'
+        offset = (page - 1) * per_page
+        params.extend([per_page, offset])
     
-    conn.close()
+        c.execute(query, params)
+        logs = c.fetchall()
     
     # Calculate pagination info
     total_pages = (total_logs + per_page - 1) // per_page
@@ -705,135 +677,15 @@ def get_paginated_logs(router_id, page=1, per_page=50, severity_filter=None, sea
         'has_next': page < total_pages
     }
 
-# Simple database context manager
+# Pooled database connections
 import sqlite3
 from contextlib import contextmanager
 
 @contextmanager
-def get_db_connection():
-    """Context manager for database connections"""
-    conn = sqlite3.connect(db_path)
-    try:
+def get_db_connection(write=False):
+    """Pooled connection for the block: query-only, or committed on success when ``write``"""
+    with (db.write() if write else db.read()) as conn:
         yield conn
-    finally:
-        conn.close()
-
-def collect_ip_bandwidth_data(router_id, api):
-    """OPTIMIZATION: Collect per-IP bandwidth data with heavy filtering"""
-    try:
-        # Get IP traffic data from firewall accounting
-        traffic_data = []
-        
-        # Try to get traffic from firewall accounting
-        try:
-            accounting = api.get_resource('/ip/accounting')
-            traffic_data = accounting.get() if accounting.get() else []
-        except Exception as e:
-            print(f"Could not get IP accounting data: {e}")
-        
-        # If no accounting data, try to get from connection tracking
-        if not traffic_data:
-            try:
-                connections = api.get_resource('/ip/firewall/connection')
-                connection_data = connections.get() if connections.get() else []
-                
-                # Convert connection data to traffic format
-                for conn in connection_data:
-                    if conn.get('src-address') and conn.get('dst-address'):
-                        # This is simplified - real implementation would need more complex tracking
-                        traffic_data.append({
-                            'src-address': conn['src-address'],
-                            'dst-address': conn['dst-address'],
-                            'bytes': conn.get('bytes', 0),
-                            'packets': conn.get('packets', 0)
-                        })
-            except Exception as e:
-                print(f"Could not get connection data: {e}")
-        
-        # Get ARP table for MAC addresses and hostnames
-        arp_table = {}
-        try:
-            arp = api.get_resource('/ip/arp')
-            arp_data = arp.get() if arp.get() else []
-            for entry in arp_data:
-                if entry.get('address'):
-                    arp_table[entry['address']] = {
-                        'mac_address': entry.get('mac-address'),
-                        'hostname': entry.get('host-name')
-                    }
-        except Exception as e:
-            print(f"Could not get ARP table: {e}")
-        
-        # Get DHCP leases to identify internal IPs
-        internal_ips = set()
-        try:
-            dhcp_leases = api.get_resource('/ip/dhcp-server/lease')
-            leases = dhcp_leases.get() if dhcp_leases.get() else []
-            for lease in leases:
-                if lease.get('address'):
-                    internal_ips.add(lease['address'])
-        except Exception as e:
-            print(f"Could not get DHCP leases: {e}")
-        
-        # Get static IP addresses
-        try:
-            ip_addresses = api.get_resource('/ip/address')
-            addresses = ip_addresses.get() if ip_addresses.get() else []
-            for addr in addresses:
-                if addr.get('address'):
-                    # Extract IP from CIDR notation (e.g., "192.168.1.1/24" -> "192.168.1.1")
-                    ip = addr['address'].split('/')[0]
-                    internal_ips.add(ip)
-        except Exception as e:
-            print(f"Could not get IP addresses: {e}")
-        
-        # OPTIMIZATION: Use batch database operations
-        with get_db_connection() as conn:
-            c = conn.cursor()
-            
-            # Track unique IPs and their traffic - focus on internal IPs
-            ip_traffic = {}
-            
-            for traffic in traffic_data:
-                # Track source IP traffic (only for internal IPs)
-                src_ip = traffic.get('src-address')
-                if src_ip and src_ip in internal_ips:
-                    # Extract just the IP without port
-                    src_ip_clean = src_ip.split(':')[0] if ':' in src_ip else src_ip
-                    if src_ip_clean not in ip_traffic:
-                        ip_traffic[src_ip_clean] = {'rx_bytes': 0, 'tx_bytes': 0}
-                    ip_traffic[src_ip_clean]['tx_bytes'] += int(traffic.get('bytes', 0))
-                
-                # Track destination IP traffic (only for internal IPs)
-                dst_ip = traffic.get('dst-address')
-                if dst_ip and dst_ip in internal_ips:
-                    # Extract just the IP without port
-                    dst_ip_clean = dst_ip.split(':')[0] if ':' in dst_ip else dst_ip
-                    if dst_ip_clean not in ip_traffic:
-                        ip_traffic[dst_ip_clean] = {'rx_bytes': 0, 'tx_bytes': 0}
-                    ip_traffic[dst_ip_clean]['rx_bytes'] += int(traffic.get('bytes', 0))
-            
-            # OPTIMIZATION: Batch insert for better performance
-            batch_data = []
-            for ip, traffic in ip_traffic.items():
-                arp_info = arp_table.get(ip, {})
-                batch_data.append((
-                    router_id, ip, arp_info.get('mac_address'), 
-                    arp_info.get('hostname'), traffic['rx_bytes'], traffic['tx_bytes']
-                ))
-            
-            if batch_data:
-                c.executemany('''
-                    INSERT INTO ip_bandwidth_data (router_id, ip_address, mac_address, hostname, rx_bytes, tx_bytes)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                ''', batch_data)
-            
-            conn.commit()
-        print(f"Collected IP bandwidth data for {len(ip_traffic)} internal IPs on router {router_id}")
-        return True
-    except Exception as e:
-        print(f"Error collecting IP bandwidth data: {e}")
-        return False
 
 def hash_password(password):
     return hashlib.sha256(password.encode()).hexdigest()
@@ -851,10 +703,9 @@ def login_required(f):
 
 def update_router_status_cache(router_id, name, host, port, username, password):
     """Update router status cache for faster dashboard loading"""
-    from datetime import datetime
     import json
     
-    api, connection, error = connect_to_router(host, port, username, password)
+    api, connection, error = connect_to_router(host, port, username, password, router_id=router_id)
     
     if api:
         info = get_router_info(api)
@@ -865,59 +716,40 @@ def update_router_status_cache(router_id, name, host, port, username, password):
         status = 'offline'
         router_info = json.dumps({'error': error or 'Connection failed'})
     
-    conn = sqlite3.connect(db_path)
-    c = conn.cursor()
-    c.execute('''
-        INSERT OR REPLACE INTO router_status_cache (router_id, status, last_checked, router_info)
-        VALUES (?, ?, ?, ?)
-    ''', (router_id, status, datetime.now(), router_info))
-    conn.commit()
-    conn.close()
+    with get_db_connection(write=True) as conn:
+        c = conn.cursor()
+        c.execute('''
+            INSERT OR REPLACE INTO router_status_cache (router_id, status, last_checked, router_info)
+            VALUES (?, ?, ?, ?)
+        ''', (router_id, status, int(time.time()), router_info))
     
     return status, router_info
 
-def get_ip_bandwidth_stats(router_id, time_periods):
-    """Get per-IP bandwidth statistics for specified time periods - Zabbix-like intervals"""
-    import datetime
-    
+def get_ip_bandwidth_stats(router_id, time_periods, limit=None):
+    """Get per-IP bandwidth statistics for specified time periods - Zabbix-like intervals.
+
+    Totals come from the running sums of the top talkers engine (the
+    periods are its ``WINDOWS``), or with ``TOP_TALKERS_ENABLED=0`` from
+    one range read per source for all periods; ``limit`` keeps only the
+    busiest IPs.
+    """
     stats = {}
-    conn = sqlite3.connect(db_path)
-    c = conn.cursor()
-    
-    # Define time periods in minutes (Zabbix-like intervals)
-    periods = {
-        '1m': 1,
-        '5m': 5,
-        '15m': 15,
-        '30m': 30,
-        '1h': 60,
-        '3h': 180,
-        '6h': 360,
-        '12h': 720,
-        '24h': 1440,
-        '3d': 4320,
-        '1w': 10080
-    }
+    periods = {name: minutes * 60 for name, minutes in WINDOWS.items() if name in time_periods}
     
-    for period_name, period_minutes in periods.items():
-        if period_name in time_periods:
-            # Calculate time threshold
-            threshold = datetime.datetime.now() - datetime.timedelta(minutes=period_minutes)
-            
-            # Get per-IP bandwidth data for this period
-            c.execute('''
-                SELECT ip_address, mac_address, hostname, 
-                       SUM(rx_bytes) as total_rx, SUM(tx_bytes) as total_tx
-                FROM ip_bandwidth_data 
-                WHERE router_id = ? AND timestamp >= ?
-                GROUP BY ip_address
-                ORDER BY total_rx + total_tx DESC
-            ''', (router_id, threshold))
-            
+    with get_db_connection() as conn:
+        if TOP_TALKERS_ENABLED:
+            # Per-host totals of each window, kept up to date in memory
+            totals_by_period = {name: talkers.totals(conn, router_id, name) for name in periods}
+        else:
+            # Every period in one pass: conditional sums over the widest window of each source
+            totals_by_period = host_totals_by_window(conn, router_id, periods, archive=archive)
+        
+        for period_name, totals in totals_by_period.items():
+            # Resolve host ids through the cached catalog and add them up per IP
             period_stats = {}
-            for row in c.fetchall():
+            for row in catalog.totals_by_ip(totals, limit):
                 ip_address, mac_address, hostname, total_rx, total_tx = row
-                
+            
                 period_stats[ip_address] = {
                     'mac_address': mac_address,
                     'hostname': hostname,
@@ -926,23 +758,30 @@ def get_ip_bandwidth_stats(router_id, time_periods):
                     'rx_mb': (total_rx / 1024 / 1024) if total_rx else 0,
                     'tx_mb': (total_tx / 1024 / 1024) if total_tx else 0
                 }
-            
+        
             stats[period_name] = period_stats
     
-    conn.close()
     return stats
 
+def warm_top_talkers():
+    """Load the running totals of every router from the database"""
+    try:
+        with get_db_connection() as conn:
+            warmed = talkers.warm(conn)
+        print(f"Top talkers warmed for {warmed} routers")
+    except Exception as e:
+        print(f"Could not warm top talkers: {e}")
+
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
         
-        conn = sqlite3.connect(db_path)
-        c = conn.cursor()
-        c.execute('SELECT id, username, password_hash FROM users WHERE username = ?', (username,))
-        user = c.fetchone()
-        conn.close()
+        with get_db_connection() as conn:
+            c = conn.cursor()
+            c.execute('SELECT id, username, password_hash FROM users WHERE username = ?', (username,))
+            user = c.fetchone()
         
         if user and verify_password(password, user[2]):
             session['user_id'] = user[0]
@@ -982,21 +821,19 @@ def change_password():
             return render_template('change_password.html')
         
         # Verify current password
-        conn = sqlite3.connect(db_path)
-        c = conn.cursor()
-        c.execute('SELECT password_hash FROM users WHERE id = ?', (session['user_id'],))
-        user = c.fetchone()
+        with get_db_connection() as conn:
+            c = conn.cursor()
+            c.execute('SELECT password_hash FROM users WHERE id = ?', (session['user_id'],))
+            user = c.fetchone()
         
         if not user or not verify_password(current_password, user[0]):
             flash('Current password is incorrect', 'error')
-            conn.close()
             return render_template('change_password.html')
         
         # Update password
         new_password_hash = hash_password(new_password)
-        c.execute('UPDATE users SET password_hash = ? WHERE id = ?', (new_password_hash, session['user_id']))
-        conn.commit()
-        conn.close()
+        with get_db_connection(write=True) as conn:
+            conn.execute('UPDATE users SET password_hash = ? WHERE id = ?', (new_password_hash, session['user_id']))
         
         flash('Password changed successfully!', 'success')
         return redirect(url_for('index'))
@@ -1010,16 +847,15 @@ def index():
         return redirect(url_for('login'))
     
     # Show dashboard if authenticated
-    conn = sqlite3.connect(db_path)
-    c = conn.cursor()
-    c.execute('SELECT * FROM routers ORDER BY created_at DESC')
-    routers = c.fetchall()
-    conn.close()
+    with get_db_connection() as conn:
+        c = conn.cursor()
+        c.execute('SELECT * FROM routers ORDER BY created_at DESC')
+        routers = c.fetchall()
     
     router_data = []
     for router in routers:
         router_id, name, host, port, username, password, created_at = router
-        api, connection, error = connect_to_router(host, port, username, password)
+        api, connection, error = connect_to_router(host, port, username, password, router_id=router_id)
         
         if api:
             info = get_router_info(api)
@@ -1075,12 +911,10 @@ def add_router():
         api, connection, error = connect_to_router(host, port, username, password)
         if api:
             # Connection successful, save to database
-            conn = sqlite3.connect(db_path)
-            c = conn.cursor()
-            c.execute('INSERT INTO routers (name, host, port, username, password) VALUES (?, ?, ?, ?, ?)',
-                     (name, host, port, username, password))
-            conn.commit()
-            conn.close()
+            with get_db_connection(write=True) as conn:
+                c = conn.cursor()
+                c.execute('INSERT INTO routers (name, host, port, username, password) VALUES (?, ?, ?, ?, ?)',
+                         (name, host, port, username, password))
             connection.disconnect()
             flash('Router connected and added successfully!', 'success')
             return redirect(url_for('index'))
@@ -1092,25 +926,26 @@ def add_router():
 @app.route('/delete_router/<int:router_id>')
 @login_required
 def delete_router(router_id):
-    conn = sqlite3.connect(db_path)
-    c = conn.cursor()
-    c.execute('DELETE FROM routers WHERE id = ?', (router_id,))
-    conn.commit()
-    conn.close()
+    with get_db_connection(write=True) as conn:
+        c = conn.cursor()
+        c.execute('DELETE FROM routers WHERE id = ?', (router_id,))
+    router_sessions.close_router(router_id)
+    talkers.forget(router_id)
     flash('Router deleted successfully!', 'success')
     return redirect(url_for('index'))
 
 @app.route('/refresh_router/<int:router_id>')
 @login_required
 def refresh_router(router_id):
-    conn = sqlite3.connect(db_path)
-    c = conn.cursor()
-    c.execute('SELECT * FROM routers WHERE id = ?', (router_id,))
-    router = c.fetchone()
-    conn.close()
+    with get_db_connection() as conn:
+        c = conn.cursor()
+        c.execute('SELECT * FROM routers WHERE id = ?', (router_id,))
+        router = c.fetchone()
     
     if router:
         router_id, name, host, port, username, password, created_at = router
+        # An explicit refresh always tries the router, even if its breaker is open
+        router_breaker.reset(router_id)
         status, router_info = update_router_status_cache(router_id, name, host, port, username, password)
         
         if status == 'online':
@@ -1125,19 +960,20 @@ def refresh_router(router_id):
 def monitor_router(router_id):
     # Get selected time period from query parameter, default to 1h
     selected_period = request.args.get('period', '1h')
+    # Optionally only the busiest IPs
+    limit = request.args.get('limit', type=int)
     
-    conn = sqlite3.connect(db_path)
-    c = conn.cursor()
-    c.execute('SELECT * FROM routers WHERE id = ?', (router_id,))
-    router = c.fetchone()
-    conn.close()
+    with get_db_connection() as conn:
+        c = conn.cursor()
+        c.execute('SELECT * FROM routers WHERE id = ?', (router_id,))
+        router = c.fetchone()
     
     if not router:
         flash('Router not found', 'error')
         return redirect(url_for('index'))
     
     router_id, name, host, port, username, password, created_at = router
-    api, connection, error = connect_to_router(host, port, username, password)
+    api, connection, error = connect_to_router(host, port, username, password, router_id=router_id)
     
     if api:
         # Get detailed router information for the monitor page
@@ -1153,7 +989,7 @@ def monitor_router(router_id):
             return redirect(url_for('index'))
         
         # Get per-IP bandwidth statistics for selected time period only
-        bandwidth_stats = get_ip_bandwidth_stats(router_id, [selected_period])
+        bandwidth_stats = get_ip_bandwidth_stats(router_id, [selected_period], limit)
         
         # Define available time periods for dropdown
         time_periods = [
@@ -1188,29 +1024,33 @@ def api_monitor_router(router_id):
     """API endpoint for refreshing router monitor data"""
     # Get selected time period from query parameter, default to 1h
     selected_period = request.args.get('period', '1h')
+    # Optionally only the busiest IPs
+    limit = request.args.get('limit', type=int)
     
-    conn = sqlite3.connect(db_path)
-    c = conn.cursor()
-    c.execute('SELECT * FROM routers WHERE id = ?', (router_id,))
-    router = c.fetchone()
-    conn.close()
+    with get_db_connection() as conn:
+        c = conn.cursor()
+        c.execute('SELECT * FROM routers WHERE id = ?', (router_id,))
+        router = c.fetchone()
     
     if not router:
         return jsonify({'success': False, 'error': 'Router not found'}), 404
     
     router_id, name, host, port, username, password, created_at = router
-    api, connection, error = connect_to_router(host, port, username, password)
+    api, connection, error = connect_to_router(host, port, username, password, router_id=router_id)
     
     if api:
         try:
+            # Both helpers read identity/resources; fetch each path once
+            snapshot = RouterSnapshot(api, router_id)
+            
             # Get updated system information
-            system_info = get_router_info(api)
+            system_info = get_router_info(snapshot)
             
             # Get updated detailed information
-            detailed_info = get_detailed_router_info(api)
+            detailed_info = get_detailed_router_info(snapshot)
             
             # Get updated bandwidth statistics
-            bandwidth_stats = get_ip_bandwidth_stats(router_id, [selected_period])
+            bandwidth_stats = get_ip_bandwidth_stats(router_id, [selected_period], limit)
             
             connection.disconnect()
             
@@ -1234,8 +1074,8 @@ def api_monitor_router(router_id):
     else:
         return jsonify({'success': False, 'error': error}), 500
 
-def get_ip_bandwidth_history(router_id, ip_address, time_period):
-    """Get historical bandwidth data for a specific IP address for charting"""
+def get_ip_bandwidth_history(router_id, ip_address, time_period, max_points=None):
+    """Get historical bandwidth data for a specific IP address for charting, thinned to max_points"""
     import datetime
     
     # Define time periods in minutes
@@ -1253,61 +1093,36 @@ def get_ip_bandwidth_history(router_id, ip_address, time_period):
         return {'error': 'Invalid time period'}
     
     period_minutes = periods[time_period]
-    threshold = (datetime.datetime.now() - datetime.timedelta(minutes=period_minutes)).strftime('%Y-%m-%d %H:%M:%S')
-    
-    print(f"Chart query: router_id={router_id}, ip={ip_address}, period={time_period}, threshold={threshold}")
+    since = time.time() - period_minutes * 60
     
-    conn = sqlite3.connect(db_path)
-    c = conn.cursor()
+    print(f"Chart query: router_id={router_id}, ip={ip_address}, period={time_period}, "
+          f"since={format_timestamp(since)} UTC")
     
     try:
-        # Get raw data points without aggregation
-        query = '''
-            SELECT 
-                timestamp,
-                rx_bytes,
-                tx_bytes
-            FROM ip_bandwidth_data 
-            WHERE router_id = ? AND ip_address = ? AND timestamp >= ?
-            ORDER BY timestamp
-        '''
-        print("Executing raw data query")
-        c.execute(query, (router_id, ip_address, threshold))
-        
-        data_points = []
-        rows = c.fetchall()
-        print(f"Query returned {len(rows)} raw data rows")
-        
-        # Calculate Mbps rates from raw data
-        for i, row in enumerate(rows):
-            timestamp, rx_bytes, tx_bytes = row
-            
-            # For the first data point, we can't calculate rate, so use 0
-            if i == 0:
-                download_mbps = 0
-                upload_mbps = 0
-            else:
-                # Calculate time difference in seconds
-                prev_time = datetime.datetime.strptime(rows[i-1][0], '%Y-%m-%d %H:%M:%S')
-                curr_time = datetime.datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S')
-                time_diff_seconds = (curr_time - prev_time).total_seconds()
-                
-                if time_diff_seconds > 0:
-                    # Calculate Mbps: (bytes * 8 bits/byte) / time_in_seconds / 1,000,000 bits per megabit
-                    download_mbps = ((rx_bytes or 0) * 8) / time_diff_seconds / 1000000
-                    upload_mbps = ((tx_bytes or 0) * 8) / time_diff_seconds / 1000000
-                else:
-                    download_mbps = 0
-                    upload_mbps = 0
-            
-            data_points.append({
-                'timestamp': timestamp,
-                'download_mbps': download_mbps,
-                'upload_mbps': upload_mbps,
-                'total_mbps': download_mbps + upload_mbps
-            })
-        
-        print(f"Processed {len(data_points)} data points for chart")
+        # An IP seen with several MACs/hostnames has one host id for each
+        host_ids = catalog.host_ids_for_ip(ip_address)
+        # Rollups unless the chart shows more points than they have (raw samples reach back to the archive's end)
+        tier = chart_tier(period_minutes * 60, max_points, BANDWIDTH_ARCHIVE_RETENTION_DAYS)
+        if tier:
+            # One point per rollup bucket: bytes moved in the bucket over its length
+            with get_db_connection() as conn:
+                rows = host_history(conn, router_id, host_ids, tier, since)
+            print(f"Query returned {len(rows)} {tier.name} rollup rows")
+            times, rx_bytes, tx_bytes = history_arrays(rows, 3)
+            download, upload = bucket_rates(rx_bytes, tx_bytes, tier.seconds)
+        else:
+            # Get raw data points without aggregation from the day partitions (and archived days) in range
+            print("Executing raw data query")
+            with get_db_connection() as conn:
+                rows = raw_host_history(conn, router_id, host_ids, since, archive)
+            print(f"Query returned {len(rows)} raw data rows")
+            # Bytes of each poll over the seconds since the previous one (0 for the first)
+            times, rx_bytes, tx_bytes = history_arrays(rows, 3)
+            download, upload = counter_rates(times, rx_bytes, tx_bytes)
+        
+        # Long series are thinned on the arrays (LTTB) before any point dict is built
+        data_points = chart_points(times, download, upload, max_points)
+        print(f"Processed {len(data_points)} data points for chart (of {len(times)})")
         
         # If we have no data or only zeros, create some sample data for testing
         if not data_points or all(p['download_mbps'] == 0 and p['upload_mbps'] == 0 for p in data_points):
@@ -1324,55 +1139,48 @@ def get_ip_bandwidth_history(router_id, ip_address, time_period):
                 })
             data_points.reverse()  # Put in chronological order
         
-        conn.close()
         return data_points
         
     except Exception as e:
         print(f"Error in get_ip_bandwidth_history: {e}")
         import traceback
         traceback.print_exc()
-        conn.close()
         raise
 
 def get_router_connections(router_id):
     """Get real-time connection data for a router including internal IPs, clients, and upstream connections"""
-    conn = sqlite3.connect(db_path)
-    c = conn.cursor()
-    c.execute('SELECT * FROM routers WHERE id = ?', (router_id,))
-    router = c.fetchone()
-    conn.close()
+    with get_db_connection() as conn:
+        c = conn.cursor()
+        c.execute('SELECT * FROM routers WHERE id = ?', (router_id,))
+        router = c.fetchone()
     
     if not router:
         return {'error': 'Router not found'}
     
     router_id, name, host, port, username, password, created_at = router
-    api, connection, error = connect_to_router(host, port, username, password)
+    api, connection, error = connect_to_router(host, port, username, password, router_id=router_id)
     
     if not api:
         return {'error': error or 'Failed to connect to router'}
     
     try:
+        snapshot = RouterSnapshot(api, router_id)
         connections_data = []
         
         # Get IP addresses to identify internal interfaces
-        ip_addresses = api.get_resource('/ip/address')
-        ip_data = ip_addresses.get() if ip_addresses.get() else []
+        ip_data = snapshot.get('/ip/address')
         
         # Get DHCP leases for connected clients
-        dhcp_leases = api.get_resource('/ip/dhcp-server/lease')
-        leases_data = dhcp_leases.get() if dhcp_leases.get() else []
+        leases_data = snapshot.get('/ip/dhcp-server/lease')
         
         # Get ARP table for MAC addresses and connection status
-        arp_table = api.get_resource('/ip/arp')
-        arp_data = arp_table.get() if arp_table.get() else []
+        arp_data = snapshot.get('/ip/arp')
         
         # Get routes to identify upstream connections
-        routes = api.get_resource('/ip/route')
-        routes_data = routes.get() if routes.get() else []
+        routes_data = snapshot.get('/ip/route')
         
         # Get interfaces for additional info
-        interfaces = api.get_resource('/interface')
-        interfaces_data = interfaces.get() if interfaces.get() else []
+        interfaces_data = snapshot.get('/interface')
         
         # Process each internal IP address
         for ip_addr in ip_data:
@@ -1469,10 +1277,8 @@ def get_router_connections(router_id):
             connection.disconnect()
         return {'error': str(e)}
 
-def get_interface_bandwidth_data(router_id, time_period):
-    """Get interface bandwidth statistics for charting"""
-    import datetime
-    
+def get_interface_bandwidth_data(router_id, time_period, max_points=None):
+    """Get interface bandwidth statistics for charting, each series thinned to max_points"""
     # Define time periods in minutes
     periods = {
         '1h': 60,
@@ -1488,98 +1294,42 @@ def get_interface_bandwidth_data(router_id, time_period):
         return {'error': 'Invalid time period'}
     
     period_minutes = periods[time_period]
-    threshold = (datetime.datetime.now() - datetime.timedelta(minutes=period_minutes)).strftime('%Y-%m-%d %H:%M:%S')
-    
-    print(f"Interface chart query: router_id={router_id}, period={time_period}, threshold={threshold}")
+    since = time.time() - period_minutes * 60
     
-    conn = sqlite3.connect(db_path)
-    c = conn.cursor()
+    print(f"Interface chart query: router_id={router_id}, period={time_period}, since={format_timestamp(since)} UTC")
     
     try:
-        # Get raw interface data without aggregation
-        query = '''
-            SELECT 
-                interface_name,
-                timestamp,
-                rx_bytes,
-                tx_bytes
-            FROM interface_bandwidth_data 
-            WHERE router_id = ? AND timestamp >= ?
-            ORDER BY interface_name, timestamp
-        '''
-        print("Executing raw interface data query")
-        c.execute(query, (router_id, threshold))
-        
-        # Organize data by interface
+        # Rollups unless the chart shows more points than they have (raw samples reach back to the archive's end)
+        tier = chart_tier(period_minutes * 60, max_points, BANDWIDTH_ARCHIVE_RETENTION_DAYS)
+        if tier:
+            # Rollup buckets hold real per-interface deltas: one point per bucket
+            with get_db_connection() as conn:
+                rows = interface_history(conn, router_id, tier, since)
+            print(f"Interface query returned {len(rows)} {tier.name} rollup rows")
+            interface_ids, times, rx_bytes, tx_bytes = history_arrays(rows, 4, ints=2)
+            download, upload = bucket_rates(rx_bytes, tx_bytes, tier.seconds)
+        else:
+            # Raw rows already hold each poll's rates (bits per second), so this is a plain range read
+            print("Executing raw interface data query")
+            with get_db_connection() as conn:
+                rows = raw_interface_history(conn, router_id, since, archive)
+            print(f"Interface query returned {len(rows)} raw data rows")
+            interface_ids, times, rx_bps, tx_bps = history_arrays(rows, 4, ints=2)
+            download, upload = rx_bps / BITS_PER_MEGABIT, tx_bps / BITS_PER_MEGABIT
+        
+        # Rows come grouped by interface: one series each, thinned to max_points (LTTB)
         interface_data = {}
-        rows = c.fetchall()
-        print(f"Interface query returned {len(rows)} raw data rows")
-        
-        # Group rows by interface
-        interface_rows = {}
-        for row in rows:
-            interface_name, timestamp, rx_bytes, tx_bytes = row
-            if interface_name not in interface_rows:
-                interface_rows[interface_name] = []
-            interface_rows[interface_name].append((timestamp, rx_bytes, tx_bytes))
-        
-        # Calculate Mbps rates for each interface from raw data
-        for interface_name, iface_rows in interface_rows.items():
-            interface_data[interface_name] = []
-            
-            for i, row in enumerate(iface_rows):
-                timestamp, rx_bytes, tx_bytes = row
-                
-                # For the first data point, we can't calculate rate, so use 0
-                if i == 0:
-                    download_mbps = 0
-                    upload_mbps = 0
-                else:
-                    # Calculate time difference in seconds
-                    prev_time = datetime.datetime.strptime(iface_rows[i-1][0], '%Y-%m-%d %H:%M:%S')
-                    curr_time = datetime.datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S')
-                    time_diff_seconds = (curr_time - prev_time).total_seconds()
-                    
-                    if time_diff_seconds > 0:
-                        # Calculate Mbps: (bytes * 8 bits/byte) / time_in_seconds / 1,000,000 bits per megabit
-                        download_mbps = ((rx_bytes or 0) * 8) / time_diff_seconds / 1000000
-                        upload_mbps = ((tx_bytes or 0) * 8) / time_diff_seconds / 1000000
-                    else:
-                        download_mbps = 0
-                        upload_mbps = 0
-                
-                interface_data[interface_name].append({
-                    'timestamp': timestamp,
-                    'download_mbps': download_mbps,
-                    'upload_mbps': upload_mbps,
-                    'total_mbps': download_mbps + upload_mbps
-                })
-            
-            print(f"Interface {interface_name}: processed {len(interface_data[interface_name])} data points")
-            
-            # If we have no data or only zeros, create some sample data for testing
-            if not interface_data[interface_name] or all(p['download_mbps'] == 0 and p['upload_mbps'] == 0 for p in interface_data[interface_name]):
-                print(f"No valid data found for interface {interface_name}, generating sample data")
-                # Generate some sample data for testing
-                sample_time = datetime.datetime.now()
-                for i in range(10):
-                    sample_time = sample_time - datetime.timedelta(minutes=5)
-                    interface_data[interface_name].append({
-                        'timestamp': sample_time.strftime('%Y-%m-%d %H:%M:00'),
-                        'download_mbps': 30.6 + (i * 0.5),  # Sample download data
-                        'upload_mbps': 2.16 + (i * 0.1),    # Sample upload data
-                        'total_mbps': 32.76 + (i * 0.6)     # Sample total data
-                    })
-                interface_data[interface_name].reverse()  # Put in chronological order
+        for interface_id, series_times, series_download, series_upload in split_series(
+                interface_ids, times, download, upload):
+            interface_data.setdefault(catalog.interface_name(interface_id), []).extend(
+                chart_points(series_times, series_download, series_upload, max_points))
         
-        conn.close()
         return interface_data
         
     except Exception as e:
         print(f"Error in get_interface_bandwidth_data: {e}")
         import traceback
         traceback.print_exc()
-        conn.close()
         return {}
 
 @app.route('/update_log_retention/<int:router_id>', methods=['POST'])
@@ -1614,33 +1364,29 @@ def export_logs_csv(router_id):
     severity_filter = request.args.get('severity', 'all')
     search_term = request.args.get('search', '')
     
-    conn = sqlite3.connect(db_path)
-    c = conn.cursor()
+    with get_db_connection() as conn:
+        c = conn.cursor()
     
-    # Build query with filters
-    query = 'SELECT timestamp, topics, message, severity, stored_at FROM router_logs WHERE router_id = ?'
-    params = [router_id]
+        # Build query with filters
+        query = 'SELECT timestamp, topics, message, severity, stored_at FROM router_logs WHERE router_id = ?'
+        params = [router_id]
     
-    if severity_filter and severity_filter != 'all':
-        query += ' AND severity = ?'
-        params.append(severity_filter)
+        if severity_filter and severity_filter != 'all':
+            query += ' AND severity = ?'
+            params.append(severity_filter)
     
-    if search_term:
-        query += ' AND (message LIKE ? OR topics LIKE ?)'
-        params.extend([f'%{search_term}%', f'%{search_term}%'])
+        if search_term:
+            query += ' AND (message LIKE ? OR topics LIKE ?)'
+            params.extend([f'%{search_term}%', f'%{search_term}%'])
     
-    query += ' ORDER BY timestamp DESC'
+        query += ' ORDER BY timestamp DESC'
     
-    c.execute(query, params)
-    logs = c.fetchall()
-    conn.close()
+        c.execute(query, params)
+        logs = c.fetchall()
     
-    # Get router name for filename
-    conn = sqlite3.connect(db_path)
-    c = conn.cursor()
-    c.execute('SELECT name FROM routers WHERE id = ?', (router_id,))
-    router_name = c.fetchone()[0]
-    conn.close()
+        # Get router name for filename
+        c.execute('SELECT name FROM routers WHERE id = ?', (router_id,))
+        router_name = c.fetchone()[0]
     
     # Create CSV in memory
     output = io.StringIO()
@@ -1652,7 +1398,8 @@ def export_logs_csv(router_id):
     # Write data
     for log in logs:
         timestamp, topics, message, severity, stored_at = log
-        writer.writerow([timestamp, topics, message, severity, stored_at, router_name])
+        writer.writerow([timestamp, topics, message, severity,
+                         format_timestamp(stored_at) if stored_at is not None else '', router_name])
     
     # Prepare response
     output.seek(0)
@@ -1676,6 +1423,7 @@ def api_chart_bandwidth(router_id):
     """API endpoint for bandwidth chart data"""
     ip_address = request.args.get('ip')
     time_period = request.args.get('period', '1h')
+    max_points = chart_max_points(request.args.get('max_points', type=int))
     
     print(f"Chart API called: router_id={router_id}, ip={ip_address}, period={time_period}")
     
@@ -1683,7 +1431,7 @@ def api_chart_bandwidth(router_id):
         return jsonify({'success': False, 'error': 'IP address parameter required'}), 400
     
     try:
-        chart_data = get_ip_bandwidth_history(router_id, ip_address, time_period)
+        chart_data = get_ip_bandwidth_history(router_id, ip_address, time_period, max_points)
         print(f"Chart data retrieved: {len(chart_data) if chart_data else 0} points")
         
         # Check if we have any data
@@ -1714,6 +1462,7 @@ def api_chart_interface_bandwidth(router_id):
     """API endpoint for interface bandwidth chart data"""
     interface_name = request.args.get('interface')
     time_period = request.args.get('period', '1h')
+    max_points = chart_max_points(request.args.get('max_points', type=int))
     
     print(f"Interface chart API called: router_id={router_id}, interface={interface_name}, period={time_period}")
     
@@ -1721,7 +1470,7 @@ def api_chart_interface_bandwidth(router_id):
         return jsonify({'success': False, 'error': 'Interface name parameter required'}), 400
     
     try:
-        interface_data = get_interface_bandwidth_data(router_id, time_period)
+        interface_data = get_interface_bandwidth_data(router_id, time_period, max_points)
         
         if interface_name in interface_data:
             chart_data = interface_data[interface_name]
@@ -1778,12 +1527,12 @@ def connections_page(router_id):
     # Get query parameters
     page = request.args.get('page', 1, type=int)
     sort_by = request.args.get('sort', 'download_desc')
+    min_bytes = request.args.get('min_bytes', 0, type=int)
     
-    conn = sqlite3.connect(db_path)
-    c = conn.cursor()
-    c.execute('SELECT * FROM routers WHERE id = ?', (router_id,))
-    router = c.fetchone()
-    conn.close()
+    with get_db_connection() as conn:
+        c = conn.cursor()
+        c.execute('SELECT * FROM routers WHERE id = ?', (router_id,))
+        router = c.fetchone()
     
     if not router:
         flash('Router not found', 'error')
@@ -1792,7 +1541,7 @@ def connections_page(router_id):
     router_id, name, host, port, username, password, created_at = router
     
     # Get connection data
-    connections_data = get_live_firewall_connections(router_id)
+    connections_data = get_live_firewall_connections(router_id, min_bytes)
     
     if 'error' not in connections_data:
         # Apply sorting
@@ -1838,7 +1587,8 @@ def connections_page(router_id):
 def api_connections(router_id):
     """API endpoint for connections page data"""
     try:
-        connections_data = get_live_firewall_connections(router_id)
+        min_bytes = request.args.get('min_bytes', 0, type=int)
+        connections_data = get_live_firewall_connections(router_id, min_bytes)
         
         if 'error' in connections_data:
             return jsonify({
@@ -1889,11 +1639,10 @@ def router_logs(router_id):
     severity_filter = request.args.get('severity', 'all')
     search_term = request.args.get('search', '')
     
-    conn = sqlite3.connect(db_path)
-    c = conn.cursor()
-    c.execute('SELECT * FROM routers WHERE id = ?', (router_id,))
-    router = c.fetchone()
-    conn.close()
+    with get_db_connection() as conn:
+        c = conn.cursor()
+        c.execute('SELECT * FROM routers WHERE id = ?', (router_id,))
+        router = c.fetchone()
     
     if not router:
         flash('Router not found', 'error')
@@ -1902,15 +1651,11 @@ def router_logs(router_id):
     router_id, name, host, port, username, password, created_at = router
     
     # Try to get fresh logs from router
-    api, connection, error = connect_to_router(host, port, username, password)
+    api, connection, error = connect_to_router(host, port, username, password, router_id=router_id)
     if api:
         try:
-            # Get system logs from router
-            logs_resource = api.get_resource('/log')
-            fresh_logs = logs_resource.get() if logs_resource.get() else []
-            
-            # Save fresh logs to database
-            saved_count = save_router_logs(router_id, fresh_logs)
+            # Fetch and save only the log lines newer than the stored cursor
+            saved_count = collect_new_logs(db, router_id, RouterSnapshot(api, router_id))
             
             # Clean up old logs based on retention settings
             cleanup_old_logs(router_id)
@@ -1928,26 +1673,24 @@ def router_logs(router_id):
     pagination_data = get_paginated_logs(router_id, page, 50, severity_filter, search_term)
     
     # Get log statistics from database
-    conn = sqlite3.connect(db_path)
-    c = conn.cursor()
-    
-    # Get total statistics
-    c.execute('SELECT COUNT(*) FROM router_logs WHERE router_id = ?', (router_id,))
-    total_logs = c.fetchone()[0]
+    with get_db_connection() as conn:
+        c = conn.cursor()
     
-    # Get severity statistics
-    c.execute('SELECT severity, COUNT(*) FROM router_logs WHERE router_id = ? GROUP BY severity', (router_id,))
-    severity_stats = {}
-    for severity, count in c.fetchall():
-        severity_stats[severity] = count
+        # Get total statistics
+        c.execute('SELECT COUNT(*) FROM router_logs WHERE router_id = ?', (router_id,))
+        total_logs = c.fetchone()[0]
     
-    # Get category statistics
-    c.execute('SELECT topics, COUNT(*) FROM router_logs WHERE router_id = ? GROUP BY topics', (router_id,))
-    category_stats = {}
-    for category, count in c.fetchall():
-        category_stats[category] = count
+        # Get severity statistics
+        c.execute('SELECT severity, COUNT(*) FROM router_logs WHERE router_id = ? GROUP BY severity', (router_id,))
+        severity_stats = {}
+        for severity, count in c.fetchall():
+            severity_stats[severity] = count
     
-    conn.close()
+        # Get category statistics
+        c.execute('SELECT topics, COUNT(*) FROM router_logs WHERE router_id = ? GROUP BY topics', (router_id,))
+        category_stats = {}
+        for category, count in c.fetchall():
+            category_stats[category] = count
     
     # Get retention settings
     retention_days = get_log_retention_settings(router_id)
@@ -1965,42 +1708,46 @@ def router_logs(router_id):
                          current_severity=severity_filter,
                          current_search=search_term)
 
-def get_live_firewall_connections(router_id):
-    """Get real-time firewall connections with simple caching"""
+def get_live_firewall_connections(router_id, min_bytes=0):
+    """Get real-time firewall connections with simple caching
+
+    Only the columns we display are requested from RouterOS, and with
+    ``min_bytes`` the router itself drops flows smaller than that.
+    """
     current_time = time.time()
+    cache_key = (router_id, min_bytes)
     
     with firewall_cache_lock:
         # Check cache first
-        if router_id in firewall_connections_cache:
-            cached_data, timestamp = firewall_connections_cache[router_id]
+        if cache_key in firewall_connections_cache:
+            cached_data, timestamp = firewall_connections_cache[cache_key]
             if current_time - timestamp < 10:  # 10-second cache
                 return cached_data
     
-    conn = sqlite3.connect(db_path)
-    c = conn.cursor()
-    c.execute('SELECT * FROM routers WHERE id = ?', (router_id,))
-    router = c.fetchone()
-    conn.close()
+    with get_db_connection() as conn:
+        c = conn.cursor()
+        c.execute('SELECT * FROM routers WHERE id = ?', (router_id,))
+        router = c.fetchone()
     
     if not router:
         return {'error': 'Router not found'}
     
     router_id, name, host, port, username, password, created_at = router
-    api, connection, error = connect_to_router(host, port, username, password)
+    api, connection, error = connect_to_router(host, port, username, password, router_id=router_id)
     
     if not api:
         return {'error': error or 'Failed to connect to router'}
     
     try:
-        # Get firewall connections - stable method
-        firewall_connections = api.get_resource('/ip/firewall/connection')
-        connections_data = firewall_connections.get() if firewall_connections.get() else []
+        snapshot = RouterSnapshot(api, router_id)
+        
+        # Get firewall connections - projected and filtered on the router
+        connections_data = snapshot.query(conntrack_query(min_bytes=min_bytes))
         
         # Get DHCP leases for hostname resolution
         hostname_map = {}
         try:
-            dhcp_leases = api.get_resource('/ip/dhcp-server/lease')
-            leases = dhcp_leases.get() if dhcp_leases.get() else []
+            leases = snapshot.query(RouterQuery('/ip/dhcp-server/lease', ('address', 'host-name')))
             for lease in leases:
                 if lease.get('address') and lease.get('host-name'):
                     hostname_map[lease['address']] = lease['host-name']
@@ -2009,8 +1756,7 @@ def get_live_firewall_connections(router_id):
         
         # Get ARP table as fallback for hostname resolution
         try:
-            arp_table = api.get_resource('/ip/arp')
-            arp_data = arp_table.get() if arp_table.get() else []
+            arp_data = snapshot.query(RouterQuery('/ip/arp', ('address', 'host-name')))
             for arp_entry in arp_data:
                 if arp_entry.get('address') and arp_entry.get('host-name') and arp_entry['address'] not in hostname_map:
                     hostname_map[arp_entry['address']] = arp_entry['host-name']
@@ -2044,12 +1790,8 @@ def get_live_firewall_connections(router_id):
             if is_internal_src and is_external_dst:
                 total_connections += 1
                 
-                # Get bytes (format: "sent/received" from router perspective)
-                bytes_field = conn.get('bytes', '0/0')
-                if '/' in bytes_field:
-                    sent_bytes, received_bytes = map(int, bytes_field.split('/'))
-                else:
-                    sent_bytes, received_bytes = 0, 0
+                # Get bytes (orig/repl counters, or legacy "sent/received")
+                sent_bytes, received_bytes = connection_bytes(conn)
                 
                 # From router view: sent = client upload, received = client download
                 upload_bytes = sent_bytes      # Client upload to internet
@@ -2109,7 +1851,7 @@ def get_live_firewall_connections(router_id):
         
         # Update cache
         with firewall_cache_lock:
-            firewall_connections_cache[router_id] = (result, current_time)
+            firewall_connections_cache[cache_key] = (result, current_time)
         
         return result
         
@@ -2207,5 +1949,9 @@ def get_service_name_simple(dst_port, protocol):
 
 if __name__ == '__main__':
     init_db()
+    # Covering indexes missing from older databases are built while the app serves
+    start_index_build(db_path)
+    # Load the monitor page's running totals before the first request asks for them
+    threading.Thread(target=warm_top_talkers, name='top-talkers-warm', daemon=True).start()
     print(f"Starting Flask app with database at: {db_path}")
     app.run(host='0.0.0.0', port=8080, debug=True)
\ No newline at end of file
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Columnar archive for raw bandwidth samples past the hot window.
+
+SQLite keeps the last ``BANDWIDTH_HOT_DAYS`` day partitions of
+``ip_bandwidth_data`` and ``interface_bandwidth_data``. Older, closed days
+are moved by the maintenance service into column files, one directory per
+table, router and day::
+
+    archive/ip_bandwidth_data/<router_id>/<YYYYMMDD>/timestamp.npy
+                                                    host_id.npy
+                                                    rx_bytes.npy ...
+
+Every column is a fixed-width ``.npy`` array (epoch seconds, ids, byte
+counts, rates) sorted by timestamp, so a read maps the files with
+``numpy.memmap`` and slices the requested range out of them with
+``searchsorted`` without copying. A day is 20 bytes per IP sample instead
+of a table row plus two covering index entries, and archived days no
+longer weigh on the hot database or its indexes. They are kept for
+``BANDWIDTH_ARCHIVE_RETENTION_DAYS`` (or the router's raw retention
+override), longer than the hot days.
+
+``raw_host_totals``, ``raw_host_history`` and ``raw_interface_history`` in
+``bandwidth_partitions`` read the archive for the part of a period that
+lies before the oldest hot partition. Charts read raw samples, and so the
+archive, when they show more points than the rollups have over the period
+(``bandwidth_rollup.chart_tier``).
+"""
+
+import os
+import shutil
+from datetime import datetime
+
+import numpy as np
+
+from bandwidth_partitions import DAY, list_partitions, partition_day
+
+# Days of raw samples kept in SQLite before they move to the archive
+BANDWIDTH_HOT_DAYS = float(os.environ.get('BANDWIDTH_HOT_DAYS', '2'))
+# Days archived raw samples are kept (unless a router has its own raw retention)
+BANDWIDTH_ARCHIVE_RETENTION_DAYS = float(os.environ.get('BANDWIDTH_ARCHIVE_RETENTION_DAYS', '30'))
+# Archive directory; defaults to 'archive' next to the database
+BANDWIDTH_ARCHIVE_DIR = os.environ.get('BANDWIDTH_ARCHIVE_DIR', '')
+
+# (column, SQL expression, dtype) of each archived table, timestamp first
+ARCHIVE_COLUMNS = {
+    'ip_bandwidth_data': (
+        ('timestamp', 'timestamp', np.int64),
+        ('host_id', 'host_id', np.int32),
+        ('rx_bytes', 'COALESCE(rx_bytes, 0)', np.int64),
+        ('tx_bytes', 'COALESCE(tx_bytes, 0)', np.int64),
+    ),
+    'interface_bandwidth_data': (
+        ('timestamp', 'timestamp', np.int64),
+        ('interface_id', 'interface_id', np.int32),
+        ('rx_bytes', 'COALESCE(rx_bytes, 0)', np.int64),
+        ('tx_bytes', 'COALESCE(tx_bytes, 0)', np.int64),
+        ('rx_bps', 'COALESCE(rx_bps, 0)', np.float64),
+        ('tx_bps', 'COALESCE(tx_bps, 0)', np.float64),
+    ),
+}
+
+
+def archive_dir(db_path):
+    return BANDWIDTH_ARCHIVE_DIR or os.path.join(os.path.dirname(os.path.abspath(db_path)), 'archive')
+
+
+class BandwidthArchive:
+    """Day column files of raw bandwidth samples under ``root``"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def _router_dir(self, table, router_id):
+        return os.path.join(self.root, table, str(router_id))
+
+    def routers(self, table):
+        try:
+            return sorted(int(name) for name in os.listdir(os.path.join(self.root, table)) if name.isdigit())
+        except FileNotFoundError:
+            return []
+
+    def days(self, table, router_id):
+        """[(day, directory)] archived for a router, oldest first"""
+        directory = self._router_dir(table, router_id)
+        try:
+            names = os.listdir(directory)
+        except FileNotFoundError:
+            return []
+        days = []
+        for name in names:
+            try:
+                day = datetime.strptime(name, '%Y%m%d').date()
+            except ValueError:
+                # Unfinished writes end in .tmp
+                continue
+            days.append((day, os.path.join(directory, name)))
+        return sorted(days)
+
+    def write_partition(self, conn, table, name, day):
+        """Write one closed day table into column files; returns rows archived"""
+        columns = ARCHIVE_COLUMNS[table]
+        dtype = np.dtype([(column, column_type) for column, _, column_type in columns])
+        select = ', '.join(expression for _, expression, _ in columns)
+        written = 0
+        for (router_id,) in conn.execute(f'SELECT DISTINCT router_id FROM {name}').fetchall():
+            rows = np.fromiter(conn.execute(f'''
+                SELECT {select} FROM {name} WHERE router_id = ? ORDER BY timestamp, {columns[1][0]}
+            ''', (router_id,)), dtype=dtype)
+            target = os.path.join(self._router_dir(table, router_id), f'{day:%Y%m%d}')
+            staging = target + '.tmp'
+            shutil.rmtree(staging, ignore_errors=True)
+            os.makedirs(staging)
+            for column, _, _ in columns:
+                np.save(os.path.join(staging, f'{column}.npy'), np.ascontiguousarray(rows[column]))
+            # A day is visible to readers only once all of its columns are there
+            shutil.rmtree(target, ignore_errors=True)
+            os.rename(staging, target)
+            written += len(rows)
+        return written
+
+    def drop_days_before(self, table, router_id, cutoff):
+        """Delete a router's archived days that end at or before the ``cutoff`` epoch"""
+        last_kept = partition_day(cutoff)
+        days = self.days(table, router_id)
+        dropped = 0
+        for day, directory in days:
+            if day < last_kept:
+                shutil.rmtree(directory)
+                dropped += 1
+        if days and dropped == len(days):
+            shutil.rmtree(self._router_dir(table, router_id), ignore_errors=True)
+        return dropped
+
+    def read(self, table, router_id, since, until=None):
+        """{column: array} of a router's samples in [since, until), oldest first.
+
+        Each day's columns are memory-mapped and sliced to the range; only
+        days spanning more than one file are copied when joined.
+        """
+        first = partition_day(since)
+        last = partition_day(until - 1) if until is not None else None
+        parts = []
+        for day, directory in self.days(table, router_id):
+            if day < first or (last is not None and day > last):
+                continue
+            mapped = {column: np.load(os.path.join(directory, f'{column}.npy'), mmap_mode='r')
+                      for column, _, _ in ARCHIVE_COLUMNS[table]}
+            timestamps = mapped['timestamp']
+            start = np.searchsorted(timestamps, since, 'left')
+            end = np.searchsorted(timestamps, until, 'left') if until is not None else len(timestamps)
+            if end > start:
+                parts.append({column: values[start:end] for column, values in mapped.items()})
+        if len(parts) == 1:
+            return parts[0]
+        return {column: np.concatenate([part[column] for part in parts]) if parts
+                else np.empty(0, column_type) for column, _, column_type in ARCHIVE_COLUMNS[table]}
+
+    def host_totals(self, router_id, since, until=None):
+        """Per-host (host_id, rx, tx) of archived samples in [since, until)"""
+        data = self.read('ip_bandwidth_data', router_id, since, until)
+        hosts, index = np.unique(data['host_id'], return_inverse=True)
+        rx = np.zeros(len(hosts), np.int64)
+        tx = np.zeros(len(hosts), np.int64)
+        np.add.at(rx, index, data['rx_bytes'])
+        np.add.at(tx, index, data['tx_bytes'])
+        return list(zip(hosts.tolist(), rx.tolist(), tx.tolist()))
+
+    def host_history(self, router_id, host_ids, since, until=None):
+        """(timestamp, rx, tx) of archived samples summed over ``host_ids``, oldest first"""
+        data = self.read('ip_bandwidth_data', router_id, since, until)
+        selected = np.isin(data['host_id'], host_ids)
+        stamps, index = np.unique(data['timestamp'][selected], return_inverse=True)
+        rx = np.zeros(len(stamps), np.int64)
+        tx = np.zeros(len(stamps), np.int64)
+        np.add.at(rx, index, data['rx_bytes'][selected])
+        np.add.at(tx, index, data['tx_bytes'][selected])
+        return list(zip(stamps.tolist(), rx.tolist(), tx.tolist()))
+
+    def interface_history(self, router_id, since, until=None):
+        """(interface_id, timestamp, rx, tx) archived rates, by interface then time"""
+        data = self.read('interface_bandwidth_data', router_id, since, until)
+        order = np.argsort(data['interface_id'], kind='stable')
+        return list(zip(data['interface_id'][order].tolist(), data['timestamp'][order].tolist(),
+                        data['rx_bps'][order].tolist(), data['tx_bps'][order].tolist()))
+
+
+def archive_closed_days(conn, archive, now, drop):
+    """Archive the day partitions past the hot window.
+
+    ``drop(table, name)`` removes a partition once its files are written
+    (through the ingest writer in the collector). Returns rows archived.
+    """
+    last_hot = partition_day(now - BANDWIDTH_HOT_DAYS * DAY)
+    archived = 0
+    for table in ARCHIVE_COLUMNS:
+        for day, name in list_partitions(conn, table):
+            if day >= last_hot:
+                break
+            archived += archive.write_partition(conn, table, name, day)
+            drop(table, name)
+    return archived
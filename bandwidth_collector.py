@@ -1,23 +1,78 @@
 #!/usr/bin/env python3
 """
-Background service to collect per-IP bandwidth data from MikroTik routers every minute
+Background service that collects per-IP, interface, log and status data from MikroTik routers
 """
 
 import sqlite3
-import routeros_api
+from router_sessions import RouterSessionPool
+from router_snapshot import RouterQuery, RouterSnapshot, compile_networks, conntrack_query
+from ingest_writer import IngestWriter, enable_wal
+from db_pool import ConnectionPool
+from log_cursor import LOG_CURSOR_SCHEMA, LogFollower, collect_new_logs
+from counter_state import COUNTER_STATE_SCHEMA, CounterStateStore, parse_uptime
+from collection_scheduler import JOB_INTERVALS, CollectionScheduler
+from router_breaker import BREAKER_SCHEMA, RouterCircuitBreaker
+from flow_delta import FLOW_COLUMNS, FlowDeltaEngine, rollup_by_ip
+from bandwidth_partitions import (PARTITIONED_TABLES, ensure_partition, insert_sql, migrate_legacy_tables,
+                                  partition_day, partition_name)
+from bandwidth_indexes import start_index_build
+from bandwidth_archive import BandwidthArchive, archive_dir
+from dimension_catalog import HOST_SCHEMA, INTERFACE_SCHEMA, DimensionCatalog
+from bandwidth_rollup import (INTERFACE_ROLLUP_SCHEMA, INTERFACE_ROLLUP_UPSERT, IP_ROLLUP_SCHEMA, IP_ROLLUP_UPSERT,
+                              backfill_rollups, interface_rollup_rows, ip_rollup_rows)
+from maintenance import BANDWIDTH_RETENTION_SCHEMA, MAINTENANCE_INTERVAL, MaintenanceService, enable_incremental_vacuum
+from router_leases import (COLLECTOR_PROCESSES, COLLECTOR_SHARDED, COLLECTOR_WORKER_ID, LEASE_SCHEMA,
+                           LEASE_TTL, ROLE_SCHEMA, WORKER_SCHEMA, RouterLeaseManager, default_worker_id)
 import time
-import schedule
 import threading
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime
 import os
+import json
 
 # Use absolute path for Docker compatibility
 # db_path = '/app/data/routers.db'
 # Use local path for non-Docker usage
 db_path = os.path.join('data', 'routers.db')
 
-# Dictionary to store previous interface statistics for each router
-router_interface_stats = {}
+# Single writer thread: collector writes are queued and committed in batches
+ingest = IngestWriter(db_path)
+
+# Reused connections for the collector's own reads and schema setup
+db = ConnectionPool(db_path)
+
+# Host and interface ids, cached; new ones are added through the writer
+catalog = DimensionCatalog(db_path, writer=ingest, db=db)
+
+# Raw bandwidth day partitions this process already created
+ensured_partitions = set()
+
+# Previous interface counters per router, persisted so deltas survive restarts
+counter_state = CounterStateStore(db_path, db=db, writer=ingest)
+
+# Previous conntrack counters per router for per-flow byte deltas
+flow_engines = {}
+flow_engines_lock = threading.Lock()
+
+# Worker pool settings for concurrent router polling
+COLLECTOR_WORKERS = int(os.environ.get('COLLECTOR_WORKERS', '16'))
+ROUTER_DEADLINE = float(os.environ.get('ROUTER_DEADLINE', '45'))
+
+# Persistent RouterOS sessions reused across collection cycles; no single
+# socket operation may outlive the router deadline
+session_pool = RouterSessionPool(socket_timeout=ROUTER_DEADLINE)
+
+# Circuit breaker shared with the web app: dead routers are re-probed with
+# exponential backoff instead of being polled (or skipped) forever
+router_breaker = RouterCircuitBreaker(db_path, db=db, writer=ingest)
+
+# RouterOS sessions currently in flight, so stragglers can be cancelled
+active_connections = {}
+active_connections_lock = threading.Lock()
+
+# Stream router logs as they are written instead of polling every 5 minutes
+LOG_FOLLOW = os.environ.get('LOG_FOLLOW', '0') == '1'
+log_followers = {}
 
 def init_db():
     """Initialize database tables if they don't exist"""
@@ -29,194 +84,345 @@ def init_db():
     os.makedirs(data_dir, exist_ok=True)
     
     try:
-        conn = sqlite3.connect(db_path)
-        c = conn.cursor()
-        
-        # Create routers table
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS routers (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                host TEXT NOT NULL,
-                port INTEGER DEFAULT 8728,
-                username TEXT NOT NULL,
-                password TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Create per-IP bandwidth monitoring table
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS ip_bandwidth_data (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                router_id INTEGER NOT NULL,
-                ip_address TEXT NOT NULL,
-                mac_address TEXT,
-                hostname TEXT,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                rx_bytes INTEGER DEFAULT 0,
-                tx_bytes INTEGER DEFAULT 0,
-                FOREIGN KEY (router_id) REFERENCES routers (id)
-            )
-        ''')
-        
-        # Create router status cache table
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS router_status_cache (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                router_id INTEGER NOT NULL,
-                status TEXT NOT NULL,
-                last_checked TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                router_info TEXT,
-                FOREIGN KEY (router_id) REFERENCES routers (id)
-            )
-        ''')
-        
-        # Create interface bandwidth data table
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS interface_bandwidth_data (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                router_id INTEGER NOT NULL,
-                interface_name TEXT NOT NULL,
-                rx_bytes INTEGER DEFAULT 0,
-                tx_bytes INTEGER DEFAULT 0,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (router_id) REFERENCES routers (id)
-            )
-        ''')
-        
-        # Create indexes for faster queries
-        c.execute('CREATE INDEX IF NOT EXISTS idx_ip_bandwidth_router_time ON ip_bandwidth_data (router_id, timestamp)')
-        c.execute('CREATE INDEX IF NOT EXISTS idx_ip_bandwidth_ip ON ip_bandwidth_data (ip_address)')
-        c.execute('CREATE INDEX IF NOT EXISTS idx_ip_bandwidth_mac ON ip_bandwidth_data (mac_address)')
-        c.execute('CREATE INDEX IF NOT EXISTS idx_router_status_time ON router_status_cache (last_checked)')
-        c.execute('CREATE INDEX IF NOT EXISTS idx_interface_bandwidth_router_time ON interface_bandwidth_data (router_id, timestamp)')
-        c.execute('CREATE INDEX IF NOT EXISTS idx_interface_bandwidth_name ON interface_bandwidth_data (interface_name)')
-        
-        conn.commit()
-        conn.close()
+        with db.write() as conn:
+            # WAL: page views read while the collector's writer commits
+            enable_wal(conn)
+            # Free pages go back to the file system after retention deletes
+            enable_incremental_vacuum(conn)
+            c = conn.cursor()
+        
+            # Create routers table
+            c.execute('''
+                CREATE TABLE IF NOT EXISTS routers (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT NOT NULL,
+                    host TEXT NOT NULL,
+                    port INTEGER DEFAULT 8728,
+                    username TEXT NOT NULL,
+                    password TEXT NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+                
+            # Create router status cache table
+            c.execute('''
+                CREATE TABLE IF NOT EXISTS router_status_cache (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    router_id INTEGER NOT NULL,
+                    status TEXT NOT NULL,
+                    last_checked INTEGER,
+                    router_info TEXT,
+                    FOREIGN KEY (router_id) REFERENCES routers (id)
+                )
+            ''')
+                
+            # Per-router position in the RouterOS log buffer
+            c.execute(LOG_CURSOR_SCHEMA)
+        
+            # Last interface counters per router, reloaded at startup
+            c.execute(COUNTER_STATE_SCHEMA)
+        
+            # Per-router circuit breaker state
+            c.execute(BREAKER_SCHEMA)
+        
+            # Router ownership leases for sharded collectors
+            c.execute(LEASE_SCHEMA)
+            c.execute(WORKER_SCHEMA)
+            c.execute(ROLE_SCHEMA)
+        
+            # Per-router raw bandwidth retention overrides
+            c.execute(BANDWIDTH_RETENTION_SCHEMA)
+        
+            # Hosts and interface names, referenced by id from the bandwidth tables
+            c.execute(HOST_SCHEMA)
+            c.execute(INTERFACE_SCHEMA)
+        
+            # Raw bandwidth samples live in day partitions; migrate the old tables in place
+            moved = migrate_legacy_tables(c)
+            if moved:
+                print(f"Moved {moved} raw bandwidth rows into day partitions")
+        
+            # 5m / 1h / 1d bandwidth rollups, seeded once from existing raw history
+            c.execute(IP_ROLLUP_SCHEMA)
+            c.execute(INTERFACE_ROLLUP_SCHEMA)
+            filled = backfill_rollups(conn)
+            if filled:
+                print(f"Backfilled {filled} bandwidth rollup buckets from raw history")
+        
+            # Create indexes for faster queries
+            c.execute('CREATE INDEX IF NOT EXISTS idx_router_status_time ON router_status_cache (last_checked)')
+        
         print(f"Database initialized successfully at {db_path}")
         
     except Exception as e:
         print(f"Error initializing database at {db_path}: {e}")
         raise
 
-def collect_all_routers_bandwidth():
-    """Collect bandwidth data for all routers in the database"""
+def _cancel_router_poll(router_id):
+    """Tear down the RouterOS session of a straggling poll so its worker unblocks"""
+    with active_connections_lock:
+        session = active_connections.pop(router_id, None)
+    if session is not None:
+        session.cancel()
+
+def collect_router_data(router, deadline, cancelled, jobs=tuple(JOB_INTERVALS)):
+    """Poll a single router for the given jobs; runs inside a collector worker thread.
+
+    Returns the snapshot's traffic stats on success, None on failure.
+    """
+    router_id, name, host, port, username, password = router
+    
+    # Open breaker: the router failed recently and its backoff has not run out
+    if not router_breaker.allow(router_id):
+        return None
+    print(f"[{datetime.now()}] Collecting bandwidth data for {name} ({host})")
+    
+    connection = None
     try:
-        conn = sqlite3.connect(db_path)
-        c = conn.cursor()
-        
-        # Check if routers table exists
-        c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='routers'")
-        if not c.fetchone():
-            print("Routers table not found, initializing database...")
-            conn.close()
-            init_db()
-            conn = sqlite3.connect(db_path)
-            c = conn.cursor()
+        # Reuse the router's pooled session (login is only paid once)
+        api, connection = session_pool.acquire(router_id, host, port, username, password)
+        with active_connections_lock:
+            active_connections[router_id] = connection.session
         
-        # Get all routers
-        c.execute('SELECT id, name, host, port, username, password FROM routers')
-        routers = c.fetchall()
+        # Every RouterOS path is fetched once and shared by all collectors
+        snapshot = RouterSnapshot(api, router_id)
         
-        # Check which routers are online from cache
-        try:
-            c.execute('SELECT router_id, status FROM router_status_cache')
-            router_status = {row[0]: row[1] for row in c.fetchall()}
-        except sqlite3.OperationalError:
-            # router_status_cache table might not exist yet
-            router_status = {}
-        conn.close()
+        # Collect per-IP bandwidth data
+        if 'bandwidth' in jobs:
+            collect_ip_bandwidth_data(router_id, snapshot)
+        
+        # Collect interface bandwidth data
+        if 'interface' in jobs:
+            collect_interface_bandwidth_data(router_id, snapshot)
         
+        # Collect and save logs (followed routers stream them instead)
+        if 'logs' in jobs and router_id not in log_followers:
+            collect_router_logs(router_id, snapshot)
+        
+        if 'status' in jobs:
+            update_router_status_online(router_id, snapshot)
+        
+        connection.disconnect()
+        router_breaker.record_success(router_id)
+        stats = snapshot.stats()
+        print(f"[{datetime.now()}] Successfully collected data for {name} "
+              f"({stats['round_trips']} round trips, {stats['bytes'] / 1024:.1f} KB)")
+        return stats
+        
+    except Exception as e:
+        if connection:
+            connection.discard()
+        if router_id in cancelled:
+            print(f"[{datetime.now()}] Cancelled collection for {name} after {deadline:.0f}s deadline")
+            router_breaker.record_failure(router_id, f"Exceeded {deadline:.0f}s deadline")
+            return None
+        print(f"[{datetime.now()}] Error collecting data for {name}: {e}")
+        # Update cache to mark router as offline and back off from it
+        update_router_status_offline(router_id)
+        if router_breaker.record_failure(router_id, e) == 'open':
+            retry_in = router_breaker.state(router_id)['retry_at'] - time.time()
+            print(f"[{datetime.now()}] Circuit open for {name}; next probe in {retry_in:.0f}s")
+        return None
+    finally:
+        with active_connections_lock:
+            active_connections.pop(router_id, None)
+
+def sync_log_followers(routers):
+    """Keep one log follower per configured router (LOG_FOLLOW mode)"""
+    from routeros_async import get_engine
+    
+    current = {router[0]: router for router in routers}
+    for router_id in list(log_followers):
+        follower = log_followers[router_id]
+        if router_id not in current or follower.credentials != tuple(current[router_id][2:]):
+            follower.stop()
+            del log_followers[router_id]
+    
+    for router_id, (_, name, host, port, username, password) in current.items():
+        if router_id not in log_followers:
+            print(f"[{datetime.now()}] Following logs of {name} ({host})")
+            log_followers[router_id] = LogFollower(get_engine(), db, router_id,
+                                                   host, port, username, password, writer=ingest).start()
+
+def load_routers():
+    """Return all configured routers"""
+    # Check if routers table exists
+    with db.read() as conn:
+        exists = conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='routers'").fetchone()
+    if not exists:
+        print("Routers table not found, initializing database...")
+        init_db()
+    
+    # Get all routers
+    with db.read() as conn:
+        routers = conn.execute('SELECT id, name, host, port, username, password FROM routers').fetchall()
+    
+    if LOG_FOLLOW:
+        sync_log_followers(routers)
+    
+    return routers
+
+def collect_all_routers_bandwidth(max_workers=None, deadline=None):
+    """Collect bandwidth data for all routers in the database.
+
+    Routers are polled in parallel by a bounded worker pool so that a cycle
+    takes roughly as long as the slowest router. Polls still running after
+    ``deadline`` seconds are cancelled. Returns a dict of per-cycle stats.
+    """
+    max_workers = max_workers or COLLECTOR_WORKERS
+    deadline = deadline or ROUTER_DEADLINE
+    cycle_start = time.monotonic()
+    cycle_stats = {'routers': 0, 'succeeded': 0, 'failed': 0, 'timed_out': 0, 'skipped': 0,
+                   'round_trips': 0, 'bytes': 0, 'wall_time': 0.0}
+    
+    try:
+        routers = load_routers()
+        cycle_stats['routers'] = len(routers)
+        to_poll = []
         for router in routers:
-            router_id, name, host, port, username, password = router
+            router_id, name, host = router[0], router[1], router[2]
             
-            # Skip routers that are marked offline in cache
-            if router_id in router_status and router_status[router_id] == 'offline':
-                print(f"[{datetime.now()}] Skipping offline router: {name} ({host})")
+            # Skip routers whose breaker is open until their next probe is due
+            if router_breaker.is_open(router_id):
+                print(f"[{datetime.now()}] Skipping unreachable router: {name} ({host})")
+                cycle_stats['skipped'] += 1
                 continue
+            to_poll.append(router)
+        
+        if to_poll:
+            start_times = {}
+            cancelled = set()
             
-            print(f"[{datetime.now()}] Collecting bandwidth data for {name} ({host})")
+            def run(router):
+                start_times[router[0]] = time.monotonic()
+                return collect_router_data(router, deadline, cancelled)
             
+            executor = ThreadPoolExecutor(max_workers=min(max_workers, len(to_poll)),
+                                          thread_name_prefix='collector')
+            futures = {executor.submit(run, router): router for router in to_poll}
+            pending = set(futures)
             try:
-                # Connect to router with timeout
-                connection = routeros_api.RouterOsApiPool(
-                    host,
-                    port=port,
-                    username=username,
-                    password=password,
-                    plaintext_login=True
-                )
-                api = connection.get_api()
-                
-                # Collect per-IP bandwidth data
-                collect_ip_bandwidth_data(router_id, api)
-                
-                # Collect interface bandwidth data
-                collect_interface_bandwidth_data(router_id, api)
-                
-                # Collect and save logs every 5 minutes
-                current_minute = datetime.now().minute
-                if current_minute % 5 == 0:  # Collect logs every 5 minutes
-                    collect_router_logs(router_id, api)
-                
-                connection.disconnect()
-                print(f"[{datetime.now()}] Successfully collected data for {name}")
-                
-            except Exception as e:
-                print(f"[{datetime.now()}] Error collecting data for {name}: {e}")
-                # Update cache to mark router as offline
-                update_router_status_offline(router_id)
+                while pending:
+                    done, pending = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        result = future.result()
+                        if result:
+                            cycle_stats['succeeded'] += 1
+                            cycle_stats['round_trips'] += result['round_trips']
+                            cycle_stats['bytes'] += result['bytes']
+                        else:
+                            cycle_stats['failed'] += 1
+                    
+                    # Cancel stragglers that have run past their deadline
+                    now = time.monotonic()
+                    for future in list(pending):
+                        router = futures[future]
+                        started = start_times.get(router[0])
+                        if started is not None and now - started > deadline:
+                            cancelled.add(router[0])
+                            _cancel_router_poll(router[0])
+                            pending.discard(future)
+                            cycle_stats['timed_out'] += 1
+                            print(f"[{datetime.now()}] Router {router[1]} ({router[2]}) exceeded {deadline:.0f}s deadline")
+            finally:
+                executor.shutdown(wait=False, cancel_futures=True)
         
     except Exception as e:
         print(f"[{datetime.now()}] Error in collector: {e}")
+    
+    cycle_stats['wall_time'] = time.monotonic() - cycle_start
+    print(f"[{datetime.now()}] Collection cycle finished in {cycle_stats['wall_time']:.2f}s: "
+          f"{cycle_stats['succeeded']} ok, {cycle_stats['failed']} failed, "
+          f"{cycle_stats['timed_out']} timed out, {cycle_stats['skipped']} skipped, "
+          f"{cycle_stats['round_trips']} round trips, {cycle_stats['bytes'] / 1024:.1f} KB "
+          f"({max_workers} workers)")
+    return cycle_stats
+
+def write_router_status(router_id, status, router_info):
+    """Queue the latest status of a router (one cache row per router)"""
+    checked = int(time.time())
+    
+    def write(conn):
+        c = conn.execute('''
+            UPDATE router_status_cache SET status = ?, last_checked = ?, router_info = ?
+            WHERE router_id = ?
+        ''', (status, checked, router_info, router_id))
+        if c.rowcount == 0:
+            conn.execute('''
+                INSERT INTO router_status_cache (router_id, status, last_checked, router_info)
+                VALUES (?, ?, ?, ?)
+            ''', (router_id, status, checked, router_info))
+    
+    ingest.submit_call(write)
 
 def update_router_status_offline(router_id):
     """Update router status to offline in cache"""
     try:
-        conn = sqlite3.connect(db_path)
-        c = conn.cursor()
-        c.execute('''
-            INSERT OR REPLACE INTO router_status_cache (router_id, status, last_checked, router_info)
-            VALUES (?, ?, ?, ?)
-        ''', (router_id, 'offline', datetime.now(), '{"error": "Connection failed"}'))
-        conn.commit()
-        conn.close()
+        write_router_status(router_id, 'offline', '{"error": "Connection failed"}')
+    except Exception as e:
+        print(f"Error updating router status cache: {e}")
+
+def update_router_status_online(router_id, snapshot):
+    """Update router status to online in cache using this cycle's snapshot"""
+    try:
+        resource = snapshot.first('/system/resource')
+        info = {
+            'name': snapshot.first('/system/identity').get('name', 'N/A'),
+            'uptime': resource.get('uptime', 'N/A'),
+            'cpu_load': resource.get('cpu-load', 'N/A'),
+            'version': resource.get('version', 'N/A'),
+            'total_memory': resource.get('total-memory', 'N/A'),
+            'free_memory': resource.get('free-memory', 'N/A')
+        }
+        write_router_status(router_id, 'online', json.dumps(info))
     except Exception as e:
         print(f"Error updating router status cache: {e}")
 
-def collect_interface_bandwidth_data(router_id, api):
+def submit_raw_samples(table, rows, now):
+    """Queue raw samples into the day partition of ``now``, creating it on first use"""
+    name = partition_name(table, partition_day(now))
+    if name not in ensured_partitions:
+        # Queued ahead of the rows, so the table exists when they are written
+        ingest.submit_call(lambda conn: ensure_partition(conn, table, name))
+        ensured_partitions.add(name)
+    ingest.submit(insert_sql(name, PARTITIONED_TABLES[table]['columns']), rows)
+
+def collect_interface_bandwidth_data(router_id, snapshot):
     """Collect interface bandwidth statistics"""
     try:
         # Get interface statistics
-        interfaces = api.get_resource('/interface')
-        interface_data = interfaces.get() if interfaces.get() else []
-        
-        conn = sqlite3.connect(db_path)
-        c = conn.cursor()
+        interface_data = snapshot.get('/interface')
         
-        saved_count = 0
-        for iface in interface_data:
-            iface_name = iface.get('name')
-            rx_bytes = iface.get('rx-byte', 0)
-            tx_bytes = iface.get('tx-byte', 0)
-            
-            # Only save if we have valid data
-            if iface_name and rx_bytes and tx_bytes:
-                try:
-                    # Store the cumulative counter values directly
-                    c.execute('''
-                        INSERT INTO interface_bandwidth_data (router_id, interface_name, rx_bytes, tx_bytes)
-                        VALUES (?, ?, ?, ?)
-                    ''', (router_id, iface_name, int(rx_bytes), int(tx_bytes)))
-                    saved_count += 1
-                    
-                except Exception as e:
-                    print(f"Error saving interface data for {iface_name}: {e}")
-        
-        conn.commit()
-        conn.close()
+        # Uptime tells a reboot from a wrapped counter (same snapshot as the status job)
+        try:
+            uptime = parse_uptime(snapshot.first('/system/resource').get('uptime'))
+        except Exception as e:
+            print(f"Router {router_id}: No uptime, reboots are not detected this poll: {e}")
+            uptime = None
+        
+        # Track counter deltas against the previous (possibly pre-restart) sample
+        now = time.time()
+        counters = {iface.get('name'): (int(iface.get('rx-byte', 0)), int(iface.get('tx-byte', 0)))
+                    for iface in interface_data if iface.get('name') and iface.get('rx-byte') and iface.get('tx-byte')}
+        deltas = counter_state.advance(router_id, counters, now, uptime) if counters else None
+        if deltas is None:
+            print(f"Router {router_id}: No recent previous data, starting a new delta baseline")
+            return
+        rx_delta = sum(rx for rx, _ in deltas.values())
+        tx_delta = sum(tx for _, tx in deltas.values())
+        print(f"Router {router_id}: Traffic delta - RX: {rx_delta} bytes, TX: {tx_delta} bytes "
+              f"over {deltas.seconds:.0f}s")
+        
+        # Store bytes moved and rates over the interval (committed by the writer)
+        stamp = int(now)
+        interface_ids = catalog.interface_ids(deltas)
+        rates = deltas.rates()
+        rows = [(router_id, interface_ids[iface_name], rx_bytes, tx_bytes, *rates[iface_name], stamp)
+                for iface_name, (rx_bytes, tx_bytes) in deltas.items()]
+        submit_raw_samples('interface_bandwidth_data', rows, now)
+        deltas = {interface_ids[iface_name]: delta for iface_name, delta in deltas.items()}
+        ingest.submit(INTERFACE_ROLLUP_UPSERT, interface_rollup_rows(router_id, deltas, now))
+        saved_count = len(rows)
         
         if saved_count > 0:
             print(f"[{datetime.now()}] Saved interface bandwidth data for {saved_count} interfaces")
@@ -224,198 +430,62 @@ def collect_interface_bandwidth_data(router_id, api):
     except Exception as e:
         print(f"[{datetime.now()}] Error collecting interface bandwidth data: {e}")
 
-def collect_router_logs(router_id, api):
-    """Collect and save router logs"""
+def collect_router_logs(router_id, snapshot):
+    """Collect and save the router log lines emitted since the last poll"""
     try:
-        # Get system logs from router
-        logs_resource = api.get_resource('/log')
-        logs = logs_resource.get() if logs_resource.get() else []
+        # Only lines past the stored cursor are transferred and inserted
+        saved_count = collect_new_logs(db, router_id, snapshot, ingest)
         
-        if logs:
-            saved_count = save_router_logs(router_id, logs)
+        if saved_count:
             print(f"[{datetime.now()}] Saved {saved_count} new logs for router {router_id}")
-            
-            # Clean up old logs based on retention settings
-            cleanup_old_logs(router_id)
         else:
-            print(f"[{datetime.now()}] No logs found for router {router_id}")
+            print(f"[{datetime.now()}] No new logs for router {router_id}")
             
     except Exception as e:
         print(f"[{datetime.now()}] Error collecting logs for router {router_id}: {e}")
 
-def save_router_logs(router_id, logs):
-    """Save router logs to database"""
-    conn = sqlite3.connect(db_path)
-    c = conn.cursor()
-    
-    saved_count = 0
-    for log in logs:
-        timestamp = log.get('time', '')
-        topics = log.get('topics', '')
-        message = log.get('message', '')
-        
-        # Determine severity
-        message_lower = message.lower()
-        if 'critical' in message_lower or 'fatal' in message_lower or 'emergency' in message_lower:
-            severity = 'critical'
-        elif 'warning' in message_lower or 'warn' in message_lower:
-            severity = 'warning'
-        elif 'error' in message_lower or 'err' in message_lower:
-            severity = 'error'
-        elif 'info' in message_lower:
-            severity = 'info'
-        elif 'debug' in message_lower:
-            severity = 'debug'
-        else:
-            severity = 'other'
-        
-        # Check if log already exists (based on timestamp and message)
-        c.execute('SELECT id FROM router_logs WHERE router_id = ? AND timestamp = ? AND message = ?',
-                 (router_id, timestamp, message))
-        existing = c.fetchone()
-        
-        if not existing:
-            c.execute('''
-                INSERT INTO router_logs (router_id, timestamp, topics, message, severity)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (router_id, timestamp, topics, message, severity))
-            saved_count += 1
-    
-    conn.commit()
-    conn.close()
-    
-    return saved_count
-
-def get_log_retention_settings(router_id):
-    """Get log retention settings for a router"""
-    try:
-        conn = sqlite3.connect(db_path)
-        c = conn.cursor()
-        
-        c.execute('SELECT retention_days FROM log_retention_settings WHERE router_id = ?', (router_id,))
-        result = c.fetchone()
-        
-        conn.close()
-        
-        if result:
-            return result[0]
-        else:
-            # Default to 7 days if no setting exists
-            return 7
-    except Exception as e:
-        print(f"Error getting log retention settings: {e}")
-        return 7
-
-def cleanup_old_logs(router_id):
-    """Delete logs older than retention period"""
+def collect_ip_bandwidth_data(router_id, snapshot):
+    """Collect real per-IP bandwidth from per-flow conntrack byte deltas"""
     try:
-        retention_days = get_log_retention_settings(router_id)
-        cutoff_date = datetime.now() - datetime.timedelta(days=retention_days)
-        
-        conn = sqlite3.connect(db_path)
-        c = conn.cursor()
-        
-        # Convert cutoff_date to string format for comparison
-        cutoff_str = cutoff_date.strftime('%Y-%m-%d %H:%M:%S')
-        
-        c.execute('DELETE FROM router_logs WHERE router_id = ? AND stored_at < ?', 
-                  (router_id, cutoff_str))
-        deleted_count = c.rowcount
-        
-        conn.commit()
-        conn.close()
-        
-        if deleted_count > 0:
-            print(f"[{datetime.now()}] Cleaned up {deleted_count} old logs for router {router_id} (retention: {retention_days} days)")
-        
-        return deleted_count
-    except Exception as e:
-        print(f"Error cleaning up old logs: {e}")
-        return 0
-
-def collect_ip_bandwidth_data(router_id, api):
-    """Collect per-IP bandwidth data using interface statistics with delta tracking"""
-    try:
-        # Get current interface statistics
-        current_stats = {}
-        total_rx_bytes = 0
-        total_tx_bytes = 0
-        
-        try:
-            interfaces = api.get_resource('/interface')
-            interface_data = interfaces.get() if interfaces.get() else []
-            for iface in interface_data:
-                if iface.get('rx-byte') and iface.get('tx-byte'):
-                    iface_name = iface.get('name')
-                    rx_bytes = int(iface.get('rx-byte', 0))
-                    tx_bytes = int(iface.get('tx-byte', 0))
-                    current_stats[iface_name] = {'rx_bytes': rx_bytes, 'tx_bytes': tx_bytes}
-                    total_rx_bytes += rx_bytes
-                    total_tx_bytes += tx_bytes
-        except Exception as e:
-            print(f"Could not get interface statistics: {e}")
-        
-        # Calculate traffic delta from previous collection
-        rx_delta = 0
-        tx_delta = 0
-        
-        if router_id in router_interface_stats:
-            prev_stats = router_interface_stats[router_id]
-            prev_total_rx = prev_stats.get('total_rx_bytes', 0)
-            prev_total_tx = prev_stats.get('total_tx_bytes', 0)
-            
-            # Calculate delta (handle counter wrap-around)
-            rx_delta = max(0, total_rx_bytes - prev_total_rx)
-            tx_delta = max(0, total_tx_bytes - prev_total_tx)
-            
-            print(f"Router {router_id}: Traffic delta - RX: {rx_delta} bytes, TX: {tx_delta} bytes")
-        else:
-            print(f"Router {router_id}: First run, no previous data for delta calculation")
-        
-        # Store current stats for next calculation
-        router_interface_stats[router_id] = {
-            'total_rx_bytes': total_rx_bytes,
-            'total_tx_bytes': total_tx_bytes,
-            'timestamp': datetime.now()
-        }
-        
-        # Get active IPs from connection tracking - limit to reasonable number
-        active_ips = set()
+        # Every flow is needed to diff its counters, but only these columns
+        connection_data = snapshot.query(conntrack_query(proplist=FLOW_COLUMNS))
+        
+        with flow_engines_lock:
+            engine = flow_engines.setdefault(router_id, FlowDeltaEngine())
+        primed = engine.primed
+        deltas = engine.update(connection_data)
+        if not primed:
+            print(f"Router {router_id}: First run, recorded {engine.stats['flows']} flows as baseline")
+            return True
+        
+        # Internal hosts: the router's own networks plus DHCP clients outside them
+        internal_networks = ()
         try:
-            connections = api.get_resource('/ip/firewall/connection')
-            connection_data = connections.get() if connections.get() else []
-            # Limit to first 100 connections to avoid excessive data
-            for conn in connection_data[:100]:
-                src_ip = conn.get('src-address')
-                dst_ip = conn.get('dst-address')
-                if src_ip:
-                    src_ip_clean = src_ip.split(':')[0] if ':' in src_ip else src_ip
-                    active_ips.add(src_ip_clean)
-                if dst_ip:
-                    dst_ip_clean = dst_ip.split(':')[0] if ':' in dst_ip else dst_ip
-                    active_ips.add(dst_ip_clean)
+            addresses = snapshot.query(RouterQuery('/ip/address', ('address',)))
+            internal_networks = compile_networks(entry['address'] for entry in addresses
+                                                 if entry.get('address'))
         except Exception as e:
-            print(f"Could not get connection data: {e}")
+            print(f"Could not get IP addresses: {e}")
         
-        # Get internal IPs - essential for monitoring
         internal_ips = set()
         try:
-            dhcp_leases = api.get_resource('/ip/dhcp-server/lease')
-            leases = dhcp_leases.get() if dhcp_leases.get() else []
+            leases = snapshot.query(RouterQuery('/ip/dhcp-server/lease', ('address',)))
             for lease in leases:
                 if lease.get('address'):
                     internal_ips.add(lease['address'])
         except Exception as e:
             print(f"Could not get DHCP leases: {e}")
         
-        # Skip IP addresses collection to reduce API calls
-        # This is less critical for bandwidth monitoring
+        ip_traffic = rollup_by_ip(deltas, internal_ips, internal_networks)
+        if not ip_traffic:
+            print(f"Router {router_id}: No traffic from internal IPs "
+                  f"({engine.stats['flows']} flows, {engine.stats['expired']} expired)")
+            return True
         
         # Get ARP table for MAC addresses and hostnames
         arp_table = {}
         try:
-            arp = api.get_resource('/ip/arp')
-            arp_data = arp.get() if arp.get() else []
+            arp_data = snapshot.query(RouterQuery('/ip/arp', ('address', 'mac-address', 'host-name')))
             for entry in arp_data:
                 if entry.get('address'):
                     arp_table[entry['address']] = {
@@ -425,98 +495,156 @@ def collect_ip_bandwidth_data(router_id, api):
         except Exception as e:
             print(f"Could not get ARP table: {e}")
         
-        conn = sqlite3.connect(db_path)
-        c = conn.cursor()
-        
-        # Calculate estimated traffic per active internal IP
-        internal_active_ips = active_ips.intersection(internal_ips)
-        
-        # Store per-IP bandwidth data for internal IPs only
-        if internal_active_ips and (rx_delta > 0 or tx_delta > 0):
-            # Distribute total traffic among active internal IPs
-            num_ips = len(internal_active_ips)
-            estimated_rx_per_ip = rx_delta // num_ips
-            estimated_tx_per_ip = tx_delta // num_ips
-            
-            # Convert bytes to MB for display (1 MB = 1,048,576 bytes)
-            rx_mb = rx_delta / 1048576
-            tx_mb = tx_delta / 1048576
-            
-            for ip in internal_active_ips:
-                arp_info = arp_table.get(ip, {})
-                c.execute('''
-                    INSERT INTO ip_bandwidth_data (router_id, ip_address, mac_address, hostname, rx_bytes, tx_bytes)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                ''', (router_id, ip, arp_info.get('mac_address'), arp_info.get('hostname'), 
-                      estimated_rx_per_ip, estimated_tx_per_ip))
-            
-            print(f"Router {router_id}: Total RX={rx_mb:.2f} MB, TX={tx_mb:.2f} MB distributed among {num_ips} IPs")
-        elif internal_active_ips:
-            # Store realistic traffic data based on interface activity
-            # Generate realistic traffic values based on interface statistics
-            base_traffic = 1000  # Base traffic in bytes
-            
-            for ip in internal_active_ips:
-                arp_info = arp_table.get(ip, {})
-                # Generate some realistic traffic values
-                rx_bytes = base_traffic + (hash(ip) % 10000)
-                tx_bytes = base_traffic + (hash(ip) % 10000)
-                
-                c.execute('''
-                    INSERT INTO ip_bandwidth_data (router_id, ip_address, mac_address, hostname, rx_bytes, tx_bytes)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                ''', (router_id, ip, arp_info.get('mac_address'), arp_info.get('hostname'), 
-                      rx_bytes, tx_bytes))
-            
-            print(f"Router {router_id}: Generated realistic traffic data for {len(internal_active_ips)} IPs")
-        else:
-            print(f"Router {router_id}: No active internal IPs found")
-        
-        conn.commit()
-        conn.close()
-        print(f"Collected IP bandwidth data for router {router_id}")
+        now = time.time()
+        stamp = int(now)
+        # Rows store host ids from the catalog instead of IP/MAC/hostname text
+        hosts = [(ip, arp_table.get(ip, {}).get('mac_address'), arp_table.get(ip, {}).get('hostname'))
+                 for ip in ip_traffic]
+        host_ids = catalog.host_ids(hosts)
+        batch_data = []
+        samples = []
+        for host_id, (rx_bytes, tx_bytes) in zip(host_ids, ip_traffic.values()):
+            batch_data.append((router_id, host_id, rx_bytes, tx_bytes))
+            samples.append((router_id, host_id, stamp, rx_bytes, tx_bytes))
+        
+        submit_raw_samples('ip_bandwidth_data', samples, now)
+        ingest.submit(IP_ROLLUP_UPSERT, ip_rollup_rows(batch_data, now))
+        
+        rx_mb = sum(rx for rx, _ in ip_traffic.values()) / 1048576
+        tx_mb = sum(tx for _, tx in ip_traffic.values()) / 1048576
+        print(f"Router {router_id}: RX={rx_mb:.2f} MB, TX={tx_mb:.2f} MB across {len(ip_traffic)} IPs "
+              f"from {engine.stats['changed']} changed of {engine.stats['flows']} flows")
         return True
     except Exception as e:
         print(f"Error collecting IP bandwidth data: {e}")
         return False
 
-def run_scheduler():
-    """Run the scheduler in a separate thread"""
-    # Schedule data collection every minute
-    schedule.every(1).minutes.do(collect_all_routers_bandwidth)
+def adopt_router(router_id):
+    """Drop the in-memory state of a router this worker (re)gained a lease on.
+
+    While another worker owned it, that worker polled it and stored newer
+    counters: deltas resume from the stored sample, and the conntrack
+    engine starts over instead of diffing against a listing from before.
+    """
+    counter_state.load(router_id=router_id)
+    with flow_engines_lock:
+        flow_engines.pop(router_id, None)
+
+def run_scheduler(sharded=False, worker_id=None):
+    """Run the timing-wheel scheduler (blocks; started in a separate thread).
+
+    In sharded mode only routers this worker holds a lease on are polled,
+    and every poll is fenced by the lease so no router is polled twice for
+    the same interval when ownership moves between workers.
+    """
+    load = load_routers
+    gate = None
+    refresh_interval = 30.0
+    if sharded:
+        leases = RouterLeaseManager(db_path, worker_id)
+        
+        def load_owned_routers():
+            routers = load_routers()
+            owned = leases.rebalance([router[0] for router in routers])
+            for router_id in leases.acquired:
+                adopt_router(router_id)
+            return [router for router in routers if router[0] in owned]
+        
+        load = load_owned_routers
+        gate = leases.begin_poll
+        # Renew well within the lease TTL
+        refresh_interval = min(refresh_interval, LEASE_TTL / 3)
+        print(f"Sharded collector worker {leases.worker_id} started")
     
-    print("Bandwidth collector started. Collecting data every minute...")
+    scheduler = CollectionScheduler(
+        poll=lambda router, jobs, cancelled: collect_router_data(router, ROUTER_DEADLINE, cancelled, jobs),
+        load_routers=load,
+        cancel=_cancel_router_poll,
+        max_workers=COLLECTOR_WORKERS,
+        deadline=ROUTER_DEADLINE,
+        refresh_interval=refresh_interval,
+        gate=gate)
     
-    while True:
-        schedule.run_pending()
-        time.sleep(1)
+    intervals = ', '.join(f"{job} every {interval:.0f}s" for job, interval in scheduler.intervals.items())
+    print(f"Bandwidth collector started. Collecting {intervals}...")
+    
+    scheduler.run_forever()
 
-if __name__ == "__main__":
-    # Initialize database first
-    init_db()
+def run_collector(sharded=False, worker_id=None):
+    """Run one collector process until interrupted"""
+    # Resume delta calculation from the counters stored before the restart
+    resumed = counter_state.load()
+    print(f"Resumed interface counters for {resumed} routers")
     
-    # Run the collector immediately on startup with retry logic
-    max_retries = 3
-    for attempt in range(max_retries):
-        try:
-            collect_all_routers_bandwidth()
-            break
-        except sqlite3.OperationalError as e:
-            if "no such table" in str(e) and attempt < max_retries - 1:
-                print(f"Database table error, retrying... (attempt {attempt + 1}/{max_retries})")
-                time.sleep(2)
-                init_db()  # Re-initialize database
-            else:
-                print(f"Failed to collect bandwidth data after {max_retries} attempts: {e}")
+    # Missing query indexes are built between sample batches
+    start_index_build(db_path, writer=ingest)
+    
+    # A sharded worker only polls its own routers, so skip the all-router pass
+    if not sharded:
+        # Run the collector immediately on startup with retry logic
+        max_retries = 3
+        for attempt in range(max_retries):
+            try:
+                collect_all_routers_bandwidth()
                 break
+            except sqlite3.OperationalError as e:
+                if "no such table" in str(e) and attempt < max_retries - 1:
+                    print(f"Database table error, retrying... (attempt {attempt + 1}/{max_retries})")
+                    time.sleep(2)
+                    init_db()  # Re-initialize database
+                else:
+                    print(f"Failed to collect bandwidth data after {max_retries} attempts: {e}")
+                    break
     
     # Start the scheduler in a separate thread
-    scheduler_thread = threading.Thread(target=run_scheduler, daemon=True)
+    scheduler_thread = threading.Thread(target=run_scheduler, args=(sharded, worker_id), daemon=True)
     scheduler_thread.start()
     
+    # Retention, archiving of cold days, incremental vacuum and ANALYZE, between sample batches.
+    # Sharded workers share the database: only the holder of the maintenance role runs it, and
+    # keeps the role for as long as it keeps running
+    leader = None
+    if sharded:
+        roles = RouterLeaseManager(db_path, worker_id)
+        leader = lambda: roles.claim_role('maintenance', MAINTENANCE_INTERVAL + LEASE_TTL)
+    MaintenanceService(db_path, writer=ingest, archive=BandwidthArchive(archive_dir(db_path)), db=db,
+                       leader=leader).start()
+    
     # Keep the main thread alive
     try:
         while True:
             time.sleep(60)
     except KeyboardInterrupt:
-        print("Bandwidth collector stopped.")
\ No newline at end of file
+        if sharded:
+            RouterLeaseManager(db_path, worker_id).release_all()
+        # Commit whatever is still queued
+        ingest.stop()
+        print("Bandwidth collector stopped.")
+
+if __name__ == "__main__":
+    # Initialize database first
+    init_db()
+    
+    if COLLECTOR_PROCESSES > 1:
+        import multiprocessing
+        
+        # SQLite connections must not cross a fork: close ours (init_db used the pool and maybe the
+        # writer) and start the workers with 'spawn', so each opens its own from a fresh interpreter
+        ingest.stop()
+        db.close()
+        spawn = multiprocessing.get_context('spawn')
+        
+        # Local shards: one worker process each, coordinated through leases
+        base_id = COLLECTOR_WORKER_ID or default_worker_id()
+        processes = [spawn.Process(target=run_collector, args=(True, f"{base_id}-{index}"),
+                                   name=f"collector-{index}")
+                     for index in range(COLLECTOR_PROCESSES)]
+        for process in processes:
+            process.start()
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            print("Bandwidth collector stopped.")
+    else:
+        run_collector(COLLECTOR_SHARDED, COLLECTOR_WORKER_ID)
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Background build of the bandwidth query indexes.
+
+The hot bandwidth reads (per-IP totals, per-IP history and interface
+history, raw or from a rollup tier) each have a covering index, declared
+next to their tables in ``bandwidth_partitions`` and ``bandwidth_rollup``.
+New day partitions get theirs when they are created, but a database from
+before those indexes existed has days and rollup tables without them, and
+indexing a few million rows takes a while.
+
+``start_index_build`` finds what is missing and builds it on a daemon
+thread, one index per transaction, newest partitions first. Page views keep
+reading in the meantime (WAL) and just use the old plans until their index
+is there. In the collector the statements go through the ingest writer so
+they queue between sample batches instead of competing for the write lock.
+Indexes replaced by a covering one are dropped once it exists.
+"""
+
+import sqlite3
+import threading
+import time
+
+from bandwidth_partitions import PARTITIONED_TABLES, list_partitions
+from bandwidth_rollup import ROLLUP_INDEXES
+
+
+def _index_name(statement):
+    return statement.split(' IF NOT EXISTS ', 1)[1].split()[0]
+
+
+def index_statements(conn):
+    """CREATE/DROP INDEX statements still needed, rollups first then newest day first"""
+    existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    statements = [index for index in ROLLUP_INDEXES
+                  if index.split(' ON ', 1)[1].split()[0] in tables and _index_name(index) not in existing]
+    days = sorted(((day, table, name) for table in PARTITIONED_TABLES
+                   for day, name in list_partitions(conn, table)), reverse=True)
+    for _, table, name in days:
+        spec = PARTITIONED_TABLES[table]
+        for index in spec['indexes']:
+            index = index.format(name=name)
+            if _index_name(index) not in existing:
+                statements.append(index)
+        for index in spec['obsolete_indexes']:
+            index = index.format(name=name)
+            if index in existing:
+                statements.append(f'DROP INDEX IF EXISTS {index}')
+    return statements
+
+
+def build_missing_indexes(db_path, writer=None):
+    """Build every missing index, one per transaction; returns how many statements ran"""
+    conn = sqlite3.connect(db_path)
+    try:
+        statements = index_statements(conn)
+    finally:
+        conn.close()
+    if not statements:
+        return 0
+    print(f"Building {len(statements)} missing bandwidth indexes in the background")
+    started = time.time()
+    for statement in statements:
+        try:
+            if writer is not None:
+                writer.submit_call(lambda conn, statement=statement: conn.execute(statement), wait=True)
+            else:
+                conn = sqlite3.connect(db_path, timeout=30)
+                try:
+                    with conn:
+                        conn.execute(statement)
+                finally:
+                    conn.close()
+        except sqlite3.Error as e:
+            # A day dropped by retention meanwhile; the rest still gets built
+            print(f"Index statement failed ({statement}): {e}")
+    print(f"Bandwidth indexes built in {time.time() - started:.1f}s")
+    return len(statements)
+
+
+def start_index_build(db_path, writer=None):
+    """Run ``build_missing_indexes`` on a daemon thread"""
+    thread = threading.Thread(target=build_missing_indexes, args=(db_path, writer),
+                              name='bandwidth-index-build', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,388 @@
+#!/usr/bin/env python3
+"""
+Day partitions for raw bandwidth samples.
+
+Raw per-poll rows no longer go into one ever-growing ``ip_bandwidth_data``
+/ ``interface_bandwidth_data`` table. Every UTC day gets its own table,
+e.g. ``ip_bandwidth_data_p20240101``, with the same columns and indexes.
+Retention then drops whole day tables, which frees their pages without a
+huge ``DELETE`` holding the write lock. Range queries go through
+``query_partitions``, which only touches the days overlapping the window.
+
+Rows carry ``timestamp`` as integer epoch seconds (UTC), so a row always
+lands in the partition of the day it is stamped with, window filters are
+integer comparisons on the indexes and rate math needs no date parsing.
+Hosts and interfaces are stored as ids from the dimension catalog.
+Interface rows hold the bytes moved since the previous poll and the rates
+over that interval, not the cumulative counters. ``migrate_legacy_tables``
+moves the old single tables (text dimensions, cumulative interface
+counters, text timestamps) into day partitions once, and turns the text
+timestamps of the status cache and log tables (``EPOCH_COLUMNS``) into
+epoch seconds as well.
+"""
+
+from datetime import datetime, timedelta, timezone
+
+from counter_state import COUNTER_STATE_MAX_AGE
+from dimension_catalog import HOST_JOIN, register_hosts_from, register_interfaces_from
+
+DAY = 86400
+
+
+# (table, column, stored as local time) of the other time-series tables' timestamps: last_checked
+# used to be the collector's local datetime.now(), stored_at SQLite's UTC CURRENT_TIMESTAMP
+EPOCH_COLUMNS = (
+    ('router_status_cache', 'last_checked', True),
+    ('router_logs', 'stored_at', False),
+)
+
+
+def sql_epoch(column, local=False):
+    """SQL for the epoch seconds of a timestamp column, text (old tables) or integer"""
+    modifiers = ", 'utc'" if local else ''
+    return (f"(CASE WHEN typeof({column}) = 'text' THEN CAST(strftime('%s', {column}{modifiers}) AS INTEGER) "
+            f"ELSE {column} END)")
+
+
+def _counter_deltas():
+    """SELECT turning the old table's cumulative interface counters into delta rows.
+
+    Consecutive samples more than ``COUNTER_STATE_MAX_AGE`` apart, or whose
+    counters went backwards, give no row: the rules the collector applies
+    live. The first sample of every day has nothing before it.
+    """
+    return f'''
+        SELECT d.router_id, i.id, d.rx_bytes, d.tx_bytes,
+               d.rx_bytes * 8.0 / d.seconds, d.tx_bytes * 8.0 / d.seconds, d.timestamp
+        FROM (
+            SELECT e.router_id, e.interface_name, e.timestamp,
+                   e.rx_bytes - LAG(e.rx_bytes) OVER w AS rx_bytes, e.tx_bytes - LAG(e.tx_bytes) OVER w AS tx_bytes,
+                   e.timestamp - LAG(e.timestamp) OVER w AS seconds
+            FROM (
+                SELECT t.router_id, t.interface_name, t.rx_bytes, t.tx_bytes, {sql_epoch('t.timestamp')} AS timestamp
+                FROM {{source}} t
+                WHERE {{where}}
+            ) e
+            WINDOW w AS (PARTITION BY e.router_id, e.interface_name ORDER BY e.timestamp)
+        ) d JOIN interfaces i ON i.name = d.interface_name
+        WHERE d.seconds > 0 AND d.seconds <= {COUNTER_STATE_MAX_AGE} AND d.rx_bytes >= 0 AND d.tx_bytes >= 0
+    '''
+
+
+# Hosts and interfaces are stored as ids into the dimension catalog. The
+# indexes cover the hot reads below, so those never touch the table rows;
+# obsolete_indexes are the ones they replace. ``encode`` reads the old
+# single table (text dimensions and timestamps) in the current layout.
+PARTITIONED_TABLES = {
+    'ip_bandwidth_data': {
+        'schema': '''
+            CREATE TABLE IF NOT EXISTS {name} (
+                router_id INTEGER NOT NULL,
+                host_id INTEGER NOT NULL,
+                timestamp INTEGER NOT NULL,
+                rx_bytes INTEGER DEFAULT 0,
+                tx_bytes INTEGER DEFAULT 0,
+                FOREIGN KEY (router_id) REFERENCES routers (id),
+                FOREIGN KEY (host_id) REFERENCES hosts (id)
+            )
+        ''',
+        'indexes': (
+            # raw_host_totals: one router's window, all hosts
+            'CREATE INDEX IF NOT EXISTS idx_{name}_router_time_cover '
+            'ON {name} (router_id, timestamp, host_id, rx_bytes, tx_bytes)',
+            # raw_host_history: one router, the hosts of one IP, a window
+            'CREATE INDEX IF NOT EXISTS idx_{name}_router_host_time '
+            'ON {name} (router_id, host_id, timestamp, rx_bytes, tx_bytes)',
+        ),
+        'obsolete_indexes': ('idx_{name}_router_time', 'idx_{name}_host'),
+        'columns': ('router_id', 'host_id', 'timestamp', 'rx_bytes', 'tx_bytes'),
+        'register': register_hosts_from,
+        'encode': (f"SELECT t.router_id, h.id, {sql_epoch('t.timestamp')}, t.rx_bytes, t.tx_bytes "
+                   'FROM {source} t ' + HOST_JOIN + ' WHERE {where}'),
+    },
+    'interface_bandwidth_data': {
+        'schema': '''
+            CREATE TABLE IF NOT EXISTS {name} (
+                router_id INTEGER NOT NULL,
+                interface_id INTEGER NOT NULL,
+                rx_bytes INTEGER DEFAULT 0,
+                tx_bytes INTEGER DEFAULT 0,
+                rx_bps REAL DEFAULT 0,
+                tx_bps REAL DEFAULT 0,
+                timestamp INTEGER NOT NULL,
+                FOREIGN KEY (router_id) REFERENCES routers (id),
+                FOREIGN KEY (interface_id) REFERENCES interfaces (id)
+            )
+        ''',
+        'indexes': (
+            # raw_interface_history: one router's window, all interfaces
+            'CREATE INDEX IF NOT EXISTS idx_{name}_router_time_rates '
+            'ON {name} (router_id, timestamp, interface_id, rx_bps, tx_bps)',
+        ),
+        'obsolete_indexes': ('idx_{name}_router_time', 'idx_{name}_router_time_cover'),
+        'columns': ('router_id', 'interface_id', 'rx_bytes', 'tx_bytes', 'rx_bps', 'tx_bps', 'timestamp'),
+        'register': register_interfaces_from,
+        'encode': _counter_deltas(),
+    },
+}
+
+
+def format_timestamp(epoch):
+    """Epoch seconds as a ``YYYY-MM-DD HH:MM:SS`` UTC string, for API output"""
+    return datetime.fromtimestamp(epoch, timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def partition_day(epoch):
+    return datetime.fromtimestamp(epoch, timezone.utc).date()
+
+
+def day_start(day):
+    """Epoch of 00:00 UTC on ``day``"""
+    return int(datetime(day.year, day.month, day.day, tzinfo=timezone.utc).timestamp())
+
+
+def partition_name(table, day):
+    return f'{table}_p{day:%Y%m%d}'
+
+
+def ensure_partition(conn, table, name):
+    """Create a day table with its indexes if it does not exist yet"""
+    spec = PARTITIONED_TABLES[table]
+    conn.execute(spec['schema'].format(name=name))
+    for index in spec['indexes']:
+        conn.execute(index.format(name=name))
+    return name
+
+
+def insert_sql(name, columns):
+    return f'INSERT INTO {name} ({", ".join(columns)}) VALUES ({", ".join("?" for _ in columns)})'
+
+
+def list_partitions(conn, table):
+    """[(day, table name)] of every partition of ``table``, oldest first"""
+    prefix = f'{table}_p'
+    partitions = []
+    for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE ?",
+                                (prefix + '%',)):
+        try:
+            day = datetime.strptime(name[len(prefix):], '%Y%m%d').date()
+        except ValueError:
+            continue
+        partitions.append((day, name))
+    return sorted(partitions)
+
+
+def overlapping_partitions(conn, table, since, until=None):
+    """Names of the partitions holding rows in [since, until) (epochs)"""
+    first = partition_day(since)
+    last = partition_day(until) if until is not None else None
+    return [name for day, name in list_partitions(conn, table)
+            if day >= first and (last is None or day <= last)]
+
+
+def query_partitions(conn, table, columns, where, params, since, until=None, outer='{source}', outer_params=()):
+    """Run a query over the partitions overlapping [since, until).
+
+    Each overlapping partition contributes ``SELECT columns FROM day WHERE
+    where`` (plus the time window) to a ``UNION ALL``; ``outer`` wraps the
+    result, e.g. ``'SELECT ... FROM ({source}) GROUP BY ...'``. Parameters
+    of ``outer`` (``outer_params``) must all come before ``{source}``.
+    """
+    names = overlapping_partitions(conn, table, since, until)
+    if not names:
+        return []
+    window = 'timestamp >= ?' + (' AND timestamp < ?' if until is not None else '')
+    bounds = [int(since)] + ([int(until)] if until is not None else [])
+    branches = [f'SELECT {columns} FROM {name} WHERE ({where}) AND {window}' for name in names]
+    source = '\nUNION ALL\n'.join(branches)
+    return conn.execute(outer.format(source=source),
+                        list(outer_params) + list(params + tuple(bounds)) * len(names)).fetchall()
+
+
+def archived_rows(conn, table, since, read):
+    """``read(since, until)`` over the part of a period before the oldest day partition.
+
+    ``until`` is where the partitions start (None when there are none), so
+    a day being archived is never counted from both places. Returns [] when
+    the period starts inside the partitions.
+    """
+    partitions = list_partitions(conn, table)
+    until = day_start(partitions[0][0]) if partitions else None
+    if until is not None and until <= since:
+        return []
+    return read(since, until)
+
+
+def _add_totals(*parts):
+    """Sum (host_id, rx, tx) rows of several sources per host"""
+    totals = {}
+    for rows in parts:
+        for host_id, rx, tx in rows:
+            total = totals.setdefault(host_id, [0, 0])
+            total[0] += rx or 0
+            total[1] += tx or 0
+    return [(host_id, rx, tx) for host_id, (rx, tx) in totals.items()]
+
+
+def raw_host_totals(conn, router_id, since, archive=None):
+    """Per-host (host_id, rx, tx) of raw samples since an epoch, archived days included"""
+    rows = query_partitions(
+        conn, 'ip_bandwidth_data', 'host_id, rx_bytes, tx_bytes', 'router_id = ?', (router_id,), since,
+        outer='SELECT host_id, SUM(rx_bytes), SUM(tx_bytes) FROM ({source}) GROUP BY host_id')
+    if archive is None:
+        return rows
+    cold = archived_rows(conn, 'ip_bandwidth_data', since, lambda since, until: archive.host_totals(
+        router_id, since, until))
+    return _add_totals(cold, rows) if cold else rows
+
+
+def window_sums(column, rx, tx, sinces):
+    """SELECT list summing ``rx`` and ``tx`` over windows from ``sinces`` in one pass.
+
+    The widest window is a plain SUM and each narrower one a SUM with a
+    FILTER clause over the same rows (cheaper per row than a CASE inside
+    the SUM, needs SQLite 3.30); ``MAX(column)`` tells which windows a host was
+    seen in. Returns the list, its parameters and the sorted window starts;
+    read the result back with ``split_windows``.
+    """
+    starts = sorted(set(sinces))
+    columns = [f'SUM({rx}), SUM({tx})']
+    columns += [f'SUM({rx}) FILTER (WHERE {column} >= ?), SUM({tx}) FILTER (WHERE {column} >= ?)'
+                for _ in starts[1:]]
+    columns.append(f'MAX({column})')
+    return ', '.join(columns), [start for start in starts[1:] for _ in range(2)], starts
+
+
+def split_windows(rows, sinces, starts):
+    """One [(host_id, rx, tx)] per entry of ``sinces`` from (host_id, ``window_sums`` ...) rows"""
+    windows = []
+    for since in sinces:
+        column = 1 + 2 * starts.index(since)
+        windows.append([(row[0], row[column], row[column + 1]) for row in rows if row[-1] >= since])
+    return windows
+
+
+def raw_host_window_totals(conn, router_id, sinces, archive=None):
+    """``raw_host_totals`` for several epochs at once, in one range read.
+
+    The widest window is read once, with the narrower ones as filtered
+    sums over it (``window_sums``). Returns one [(host_id, rx, tx)] per
+    entry of ``sinces``.
+    """
+    sums, params, starts = window_sums('timestamp', 'rx_bytes', 'tx_bytes', sinces)
+    rows = query_partitions(
+        conn, 'ip_bandwidth_data', 'host_id, timestamp, rx_bytes, tx_bytes', 'router_id = ?', (router_id,),
+        starts[0], outer=f'SELECT host_id, {sums} FROM ({{source}}) GROUP BY host_id', outer_params=params)
+    totals = split_windows(rows, sinces, starts)
+    if archive is None:
+        return totals
+    merged = []
+    for since, window in zip(sinces, totals):
+        cold = archived_rows(conn, 'ip_bandwidth_data', since, lambda since, until: archive.host_totals(
+            router_id, since, until))
+        merged.append(_add_totals(cold, window) if cold else window)
+    return merged
+
+
+def raw_host_history(conn, router_id, host_ids, since, archive=None):
+    """(timestamp, rx, tx) of raw samples summed over ``host_ids`` (one IP), oldest first"""
+    if not host_ids:
+        return []
+    rows = query_partitions(
+        conn, 'ip_bandwidth_data', 'timestamp, rx_bytes, tx_bytes',
+        f"router_id = ? AND host_id IN ({', '.join('?' for _ in host_ids)})", (router_id, *host_ids), since,
+        outer='SELECT timestamp, SUM(rx_bytes), SUM(tx_bytes) FROM ({source}) GROUP BY timestamp ORDER BY timestamp')
+    if archive is None:
+        return rows
+    # Archived days all come before the partitions
+    return archived_rows(conn, 'ip_bandwidth_data', since, lambda since, until: archive.host_history(
+        router_id, host_ids, since, until)) + rows
+
+
+def raw_interface_history(conn, router_id, since, archive=None):
+    """(interface_id, timestamp, rx, tx) rates in bits per second of every interface since an epoch"""
+    rows = query_partitions(
+        conn, 'interface_bandwidth_data', 'interface_id, timestamp, rx_bps, tx_bps', 'router_id = ?',
+        (router_id,), since, outer='SELECT * FROM ({source}) ORDER BY interface_id, timestamp')
+    if archive is None:
+        return rows
+    cold = archived_rows(conn, 'interface_bandwidth_data', since, lambda since, until: archive.interface_history(
+        router_id, since, until))
+    # Stable: archived samples stay ahead of the newer ones of the same interface
+    return sorted(cold + rows, key=lambda row: row[0]) if cold else rows
+
+
+def all_partitions_source(conn, table, columns):
+    """``UNION ALL`` of every partition of ``table`` (None if there are none)"""
+    names = [name for _, name in list_partitions(conn, table)]
+    if not names:
+        return None
+    return '\nUNION ALL\n'.join(f'SELECT {columns} FROM {name}' for name in names)
+
+
+def drop_partitions_before(conn, table, cutoff):
+    """Drop the day tables that end at or before the ``cutoff`` epoch"""
+    last_kept = partition_day(cutoff)
+    dropped = []
+    for day, name in list_partitions(conn, table):
+        if day < last_kept:
+            conn.execute(f'DROP TABLE {name}')
+            dropped.append(name)
+    return dropped
+
+
+def copy_encoded(conn, table, source, target, where='1', params=()):
+    """Copy text-encoded rows of ``source`` into ``target`` as catalog ids"""
+    spec = PARTITIONED_TABLES[table]
+    spec['register'](conn, source)
+    return conn.execute(f'''
+        INSERT INTO {target} ({', '.join(spec['columns'])})
+        {spec['encode'].format(source=source, where=where)}
+    ''', params).rowcount
+
+
+def convert_text_timestamps(conn, table, column, local=False):
+    """Rewrite the text timestamps left in ``column`` as epoch seconds; returns rows changed.
+
+    Every integer sorts before every text value, so ``column >= ''`` only
+    matches the rows still to convert and is a no-op afterwards.
+    """
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone():
+        return 0
+    return conn.execute(f"UPDATE {table} SET {column} = {sql_epoch(column, local)} WHERE {column} >= ''").rowcount
+
+
+def migrate_legacy_table(conn, table):
+    """Move rows of the old single table into day partitions, then drop it.
+
+    Returns the number of rows moved (0 when there is nothing to migrate).
+    Does not commit.
+    """
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()
+    if not exists:
+        return 0
+    moved = 0
+    days = [row[0] for row in conn.execute(f'SELECT DISTINCT date(timestamp) FROM {table} WHERE timestamp IS NOT NULL')]
+    for day in days:
+        if day is None:
+            continue
+        start = datetime.strptime(day, '%Y-%m-%d').date()
+        name = ensure_partition(conn, table, partition_name(table, start))
+        moved += copy_encoded(conn, table, table, name, 't.timestamp >= ? AND t.timestamp < ?',
+                              (f'{start} 00:00:00', f'{start + timedelta(days=1)} 00:00:00'))
+    conn.execute(f'DROP TABLE {table}')
+    return moved
+
+
+def migrate_legacy_tables(conn):
+    """Bring raw bandwidth storage to the current layout; returns rows moved.
+
+    Splits the old single tables into day partitions and converts the text
+    timestamps of ``EPOCH_COLUMNS`` to epoch seconds.
+    """
+    moved = 0
+    for table in PARTITIONED_TABLES:
+        moved += migrate_legacy_table(conn, table)
+    for table, column, local in EPOCH_COLUMNS:
+        moved += convert_text_timestamps(conn, table, column, local)
+    return moved
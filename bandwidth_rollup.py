@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""
+Rollup tiers for bandwidth history.
+
+Raw samples (one row per IP or interface per poll, roughly one a minute)
+are also folded into 5-minute, 1-hour and 1-day buckets as they are
+ingested. Each bucket keeps the sum, min, max and sample count of the
+bytes moved, and is keyed by its integer epoch start, so folding a sample
+in is one ``INSERT ... ON CONFLICT DO UPDATE`` per tier in the same
+transaction as the raw row.
+
+Every tier has its own retention (raw data is kept shortest, daily buckets
+longest), applied by the collector's ``maintenance`` service. Readers call ``choose_tier`` with the period they show: it picks
+the coarsest tier that still yields ``ROLLUP_MIN_POINTS`` buckets over the
+period, so a week-long chart reads ~170 hourly rows instead of ~10k raw
+ones, and short periods keep reading raw samples.
+
+Interface tiers sum the per-interval counter deltas the collector stores
+in the raw ``interface_bandwidth_data`` days. Buckets are keyed by host and interface ids from the dimension catalog;
+an IP is the sum of its hosts (one per MAC/hostname it was seen with).
+"""
+
+import os
+import time
+
+from bandwidth_partitions import (DAY, all_partitions_source, format_timestamp, raw_host_window_totals, split_windows,
+                                  window_sums)
+
+# Raw samples and rollup buckets are kept this many days
+BANDWIDTH_RAW_RETENTION_DAYS = float(os.environ.get('BANDWIDTH_RAW_RETENTION_DAYS', '7'))
+ROLLUP_5M_RETENTION_DAYS = float(os.environ.get('ROLLUP_5M_RETENTION_DAYS', '30'))
+ROLLUP_1H_RETENTION_DAYS = float(os.environ.get('ROLLUP_1H_RETENTION_DAYS', '180'))
+ROLLUP_1D_RETENTION_DAYS = float(os.environ.get('ROLLUP_1D_RETENTION_DAYS', '1825'))
+
+# Fewest points a period may be shown with before a finer tier is used
+ROLLUP_MIN_POINTS = int(os.environ.get('ROLLUP_MIN_POINTS', '100'))
+
+
+class RollupTier:
+    """One bucket size with its retention"""
+
+    def __init__(self, name, seconds, retention_days):
+        self.name = name
+        self.seconds = seconds
+        self.retention = retention_days * DAY
+
+    def bucket(self, timestamp):
+        return int(timestamp // self.seconds) * self.seconds
+
+    def __repr__(self):
+        return f'RollupTier({self.name!r})'
+
+
+# Finest first
+ROLLUP_TIERS = (
+    RollupTier('5m', 300, ROLLUP_5M_RETENTION_DAYS),
+    RollupTier('1h', 3600, ROLLUP_1H_RETENTION_DAYS),
+    RollupTier('1d', DAY, ROLLUP_1D_RETENTION_DAYS),
+)
+
+IP_ROLLUP_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS ip_bandwidth_rollup (
+        router_id INTEGER NOT NULL,
+        resolution INTEGER NOT NULL,
+        host_id INTEGER NOT NULL,
+        bucket INTEGER NOT NULL,
+        rx_sum INTEGER NOT NULL,
+        rx_min INTEGER NOT NULL,
+        rx_max INTEGER NOT NULL,
+        tx_sum INTEGER NOT NULL,
+        tx_min INTEGER NOT NULL,
+        tx_max INTEGER NOT NULL,
+        samples INTEGER NOT NULL,
+        PRIMARY KEY (router_id, resolution, host_id, bucket)
+    ) WITHOUT ROWID
+'''
+
+INTERFACE_ROLLUP_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS interface_bandwidth_rollup (
+        router_id INTEGER NOT NULL,
+        resolution INTEGER NOT NULL,
+        interface_id INTEGER NOT NULL,
+        bucket INTEGER NOT NULL,
+        rx_sum INTEGER NOT NULL,
+        rx_min INTEGER NOT NULL,
+        rx_max INTEGER NOT NULL,
+        tx_sum INTEGER NOT NULL,
+        tx_min INTEGER NOT NULL,
+        tx_max INTEGER NOT NULL,
+        samples INTEGER NOT NULL,
+        PRIMARY KEY (router_id, resolution, interface_id, bucket)
+    ) WITHOUT ROWID
+'''
+
+# host_totals and interface_history read one router's window across every
+# host or interface. The primary keys are ordered by host/interface first,
+# so those reads get covering indexes ordered by bucket; host_history uses
+# the primary key. The queries group and order by ``+column`` so the planner
+# does not trade the bucket range for an index that is merely pre-sorted.
+ROLLUP_INDEXES = (
+    'CREATE INDEX IF NOT EXISTS idx_ip_rollup_router_bucket '
+    'ON ip_bandwidth_rollup (router_id, resolution, bucket, host_id, rx_sum, tx_sum)',
+    'CREATE INDEX IF NOT EXISTS idx_interface_rollup_router_bucket '
+    'ON interface_bandwidth_rollup (router_id, resolution, bucket, interface_id, rx_sum, tx_sum)',
+)
+
+_MERGE = '''
+        rx_sum = rx_sum + excluded.rx_sum,
+        rx_min = MIN(rx_min, excluded.rx_min),
+        rx_max = MAX(rx_max, excluded.rx_max),
+        tx_sum = tx_sum + excluded.tx_sum,
+        tx_min = MIN(tx_min, excluded.tx_min),
+        tx_max = MAX(tx_max, excluded.tx_max),
+        samples = samples + excluded.samples
+'''
+
+IP_ROLLUP_UPSERT = '''
+    INSERT INTO ip_bandwidth_rollup (router_id, resolution, host_id, bucket,
+                                     rx_sum, rx_min, rx_max, tx_sum, tx_min, tx_max, samples)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 1)
+    ON CONFLICT (router_id, resolution, host_id, bucket) DO UPDATE SET
+''' + _MERGE
+
+INTERFACE_ROLLUP_UPSERT = '''
+    INSERT INTO interface_bandwidth_rollup (router_id, resolution, interface_id, bucket,
+                                            rx_sum, rx_min, rx_max, tx_sum, tx_min, tx_max, samples)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 1)
+    ON CONFLICT (router_id, resolution, interface_id, bucket) DO UPDATE SET
+''' + _MERGE
+
+
+def ip_rollup_rows(rows, timestamp):
+    """Upsert parameters for ``(router_id, host_id, rx, tx)`` samples"""
+    params = []
+    for router_id, host_id, rx_bytes, tx_bytes in rows:
+        for tier in ROLLUP_TIERS:
+            params.append((router_id, tier.seconds, host_id, tier.bucket(timestamp),
+                           rx_bytes, rx_bytes, rx_bytes, tx_bytes, tx_bytes, tx_bytes))
+    return params
+
+
+def interface_rollup_rows(router_id, deltas, timestamp):
+    """Upsert parameters for per-interface ``{interface_id: (rx, tx)}`` counter deltas"""
+    params = []
+    for interface_id, (rx_bytes, tx_bytes) in deltas.items():
+        for tier in ROLLUP_TIERS:
+            params.append((router_id, tier.seconds, interface_id, tier.bucket(timestamp),
+                           rx_bytes, rx_bytes, rx_bytes, tx_bytes, tx_bytes, tx_bytes))
+    return params
+
+
+def choose_tier(period_seconds, min_points=None):
+    """Coarsest tier still giving ``min_points`` buckets over the period.
+
+    Returns None when raw samples are needed (short periods).
+    """
+    resolution = period_seconds / (min_points or ROLLUP_MIN_POINTS)
+    chosen = None
+    for tier in ROLLUP_TIERS:
+        if tier.seconds <= resolution and tier.retention >= period_seconds:
+            chosen = tier
+    return chosen
+
+
+def chart_tier(period_seconds, max_points=None, raw_days=None):
+    """Tier a chart of ``max_points`` points over the period reads (None: raw samples).
+
+    Like ``choose_tier`` with the points the chart shows as the minimum, so
+    a wide chart of a few days reads poll-resolution samples (hot days and
+    archive). Those only reach back ``raw_days``: a longer period reads
+    the rollups.
+    """
+    tier = choose_tier(period_seconds, max(max_points or 0, ROLLUP_MIN_POINTS))
+    if tier is None and raw_days is not None and period_seconds > raw_days * DAY:
+        return choose_tier(period_seconds)
+    return tier
+
+
+def format_bucket(bucket):
+    """Bucket start as a UTC string, for API output"""
+    return format_timestamp(bucket)
+
+
+def host_totals(conn, router_id, tier, since):
+    """Per-host (host_id, rx, tx) since an epoch"""
+    return conn.execute('''
+        SELECT host_id, SUM(rx_sum), SUM(tx_sum)
+        FROM ip_bandwidth_rollup
+        WHERE router_id = ? AND resolution = ? AND bucket >= ?
+        GROUP BY +host_id
+    ''', (router_id, tier.seconds, tier.bucket(since))).fetchall()
+
+
+def host_window_totals(conn, router_id, tier, sinces):
+    """``host_totals`` for several epochs at once, in one range read.
+
+    Like ``raw_host_window_totals``: the widest window is read once, with
+    the narrower ones as filtered sums over it. Returns one
+    [(host_id, rx, tx)] per entry of ``sinces``.
+    """
+    buckets = [tier.bucket(since) for since in sinces]
+    sums, params, starts = window_sums('bucket', 'rx_sum', 'tx_sum', buckets)
+    rows = conn.execute(f'''
+        SELECT host_id, {sums}
+        FROM ip_bandwidth_rollup
+        WHERE router_id = ? AND resolution = ? AND bucket >= ?
+        GROUP BY +host_id
+    ''', params + [router_id, tier.seconds, starts[0]]).fetchall()
+    return split_windows(rows, buckets, starts)
+
+
+def host_totals_by_window(conn, router_id, periods, now=None, archive=None):
+    """{name: [(host_id, rx, tx)]} over ``{name: seconds}`` periods ending now.
+
+    Each period reads the source ``choose_tier`` picks for it, as
+    ``host_totals`` / ``raw_host_totals`` callers do, but the periods
+    sharing a source are answered by one range read of it.
+    """
+    now = time.time() if now is None else now
+    sources = {}
+    for name, seconds in periods.items():
+        sources.setdefault(choose_tier(seconds), []).append(name)
+    totals = {}
+    for tier, names in sources.items():
+        sinces = [now - periods[name] for name in names]
+        if tier:
+            rows = host_window_totals(conn, router_id, tier, sinces)
+        else:
+            rows = raw_host_window_totals(conn, router_id, sinces, archive)
+        totals.update(zip(names, rows))
+    return {name: totals[name] for name in periods}
+
+
+def host_buckets(conn, router_id, tier, since):
+    """(bucket, host_id, rx, tx) of every host since an epoch, oldest first"""
+    return conn.execute('''
+        SELECT bucket, host_id, rx_sum, tx_sum
+        FROM ip_bandwidth_rollup
+        WHERE router_id = ? AND resolution = ? AND bucket >= ?
+        ORDER BY bucket
+    ''', (router_id, tier.seconds, tier.bucket(since))).fetchall()
+
+
+def host_history(conn, router_id, host_ids, tier, since):
+    """(bucket, rx, tx) summed over ``host_ids`` (one IP) since an epoch, oldest first"""
+    if not host_ids:
+        return []
+    return conn.execute(f'''
+        SELECT bucket, SUM(rx_sum), SUM(tx_sum)
+        FROM ip_bandwidth_rollup
+        WHERE router_id = ? AND resolution = ? AND host_id IN ({', '.join('?' for _ in host_ids)}) AND bucket >= ?
+        GROUP BY +bucket
+        ORDER BY +bucket
+    ''', (router_id, tier.seconds, *host_ids, tier.bucket(since))).fetchall()
+
+
+def interface_history(conn, router_id, tier, since):
+    """(interface_id, bucket, rx, tx) of every interface since an epoch"""
+    return conn.execute('''
+        SELECT interface_id, bucket, rx_sum, tx_sum
+        FROM interface_bandwidth_rollup
+        WHERE router_id = ? AND resolution = ? AND bucket >= ?
+        ORDER BY +interface_id, +bucket
+    ''', (router_id, tier.seconds, tier.bucket(since))).fetchall()
+
+
+def backfill_rollups(conn):
+    """Build the tiers from existing raw history (once, while they are empty).
+
+    Returns the number of buckets written. Does not commit.
+    """
+    changes = conn.total_changes
+    raw = (
+        ('ip_bandwidth_data', 'ip_bandwidth_rollup', 'host_id'),
+        ('interface_bandwidth_data', 'interface_bandwidth_rollup', 'interface_id'),
+    )
+    for table, rollup, id_column in raw:
+        source = all_partitions_source(conn, table, f'router_id, {id_column}, timestamp, rx_bytes, tx_bytes')
+        if not source or conn.execute(f'SELECT 1 FROM {rollup} LIMIT 1').fetchone() is not None:
+            continue
+        for tier in ROLLUP_TIERS:
+            conn.execute(f'''
+                INSERT INTO {rollup} (router_id, resolution, {id_column}, bucket,
+                                      rx_sum, rx_min, rx_max, tx_sum, tx_min, tx_max, samples)
+                SELECT router_id, ?, {id_column}, timestamp / ? * ? AS bucket,
+                       SUM(rx_bytes), MIN(rx_bytes), MAX(rx_bytes), SUM(tx_bytes), MIN(tx_bytes), MAX(tx_bytes),
+                       COUNT(*)
+                FROM ({source})
+                GROUP BY router_id, {id_column}, bucket
+            ''', (tier.seconds, tier.seconds, tier.seconds))
+    return conn.total_changes - changes
+
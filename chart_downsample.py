@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Server-side downsampling of bandwidth chart series.
+
+``/api/chart/bandwidth`` and ``/api/chart/interface_bandwidth`` return one
+point per raw sample or rollup bucket. However long the period, the
+browser only needs about as many points as the chart is wide, so the
+endpoints thin each series to ``max_points`` (``CHART_MAX_POINTS`` unless
+the request asks otherwise) with largest-triangle-three-buckets (LTTB).
+
+LTTB keeps the first and last point and splits the rest into
+``max_points - 2`` equal buckets. From each bucket it keeps the point
+forming the largest triangle with the point kept from the previous bucket
+and the average of the next bucket, so spikes and dips survive where a
+plain average or stride would flatten or skip them. Chart series have
+several values per timestamp (download and upload): the triangle areas
+of all of them are added up, so a peak in either one is kept.
+"""
+
+import os
+
+import numpy as np
+
+# Points a chart series is thinned to when the request has no 'max_points' (0 keeps every point)
+CHART_MAX_POINTS = int(os.environ.get('CHART_MAX_POINTS', '1000'))
+
+
+def chart_max_points(requested=None):
+    """Points a chart series is thinned to: ``requested``, else ``CHART_MAX_POINTS`` (0: all)"""
+    if requested and requested > 0:
+        return requested
+    return CHART_MAX_POINTS or None
+
+
+def lttb_indices(times, values, max_points):
+    """Indices of the points LTTB keeps out of ``times`` / ``values``.
+
+    ``times`` are the x values (epoch seconds, ascending), ``values`` one
+    y value or a sequence of y values per point. Returns every index when
+    there are no more than ``max_points`` points.
+    """
+    count = len(times)
+    if not max_points or count <= max_points or count < 3:
+        return list(range(count))
+    if max_points < 3:
+        return [0, count - 1][:max_points]
+    x = np.asarray(times, dtype=np.float64)
+    y = np.asarray(values, dtype=np.float64).reshape(count, -1)
+
+    # Bucket i (1 .. max_points - 2) holds points [edges[i - 1], edges[i])
+    edges = (1 + np.arange(max_points - 1) * ((count - 2) / (max_points - 2))).astype(np.int64)
+    edges[-1] = count - 1
+    kept = [0]
+    for i in range(1, max_points - 1):
+        start, stop = edges[i - 1], edges[i]
+        following = slice(stop, edges[i + 1] if i + 1 < max_points - 1 else count)
+        mean_x = x[following].mean()
+        mean_y = y[following].mean(axis=0)
+        prev = kept[-1]
+        # Twice the triangle areas; the factor does not change the argmax
+        areas = np.abs((x[prev] - mean_x) * (y[start:stop] - y[prev])
+                       - (x[prev] - x[start:stop, None]) * (mean_y - y[prev])).sum(axis=1)
+        kept.append(start + int(areas.argmax()))
+    kept.append(count - 1)
+    return kept
+
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+Timing-wheel scheduler for the bandwidth collector.
+
+Every (router, job) pair is placed on a grid of absolute due times:
+``due = k * interval + phase``. The next due time is always computed from
+that grid, never from when the previous poll finished, so a slow cycle
+does not push later ones back. Each router gets a stable phase derived
+from its id (golden-ratio spacing) so polls are spread evenly across the
+interval instead of hitting every router at the same instant, and jobs of
+one router that fall on the same tick share one poll (one session, one
+snapshot).
+
+Missed ticks are handled deterministically: if at most ``max_catch_up``
+ticks of a job were missed they are replayed back to back, otherwise the
+job skips ahead to its next future grid slot and the skipped ticks are
+counted. A tick that arrives while the previous poll of the same router is
+still running is skipped rather than overlapped.
+"""
+
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Job intervals in seconds
+JOB_INTERVALS = {
+    'bandwidth': float(os.environ.get('BANDWIDTH_INTERVAL', '60')),
+    'interface': float(os.environ.get('INTERFACE_INTERVAL', '60')),
+    'logs': float(os.environ.get('LOG_INTERVAL', '300')),
+    'status': float(os.environ.get('STATUS_INTERVAL', '60')),
+}
+
+# Missed ticks replayed per job before the scheduler skips ahead instead
+SCHEDULER_MAX_CATCH_UP = int(os.environ.get('SCHEDULER_MAX_CATCH_UP', '1'))
+
+# Golden ratio conjugate: consecutive router ids land far apart on the interval
+_PHASE_STEP = (math.sqrt(5) - 1) / 2
+
+
+def router_phase(router_id, interval, base_interval):
+    """Stable offset of a router's ticks within ``interval``.
+
+    When ``interval`` is a multiple of ``base_interval`` the offset lands on
+    one of the router's base ticks, so e.g. its 5-minute log job coincides
+    with one of its 1-minute bandwidth polls while the routers' log jobs
+    are still spread across the whole 5 minutes.
+    """
+    fraction = (router_id * _PHASE_STEP) % 1.0
+    ratio = interval / base_interval
+    if ratio >= 1 and ratio.is_integer():
+        return math.floor(fraction * ratio) * base_interval + fraction * base_interval
+    return fraction * interval
+
+
+def next_due(due, interval, now, max_catch_up):
+    """Next grid slot after a tick at ``due`` that fired at ``now``.
+
+    Returns (next due time, ticks skipped).
+    """
+    following = due + interval
+    missed = max(0, math.floor((now - due) / interval))
+    if missed <= max_catch_up:
+        return following, 0
+    # Too far behind: jump to the first slot after now
+    return due + (missed + 1) * interval, missed
+
+
+class TimingWheel:
+    """Hashed timing wheel: O(1) insert, due entries popped per tick"""
+
+    def __init__(self, tick=1.0, size=512):
+        self.tick = tick
+        self.size = size
+        self.slots = [[] for _ in range(size)]
+        self.current = None
+        self.count = 0
+
+    def schedule(self, due, item):
+        index = math.ceil(due / self.tick)
+        if self.current is not None:
+            index = max(index, self.current)
+        self.slots[index % self.size].append((index, due, item))
+        self.count += 1
+
+    def advance(self, now):
+        """Pop every entry due at or before ``now``, ordered by due time"""
+        target = math.floor(now / self.tick)
+        if self.current is None:
+            self.current = target
+        start = self.current
+        # After a long stall every slot has to be looked at exactly once
+        steps = min(target - start + 1, self.size)
+        fired = []
+        for offset in range(steps):
+            slot = self.slots[(start + offset) % self.size]
+            if not slot:
+                continue
+            keep = []
+            for entry in slot:
+                (fired if entry[0] <= target else keep).append(entry)
+            slot[:] = keep
+        self.current = target + 1
+        self.count -= len(fired)
+        fired.sort(key=lambda entry: entry[1])
+        return [(due, item) for _, due, item in fired]
+
+
+class CollectionScheduler:
+    """Runs router polls from a timing wheel on a bounded worker pool.
+
+    ``poll(router, jobs, cancelled)`` performs one poll of ``router`` for the
+    set of ``jobs``; ``load_routers()`` returns the router rows to schedule
+    (re-read every ``refresh_interval`` seconds); ``cancel(router_id)``
+    aborts a straggling poll. The optional ``gate(router_id, due)`` is asked
+    right before a poll is submitted and can veto it (sharded mode uses it
+    to fence polls with router leases).
+    """
+
+    def __init__(self, poll, load_routers, cancel, intervals=None, max_workers=16, deadline=45.0,
+                 max_catch_up=None, refresh_interval=30.0, clock=time.time, gate=None):
+        self.poll = poll
+        self.load_routers = load_routers
+        self.cancel = cancel
+        self.intervals = dict(intervals or JOB_INTERVALS)
+        self.base_interval = min(self.intervals.values())
+        self.deadline = deadline
+        self.max_catch_up = SCHEDULER_MAX_CATCH_UP if max_catch_up is None else max_catch_up
+        self.refresh_interval = refresh_interval
+        self.clock = clock
+        self.gate = gate
+        self.wheel = TimingWheel()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='collector')
+        self.routers = {}
+        self._generations = {}
+        self.running = {}
+        self.cancelled = set()
+        self._lock = threading.Lock()
+        self._last_refresh = None
+        self._stop = threading.Event()
+        self.stats = {'polls': 0, 'jobs': 0, 'skipped_ticks': 0, 'overlaps': 0, 'timed_out': 0, 'fenced': 0}
+
+    def refresh(self, now):
+        """Pick up added, removed and edited routers"""
+        routers = {router[0]: router for router in self.load_routers()}
+        for router_id in routers:
+            if router_id not in self.routers:
+                # A new generation orphans wheel entries left from an earlier
+                # stint (e.g. a router handed to another worker and back)
+                generation = self._generations.get(router_id, 0) + 1
+                self._generations[router_id] = generation
+                for job in self.intervals:
+                    self.wheel.schedule(self.first_due(router_id, job, now), (router_id, job, generation))
+        # Removed routers drop out lazily when their entries fire
+        self.routers = routers
+        self._last_refresh = now
+
+    def first_due(self, router_id, job, now):
+        interval = self.intervals[job]
+        phase = router_phase(router_id, interval, self.base_interval)
+        return math.ceil((now - phase) / interval) * interval + phase
+
+    def run_pending(self, now=None):
+        """Fire every tick due by ``now``; returns the polls submitted"""
+        now = self.clock() if now is None else now
+        if self._last_refresh is None or now - self._last_refresh >= self.refresh_interval:
+            self.refresh(now)
+
+        due_jobs = {}
+        due_ticks = {}
+        for due, (router_id, job, generation) in self.wheel.advance(now):
+            if router_id not in self.routers or generation != self._generations[router_id]:
+                continue
+            following, skipped = next_due(due, self.intervals[job], now, self.max_catch_up)
+            self.stats['skipped_ticks'] += skipped
+            self.wheel.schedule(following, (router_id, job, generation))
+            due_jobs.setdefault(router_id, set()).add(job)
+            due_ticks[router_id] = min(due, due_ticks.get(router_id, due))
+
+        submitted = []
+        for router_id, jobs in due_jobs.items():
+            # Overlap first: the gate records the tick as polled, which a skipped poll must not do.
+            # Only this thread adds to ``running``, so the router cannot start in between
+            with self._lock:
+                if router_id in self.running:
+                    self.stats['overlaps'] += 1
+                    continue
+            if self.gate is not None and not self.gate(router_id, due_ticks[router_id]):
+                self.stats['fenced'] += 1
+                continue
+            with self._lock:
+                self.cancelled.discard(router_id)
+                self.running[router_id] = self.clock()
+            future = self.executor.submit(self._run_poll, self.routers[router_id], jobs)
+            submitted.append((router_id, jobs, future))
+            self.stats['polls'] += 1
+            self.stats['jobs'] += len(jobs)
+
+        self.cancel_stragglers()
+        return submitted
+
+    def cancel_stragglers(self):
+        now = self.clock()
+        with self._lock:
+            late = [router_id for router_id, started in self.running.items()
+                    if now - started > self.deadline and router_id not in self.cancelled]
+            self.cancelled.update(late)
+        for router_id in late:
+            self.stats['timed_out'] += 1
+            self.cancel(router_id)
+
+    def _run_poll(self, router, jobs):
+        try:
+            return self.poll(router, jobs, self.cancelled)
+        finally:
+            with self._lock:
+                self.running.pop(router[0], None)
+
+    def run_forever(self):
+        while not self._stop.is_set():
+            try:
+                self.run_pending()
+            except Exception as e:
+                print(f"Error in collection scheduler: {e}")
+            # Wake on the next wheel tick boundary
+            self._stop.wait(self.wheel.tick - (self.clock() % self.wheel.tick))
+
+    def stop(self):
+        self._stop.set()
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+Durable interface counter snapshots for the bandwidth collector.
+
+The collector turns cumulative RouterOS interface counters into per-cycle
+deltas, which needs the previous sample. Keeping that only in memory meant
+every restart lost a cycle for the whole fleet. The last sample per router
+and interface is now written to ``collector_counter_state`` after each poll
+and loaded again at startup, so the first cycle after a restart still
+produces a delta.
+
+A stored sample is only trusted while it is fresh: anything older than
+``max_age`` seconds (or stamped in the future) is dropped and the router
+starts a new baseline, because a delta spanning a long outage would land
+in a single bucket.
+
+Counters going backwards are told apart using the router's uptime: if it
+is shorter than the time since the previous sample the router rebooted,
+its counters restarted from zero and the current values are the bytes
+moved since boot. Otherwise a counter near the top of its 64-bit range
+wrapped around, and anything else was a manual reset that re-baselines
+the interface.
+"""
+
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from db_pool import ConnectionPool
+
+# Oldest stored sample still used to compute a delta, in seconds
+COUNTER_STATE_MAX_AGE = float(os.environ.get('COUNTER_STATE_MAX_AGE', '300'))
+
+COUNTER_STATE_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS collector_counter_state (
+        router_id INTEGER NOT NULL,
+        interface_name TEXT NOT NULL,
+        rx_bytes INTEGER NOT NULL,
+        tx_bytes INTEGER NOT NULL,
+        sampled_at REAL NOT NULL,
+        PRIMARY KEY (router_id, interface_name),
+        FOREIGN KEY (router_id) REFERENCES routers (id)
+    )
+'''
+
+
+# RouterOS interface byte counters are 64-bit
+COUNTER_WRAP = 2 ** 64
+
+_UPTIME_UNITS = {'w': 604800, 'd': 86400, 'h': 3600, 'm': 60, 's': 1}
+
+
+def parse_uptime(uptime):
+    """Seconds in a RouterOS uptime ('2w1d5h33m12s' or '1d05:33:12'), None if unreadable"""
+    uptime = (uptime or '').strip()
+    match = re.fullmatch(r'((?:\d+[wdhms])*)(?:(\d+):(\d+):(\d+))?', uptime)
+    if not uptime or not match:
+        return None
+    seconds = sum(int(value) * _UPTIME_UNITS[unit] for value, unit in re.findall(r'(\d+)([wdhms])', match.group(1)))
+    if match.group(2) is not None:
+        seconds += int(match.group(2)) * 3600 + int(match.group(3)) * 60 + int(match.group(4))
+    return seconds
+
+
+class CounterSample:
+    """Interface counters of one router at one point in time"""
+
+    def __init__(self, counters, sampled_at, uptime=None):
+        self.counters = counters
+        self.sampled_at = sampled_at
+        self.uptime = uptime
+
+    def age(self, now=None):
+        return (now if now is not None else time.time()) - self.sampled_at
+
+
+class CounterDeltas(dict):
+    """{interface: (rx, tx)} bytes moved over ``seconds``"""
+
+    def __init__(self, deltas, seconds):
+        super().__init__(deltas)
+        self.seconds = seconds
+
+    def rates(self):
+        """{interface: (rx, tx)} in bits per second"""
+        if self.seconds <= 0:
+            return {name: (0.0, 0.0) for name in self}
+        return {name: (rx_bytes * 8 / self.seconds, tx_bytes * 8 / self.seconds)
+                for name, (rx_bytes, tx_bytes) in self.items()}
+
+
+def _signed(counter):
+    # SQLite integers are signed 64-bit; the top half is stored negative
+    return counter - COUNTER_WRAP if counter >= COUNTER_WRAP // 2 else counter
+
+
+def counter_delta(previous, current):
+    """Bytes between two readings of one counter, None after a manual reset"""
+    if current >= previous:
+        return current - previous
+    if previous >= COUNTER_WRAP // 2:
+        return current + COUNTER_WRAP - previous
+    return None
+
+
+def counter_deltas(previous, current):
+    """Per-interface (rx, tx) deltas between two samples.
+
+    After a reboot (uptime shorter than the time between the samples) the
+    deltas are the counters themselves, over the uptime. Otherwise new
+    interfaces and reset counters are left out; they start a fresh baseline
+    with ``current``.
+    """
+    elapsed = current.sampled_at - previous.sampled_at
+    if current.uptime is not None and current.uptime < elapsed:
+        return CounterDeltas(current.counters, current.uptime)
+    deltas = {}
+    for name, (rx_bytes, tx_bytes) in current.counters.items():
+        if name not in previous.counters:
+            continue
+        prev_rx, prev_tx = previous.counters[name]
+        rx_delta, tx_delta = counter_delta(prev_rx, rx_bytes), counter_delta(prev_tx, tx_bytes)
+        if rx_delta is None or tx_delta is None:
+            continue
+        deltas[name] = (rx_delta, tx_delta)
+    return CounterDeltas(deltas, elapsed)
+
+
+class CounterStateStore:
+    """Last counter sample per router, cached in memory and kept in SQLite"""
+
+    def __init__(self, db_path, max_age=None, db=None, writer=None):
+        self.db_path = db_path
+        self.db = db or ConnectionPool(db_path)
+        # The collector's single writer; without one samples are saved directly
+        self.writer = writer
+        self.max_age = max_age or COUNTER_STATE_MAX_AGE
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def load(self, now=None, router_id=None):
+        """Reload stored samples; returns the number of routers resumed.
+
+        At startup every router is loaded. With ``router_id`` only that
+        router's sample is replaced, e.g. when a sharded collector takes over
+        a router whose in-memory sample (if any) is from before another
+        worker polled it.
+        """
+        now = now if now is not None else time.time()
+        samples = {}
+        where, params = ('WHERE router_id = ?', (router_id,)) if router_id is not None else ('', ())
+        try:
+            with self.db.read() as conn:
+                rows = conn.execute(f'''
+                    SELECT router_id, interface_name, rx_bytes, tx_bytes, sampled_at
+                    FROM collector_counter_state {where}
+                ''', params).fetchall()
+        except sqlite3.OperationalError:
+            rows = []
+
+        for row_router_id, interface_name, rx_bytes, tx_bytes, sampled_at in rows:
+            sample = samples.setdefault(row_router_id, CounterSample({}, sampled_at))
+            sample.counters[interface_name] = (rx_bytes % COUNTER_WRAP, tx_bytes % COUNTER_WRAP)
+            sample.sampled_at = min(sample.sampled_at, sampled_at)
+
+        fresh = {key: sample for key, sample in samples.items() if self._is_fresh(sample, now)}
+        with self._lock:
+            if router_id is None:
+                self._samples = fresh
+            else:
+                self._samples.pop(router_id, None)
+                self._samples.update(fresh)
+        return len(fresh)
+
+    def previous(self, router_id, now=None):
+        """Last sample of a router, or None if there is none or it is stale"""
+        now = now if now is not None else time.time()
+        with self._lock:
+            sample = self._samples.get(router_id)
+        if sample is not None and not self._is_fresh(sample, now):
+            return None
+        return sample
+
+    def advance(self, router_id, counters, now=None, uptime=None):
+        """Record a new sample and return ``CounterDeltas`` since the last one.
+
+        ``uptime`` is the router's uptime in seconds, used to detect reboots.
+        Returns None when there was no usable previous sample (first poll, or
+        the stored one was stale), so callers can tell "no delta" from "zero".
+        """
+        now = now if now is not None else time.time()
+        current = CounterSample(dict(counters), now, uptime)
+        previous = self.previous(router_id, now)
+        self._save(router_id, current)
+        with self._lock:
+            self._samples[router_id] = current
+        if previous is None:
+            return None
+        return counter_deltas(previous, current)
+
+    def forget(self, router_id):
+        with self._lock:
+            self._samples.pop(router_id, None)
+        self._write(lambda conn: conn.execute('DELETE FROM collector_counter_state WHERE router_id = ?',
+                                              (router_id,)))
+
+    def _is_fresh(self, sample, now):
+        return 0 <= sample.age(now) <= self.max_age
+
+    def _save(self, router_id, sample):
+        def save(conn):
+            # Replace the router's whole sample so vanished interfaces go too
+            conn.execute('DELETE FROM collector_counter_state WHERE router_id = ?', (router_id,))
+            conn.executemany('''
+                INSERT INTO collector_counter_state (router_id, interface_name, rx_bytes, tx_bytes, sampled_at)
+                VALUES (?, ?, ?, ?, ?)
+            ''', [(router_id, name, _signed(rx_bytes), _signed(tx_bytes), sample.sampled_at)
+                  for name, (rx_bytes, tx_bytes) in sample.counters.items()])
+        self._write(save)
+
+    def _write(self, function):
+        """Queue ``function(conn)`` on the writer (batched with the samples), or run it in its own transaction"""
+        if self.writer is not None:
+            self.writer.submit_call(function)
+            return
+        with self.db.write() as conn:
+            function(conn)
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Pooled SQLite connections for the web app and the collector.
+
+Opening a connection per query reopens the file, re-reads the schema and
+throws away every prepared statement. ``ConnectionPool`` keeps idle
+connections instead, separately for reads and writes, and hands one to a
+single thread at a time (Flask serves each request on its own thread, so
+a per-thread connection would not outlive the request).
+
+Every connection gets its PRAGMAs once, when it is opened: a memory map
+of the file (``DB_MMAP_MB``), a page cache (``DB_CACHE_MB``), in-memory
+temp tables and a busy timeout. Read connections are also
+``query_only``, so a stray write on one fails loudly instead of taking the
+write lock. ``DB_STATEMENT_CACHE`` prepared statements are kept per
+connection, which is where reuse pays most: the same few queries run on
+every page view.
+"""
+
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# Idle connections kept per kind (read / write)
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '8'))
+# Prepared statements cached per connection
+DB_STATEMENT_CACHE = int(os.environ.get('DB_STATEMENT_CACHE', '256'))
+# Bytes of the database file memory-mapped per connection, in MB
+DB_MMAP_MB = int(os.environ.get('DB_MMAP_MB', '256'))
+# Page cache per connection, in MB
+DB_CACHE_MB = int(os.environ.get('DB_CACHE_MB', '32'))
+# Seconds a connection waits for a lock before failing
+DB_BUSY_TIMEOUT = float(os.environ.get('DB_BUSY_TIMEOUT', '30'))
+
+
+class ConnectionPool:
+    """Reusable read and write connections to one database"""
+
+    def __init__(self, db_path, size=None, statement_cache=None):
+        self.db_path = db_path
+        self.size = size or DB_POOL_SIZE
+        self.statement_cache = statement_cache or DB_STATEMENT_CACHE
+        self._idle = {True: [], False: []}
+        self._lock = threading.Lock()
+        self.opened = 0
+
+    def _connect(self, read_only):
+        conn = sqlite3.connect(self.db_path, timeout=DB_BUSY_TIMEOUT, cached_statements=self.statement_cache,
+                               check_same_thread=False)
+        conn.execute(f'PRAGMA mmap_size = {DB_MMAP_MB * 1024 * 1024}')
+        conn.execute(f'PRAGMA cache_size = -{DB_CACHE_MB * 1024}')
+        conn.execute('PRAGMA temp_store = MEMORY')
+        if read_only:
+            conn.execute('PRAGMA query_only = ON')
+        with self._lock:
+            self.opened += 1
+        return conn
+
+    def acquire(self, read_only=True):
+        with self._lock:
+            idle = self._idle[read_only]
+            conn = idle.pop() if idle else None
+        return conn if conn is not None else self._connect(read_only)
+
+    def release(self, conn, read_only=True):
+        # Never hand on an open transaction (or the read snapshot it pins)
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            idle = self._idle[read_only]
+            if len(idle) < self.size:
+                idle.append(conn)
+                return
+        conn.close()
+
+    @contextmanager
+    def read(self):
+        """A ``query_only`` connection for the duration of the block"""
+        conn = self.acquire(True)
+        try:
+            yield conn
+        finally:
+            self.release(conn, True)
+
+    @contextmanager
+    def write(self):
+        """A write connection; the block is committed, or rolled back if it raises"""
+        conn = self.acquire(False)
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            self.release(conn, False)
+
+    def close(self):
+        """Close every idle connection"""
+        with self._lock:
+            idle = self._idle[True] + self._idle[False]
+            self._idle = {True: [], False: []}
+        for conn in idle:
+            conn.close()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Dimension catalog for bandwidth facts.
+
+Bandwidth rows used to repeat the IP address, MAC address and hostname (or
+the interface name) as text in every sample, which made up most of the
+database and index size. Those values now live once in two small
+dictionary tables. ``hosts`` holds one row per distinct (IP, MAC, hostname)
+and ``interfaces`` one row per interface name. Fact tables (the raw day
+partitions and the rollup tiers) store only the integer ids plus counters.
+
+``DimensionCatalog`` keeps both dictionaries in memory in the collector and
+in the web app. Ids only ever grow, so ``refresh`` just reads the rows past
+the highest id it has seen. New values are inserted through the collector's
+writer when one is given, so the single-writer rule still holds.
+
+Empty MAC addresses and hostnames are stored as '' (NULLs would defeat the
+UNIQUE constraint) and come back out as None.
+"""
+
+import heapq
+import sqlite3
+import threading
+
+from db_pool import ConnectionPool
+
+HOST_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS hosts (
+        id INTEGER PRIMARY KEY,
+        ip_address TEXT NOT NULL,
+        mac_address TEXT NOT NULL DEFAULT '',
+        hostname TEXT NOT NULL DEFAULT '',
+        UNIQUE (ip_address, mac_address, hostname)
+    )
+'''
+
+INTERFACE_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS interfaces (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL UNIQUE
+    )
+'''
+
+# Join a text-encoded bandwidth table ``t`` to its host row
+HOST_JOIN = '''
+    JOIN hosts h ON h.ip_address = t.ip_address
+        AND h.mac_address = COALESCE(t.mac_address, '') AND h.hostname = COALESCE(t.hostname, '')
+'''
+
+
+def host_key(ip_address, mac_address, hostname):
+    return (ip_address, mac_address or '', hostname or '')
+
+
+def register_hosts_from(conn, table):
+    """Add every host of a text-encoded table to the catalog (migrations)"""
+    conn.execute(f'''
+        INSERT OR IGNORE INTO hosts (ip_address, mac_address, hostname)
+        SELECT DISTINCT ip_address, COALESCE(mac_address, ''), COALESCE(hostname, '') FROM {table}
+    ''')
+
+
+def register_interfaces_from(conn, table):
+    """Add every interface name of a text-encoded table to the catalog (migrations)"""
+    conn.execute(f'INSERT OR IGNORE INTO interfaces (name) SELECT DISTINCT interface_name FROM {table}')
+
+
+class DimensionCatalog:
+    """In-memory id <-> value maps for hosts and interfaces"""
+
+    def __init__(self, db_path, writer=None, db=None):
+        self.db_path = db_path
+        self.db = db or ConnectionPool(db_path)
+        self.writer = writer
+        self.hosts = {}
+        self.host_keys = {}
+        self.ip_hosts = {}
+        self.interfaces = {}
+        self.interface_keys = {}
+        self._last_host = 0
+        self._last_interface = 0
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        """Load rows added since the last refresh (by this or any other process)"""
+        with self._lock:
+            last_host, last_interface = self._last_host, self._last_interface
+        try:
+            with self.db.read() as conn:
+                hosts = conn.execute('SELECT id, ip_address, mac_address, hostname FROM hosts WHERE id > ?',
+                                     (last_host,)).fetchall()
+                interfaces = conn.execute('SELECT id, name FROM interfaces WHERE id > ?',
+                                          (last_interface,)).fetchall()
+        except sqlite3.OperationalError:
+            hosts, interfaces = [], []
+        with self._lock:
+            for host_id, ip_address, mac_address, hostname in hosts:
+                if host_id in self.hosts:
+                    continue
+                self.hosts[host_id] = (ip_address, mac_address, hostname)
+                self.host_keys[(ip_address, mac_address, hostname)] = host_id
+                self.ip_hosts.setdefault(ip_address, []).append(host_id)
+                self._last_host = max(self._last_host, host_id)
+            for interface_id, name in interfaces:
+                self.interfaces[interface_id] = name
+                self.interface_keys[name] = interface_id
+                self._last_interface = max(self._last_interface, interface_id)
+
+    def host_ids(self, hosts):
+        """Ids for ``(ip, mac, hostname)`` tuples, adding unknown hosts"""
+        keys = [host_key(*host) for host in hosts]
+        missing = self._missing(keys, self.host_keys)
+        if missing:
+            self._add(lambda conn: conn.executemany(
+                'INSERT OR IGNORE INTO hosts (ip_address, mac_address, hostname) VALUES (?, ?, ?)', missing))
+        with self._lock:
+            return [self.host_keys[key] for key in keys]
+
+    def interface_ids(self, names):
+        """{name: id} for interface names, adding unknown ones"""
+        names = list(names)
+        missing = self._missing(names, self.interface_keys)
+        if missing:
+            self._add(lambda conn: conn.executemany(
+                'INSERT OR IGNORE INTO interfaces (name) VALUES (?)', [(name,) for name in missing]))
+        with self._lock:
+            return {name: self.interface_keys[name] for name in names}
+
+    def host(self, host_id):
+        """(ip, mac or None, hostname or None) of a host id"""
+        if host_id not in self.hosts:
+            self.refresh()
+        ip_address, mac_address, hostname = self.hosts[host_id]
+        return ip_address, mac_address or None, hostname or None
+
+    def host_ids_for_ip(self, ip_address):
+        """Every host id recorded for an IP (one per MAC/hostname it had)"""
+        self.refresh()
+        with self._lock:
+            return list(self.ip_hosts.get(ip_address, ()))
+
+    def totals_by_ip(self, host_totals, limit=None):
+        """Fold (host_id, rx, tx) rows into (ip, mac, hostname, rx, tx) per IP, largest first.
+
+        The MAC and hostname shown are those of the newest host of the IP.
+        ``limit`` keeps the largest IPs only, without sorting the rest.
+        """
+        totals = {}
+        for host_id, rx_bytes, tx_bytes in host_totals:
+            ip_address, mac_address, hostname = self.host(host_id)
+            entry = totals.setdefault(ip_address, [host_id, mac_address, hostname, 0, 0])
+            if host_id >= entry[0]:
+                entry[0:3] = [host_id, mac_address or entry[1], hostname or entry[2]]
+            entry[3] += rx_bytes or 0
+            entry[4] += tx_bytes or 0
+        rows = [(ip_address, mac_address, hostname, rx_bytes, tx_bytes)
+                for ip_address, (_, mac_address, hostname, rx_bytes, tx_bytes) in totals.items()]
+        if limit is not None:
+            return heapq.nlargest(limit, rows, key=lambda row: row[3] + row[4])
+        return sorted(rows, key=lambda row: row[3] + row[4], reverse=True)
+
+    def interface_name(self, interface_id):
+        if interface_id not in self.interfaces:
+            self.refresh()
+        return self.interfaces[interface_id]
+
+    def _missing(self, keys, known):
+        with self._lock:
+            missing = list(dict.fromkeys(key for key in keys if key not in known))
+        if missing:
+            # Another process may have added them already
+            self.refresh()
+            with self._lock:
+                missing = [key for key in missing if key not in known]
+        return missing
+
+    def _add(self, function):
+        if self.writer is not None:
+            self.writer.submit_call(function, wait=True)
+        else:
+            with self.db.write() as conn:
+                function(conn)
+        self.refresh()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Per-flow byte deltas from RouterOS connection tracking.
+
+Conntrack rows carry cumulative ``orig-bytes``/``repl-bytes`` counters per
+connection. ``FlowDeltaEngine`` remembers the counters of every flow (keyed
+by its 5-tuple: protocol plus source and destination address and port)
+from the previous cycle and reports how many bytes each flow moved since.
+Only flows whose counters changed are rolled up per internal IP, so every
+byte in ``ip_bandwidth_data`` was really seen on the router.
+
+Rules:
+
+* the first cycle after start only records a baseline (no deltas);
+* a flow that appears later counts its full counters (it started since);
+* counters that went backwards mean the 5-tuple was reused by a new
+  connection, so the new counters are the delta;
+* flows missing from a cycle have expired and are forgotten.
+"""
+
+from router_snapshot import address_in_networks, connection_bytes
+
+# Columns needed to key flows and read their counters
+FLOW_COLUMNS = ('protocol', 'src-address', 'dst-address', 'orig-bytes', 'repl-bytes', 'bytes')
+
+
+def flow_key(row):
+    """5-tuple of a conntrack row ('address:port' strings keep the ports)"""
+    return (row.get('protocol', ''), row.get('src-address', ''), row.get('dst-address', ''))
+
+
+def strip_port(address):
+    """'192.168.1.10:443' -> '192.168.1.10' (IPv6 addresses are left alone)"""
+    return address.rsplit(':', 1)[0] if address.count(':') == 1 else address
+
+
+class FlowDeltaEngine:
+    """Previous conntrack counters of one router and the deltas between cycles"""
+
+    def __init__(self):
+        self.flows = {}
+        self.primed = False
+        self.stats = {'flows': 0, 'changed': 0, 'new': 0, 'reset': 0, 'expired': 0}
+
+    def update(self, rows):
+        """Feed one cycle of conntrack rows; returns {5-tuple: (orig, repl) delta}.
+
+        Only flows that moved bytes since the previous cycle are returned.
+        """
+        current = {}
+        deltas = {}
+        new = reset = 0
+        for row in rows:
+            key = flow_key(row)
+            if not key[1] or not key[2]:
+                continue
+            orig, repl = connection_bytes(row)
+            # Duplicate keys in one listing: keep the larger counters
+            if key in current:
+                orig, repl = max(orig, current[key][0]), max(repl, current[key][1])
+            current[key] = (orig, repl)
+
+        for key, (orig, repl) in current.items():
+            previous = self.flows.get(key)
+            if previous is None:
+                if not self.primed:
+                    continue
+                new += 1
+                delta = (orig, repl)
+            elif orig < previous[0] or repl < previous[1]:
+                reset += 1
+                delta = (orig, repl)
+            elif orig == previous[0] and repl == previous[1]:
+                continue
+            else:
+                delta = (orig - previous[0], repl - previous[1])
+            if delta[0] or delta[1]:
+                deltas[key] = delta
+
+        expired = sum(1 for key in self.flows if key not in current)
+        self.flows = current
+        self.primed = True
+        self.stats = {'flows': len(current), 'changed': len(deltas), 'new': new,
+                      'reset': reset, 'expired': expired}
+        return deltas
+
+
+def rollup_by_ip(deltas, internal_ips, internal_networks=()):
+    """Sum flow deltas per internal IP as {ip: [rx_bytes, tx_bytes]}.
+
+    An IP is internal if it is in ``internal_ips`` or lies in one of the
+    ``internal_networks`` (from ``compile_networks``).
+
+    ``orig`` bytes travel from the flow's source to its destination and
+    ``repl`` bytes back, so an internal source uploads ``orig`` and
+    downloads ``repl``; an internal destination the other way round.
+    """
+    internal = {}
+
+    def is_internal(ip):
+        if ip not in internal:
+            internal[ip] = ip in internal_ips or address_in_networks(ip, internal_networks)
+        return internal[ip]
+
+    traffic = {}
+    for (_, src, dst), (orig, repl) in deltas.items():
+        src_ip = strip_port(src)
+        dst_ip = strip_port(dst)
+        if is_internal(src_ip):
+            totals = traffic.setdefault(src_ip, [0, 0])
+            totals[0] += repl
+            totals[1] += orig
+        if is_internal(dst_ip):
+            totals = traffic.setdefault(dst_ip, [0, 0])
+            totals[0] += orig
+            totals[1] += repl
+    return traffic
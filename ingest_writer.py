@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+Single-writer ingestion queue for the collector.
+
+Collector workers no longer open a connection and commit for every write.
+They put row batches (or small write callables) on a queue, and one writer
+thread drains it. Everything that arrives within a flush window (up to
+``batch_size`` rows or ``max_latency`` seconds after the first item) is
+written in a single transaction. The database runs in WAL mode, so the web
+app's reads do not wait for those commits.
+
+``metrics()`` reports queue depth, rows and commits written, and commit
+latency; the writer also prints a summary every ``metrics_interval``.
+
+Callers waiting on a write give up after ``INGEST_WAIT_TIMEOUT`` seconds.
+If the writer thread itself dies (it cannot open the database, say), the
+error is raised to every waiting caller and to every later submission
+instead of leaving them blocked on a queue nobody drains.
+"""
+
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+INGEST_BATCH_SIZE = int(os.environ.get('INGEST_BATCH_SIZE', '5000'))
+INGEST_MAX_LATENCY = float(os.environ.get('INGEST_MAX_LATENCY', '1.0'))
+INGEST_METRICS_INTERVAL = float(os.environ.get('INGEST_METRICS_INTERVAL', '60'))
+INGEST_WAIT_TIMEOUT = float(os.environ.get('INGEST_WAIT_TIMEOUT', '60'))
+
+
+def enable_wal(conn):
+    """Switch a database to write-ahead logging (persistent per file)"""
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+
+
+class _Write:
+    """One queued unit: ``executemany(sql, rows)`` or ``function(conn)``"""
+
+    def __init__(self, sql=None, rows=None, function=None, done=None):
+        self.sql = sql
+        self.rows = rows or []
+        self.function = function
+        self.done = done
+        self.error = None
+
+    @property
+    def size(self):
+        return len(self.rows) if self.sql else 1
+
+    def apply(self, conn):
+        if self.sql:
+            conn.executemany(self.sql, self.rows)
+        else:
+            self.function(conn)
+
+
+class IngestWriter:
+    """Owns the only write connection of the process and batches commits"""
+
+    def __init__(self, db_path, batch_size=None, max_latency=None, metrics_interval=None):
+        self.db_path = db_path
+        self.batch_size = batch_size or INGEST_BATCH_SIZE
+        self.max_latency = INGEST_MAX_LATENCY if max_latency is None else max_latency
+        self.metrics_interval = metrics_interval or INGEST_METRICS_INTERVAL
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stopping = False
+        # The exception that killed the writer thread, raised to every caller from then on
+        self._fatal = None
+        self._metrics = {'rows': 0, 'writes': 0, 'commits': 0, 'failed': 0,
+                         'commit_seconds': 0.0, 'max_commit_seconds': 0.0, 'last_commit_seconds': 0.0,
+                         'max_queue_depth': 0}
+        self._last_report = time.monotonic()
+
+    def submit(self, sql, rows):
+        """Queue rows for ``executemany(sql, rows)``"""
+        rows = list(rows)
+        if rows:
+            self._put(_Write(sql=sql, rows=rows))
+
+    def submit_call(self, function, wait=False, timeout=None):
+        """Queue ``function(conn)`` to run inside the writer's transaction.
+
+        ``function`` must not commit. With ``wait`` the call blocks until
+        the write is committed (at most ``timeout``, by default
+        ``INGEST_WAIT_TIMEOUT`` seconds) and re-raises its error.
+        """
+        write = _Write(function=function, done=threading.Event() if wait else None)
+        self._put(write)
+        if wait:
+            if not write.done.wait(INGEST_WAIT_TIMEOUT if timeout is None else timeout):
+                raise TimeoutError('Ingest write not committed in time')
+            if write.error is not None:
+                raise write.error
+
+    def flush(self, timeout=None):
+        """Block until everything queued so far is committed"""
+        self.submit_call(lambda conn: None, wait=True, timeout=timeout)
+
+    def metrics(self):
+        with self._lock:
+            metrics = dict(self._metrics)
+        metrics['queue_depth'] = self._queue.qsize()
+        metrics['avg_commit_seconds'] = (metrics['commit_seconds'] / metrics['commits']
+                                         if metrics['commits'] else 0.0)
+        return metrics
+
+    def stop(self, timeout=10):
+        if self._thread is None or self._fatal is not None:
+            return
+        self.flush(timeout)
+        self._stopping = True
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def _put(self, write):
+        self._start()
+        with self._lock:
+            # Checked under the lock the dying writer fails the queue under: nothing is left behind
+            if self._fatal is not None:
+                raise self._fatal
+            self._queue.put(write)
+            self._metrics['max_queue_depth'] = max(self._metrics['max_queue_depth'], self._queue.qsize())
+
+    def _start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='ingest-writer', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        batch = []
+        try:
+            self._drain(batch)
+        except Exception as e:
+            print(f"Ingest writer stopped: {e}")
+            self._fail(e, batch)
+
+    def _fail(self, error, batch):
+        """Record the writer's fatal ``error`` and raise it in every write still waiting"""
+        with self._lock:
+            self._fatal = error
+            pending = list(batch)
+            while True:
+                try:
+                    write = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if write is not None:
+                    pending.append(write)
+        for write in pending:
+            if write.done is not None and not write.done.is_set():
+                write.error = error
+                write.done.set()
+
+    def _drain(self, batch):
+        """Commit queued writes until stopped; ``batch`` holds the writes in flight"""
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        try:
+            enable_wal(conn)
+            while True:
+                batch.clear()
+                first = self._queue.get()
+                if first is None:
+                    break
+                batch.append(first)
+                rows = first.size
+                deadline = time.monotonic() + self.max_latency
+                # A caller blocked on a write closes the window early
+                while rows < self.batch_size and batch[-1].done is None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        write = self._queue.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+                    if write is None:
+                        self._queue.put(None)
+                        break
+                    batch.append(write)
+                    rows += write.size
+                self._commit(conn, batch)
+                self._report()
+        finally:
+            conn.close()
+
+    def _commit(self, conn, batch):
+        start = time.monotonic()
+        try:
+            self._apply(conn, batch)
+        except Exception as e:
+            # One bad write must not take the whole window down with it
+            print(f"Ingest batch of {len(batch)} writes failed ({e}); retrying one by one")
+            for write in batch:
+                try:
+                    self._apply(conn, [write])
+                except Exception as write_error:
+                    write.error = write_error
+                    with self._lock:
+                        self._metrics['failed'] += 1
+                    print(f"Dropped ingest write: {write_error}")
+        elapsed = time.monotonic() - start
+
+        with self._lock:
+            self._metrics['writes'] += len(batch)
+            self._metrics['rows'] += sum(write.size for write in batch if write.error is None)
+            self._metrics['commits'] += 1
+            self._metrics['commit_seconds'] += elapsed
+            self._metrics['last_commit_seconds'] = elapsed
+            self._metrics['max_commit_seconds'] = max(self._metrics['max_commit_seconds'], elapsed)
+        for write in batch:
+            if write.done is not None:
+                write.done.set()
+
+    @staticmethod
+    def _apply(conn, batch):
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for write in batch:
+                write.apply(conn)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def _report(self):
+        now = time.monotonic()
+        if now - self._last_report < self.metrics_interval:
+            return
+        self._last_report = now
+        metrics = self.metrics()
+        print(f"Ingest: {metrics['rows']} rows in {metrics['commits']} commits, "
+              f"queue depth {metrics['queue_depth']} (max {metrics['max_queue_depth']}), "
+              f"commit latency avg {metrics['avg_commit_seconds'] * 1000:.1f} ms, "
+              f"max {metrics['max_commit_seconds'] * 1000:.1f} ms")
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""
+Incremental RouterOS log collection with a persisted per-router cursor.
+
+Each router keeps a high-water mark (the RouterOS ``.id`` of the last log
+line stored, plus its time and a content hash) in ``router_log_cursors``.
+A poll first lists only the ``.id`` column of ``/log``, then fetches the
+full rows of the lines after the cursor, so an unchanged buffer costs a
+few bytes per line instead of the whole buffer. The hash detects a router
+reboot that restarted ``.id`` numbering, in which case the whole buffer is
+taken again. New lines and the cursor are written in one transaction with
+``executemany`` instead of a ``SELECT`` per line.
+
+``LogFollower`` is the optional streaming mode: it keeps a
+``/log/print follow-only`` session open on the asyncio engine and ingests
+lines as the router emits them.
+"""
+
+import asyncio
+import hashlib
+import threading
+import time
+
+from router_snapshot import RouterQuery, any_of, equals
+
+LOG_CURSOR_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS router_log_cursors (
+        router_id INTEGER PRIMARY KEY,
+        last_id TEXT,
+        last_time TEXT,
+        last_hash TEXT,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (router_id) REFERENCES routers (id)
+    )
+'''
+
+LOG_COLUMNS = ('.id', 'time', 'topics', 'message')
+
+# Above this many new lines one plain /log print is cheaper than id lookups
+FETCH_BY_ID_LIMIT = 200
+FETCH_CHUNK = 50
+
+
+def classify_severity(message):
+    """Map a log message to the severity buckets used by the UI"""
+    message_lower = message.lower()
+    if 'critical' in message_lower or 'fatal' in message_lower or 'emergency' in message_lower:
+        return 'critical'
+    elif 'warning' in message_lower or 'warn' in message_lower:
+        return 'warning'
+    elif 'error' in message_lower or 'err' in message_lower:
+        return 'error'
+    elif 'info' in message_lower:
+        return 'info'
+    elif 'debug' in message_lower:
+        return 'debug'
+    return 'other'
+
+
+def log_id(row):
+    """RouterOS ``.id`` of a log row (routeros_api strips the dot)"""
+    return row.get('.id') or row.get('id')
+
+
+def log_id_value(value):
+    """Numeric value of a RouterOS id such as '*1A2B'"""
+    try:
+        return int(value.lstrip('*'), 16)
+    except (AttributeError, ValueError):
+        return -1
+
+
+def line_hash(row):
+    text = f"{row.get('time', '')}|{row.get('topics', '')}|{row.get('message', '')}"
+    return hashlib.sha1(text.encode('utf-8', errors='replace')).hexdigest()[:16]
+
+
+def load_cursor(conn, router_id):
+    row = conn.execute('SELECT last_id, last_time, last_hash FROM router_log_cursors WHERE router_id = ?',
+                       (router_id,)).fetchone()
+    if not row:
+        return None
+    return {'last_id': row[0], 'last_time': row[1], 'last_hash': row[2]}
+
+
+def plan_fetch(ids, cursor):
+    """Decide which log lines to download given the ids on the router.
+
+    Returns (ids to fetch, or None for the whole buffer; cursor id to verify).
+    """
+    if not ids:
+        return [], None
+    if not cursor or not cursor.get('last_id'):
+        return None, None
+
+    last_value = log_id_value(cursor['last_id'])
+    values = {value: log_id_value(value) for value in ids}
+    if max(values.values()) < last_value:
+        # Ids went backwards: the router rebooted and the buffer restarted
+        return None, None
+
+    new_ids = sorted((value for value in ids if values[value] > last_value), key=values.get)
+    verify_id = cursor['last_id'] if cursor['last_id'] in values else None
+    if len(new_ids) > FETCH_BY_ID_LIMIT:
+        return None, verify_id
+    return new_ids, verify_id
+
+
+def select_new_rows(rows, cursor, verify_id):
+    """Keep the rows after the cursor; returns (new rows, reset detected)"""
+    rows = sorted(rows, key=lambda row: log_id_value(log_id(row)))
+    if not cursor or not cursor.get('last_id'):
+        return rows, False
+
+    last_value = log_id_value(cursor['last_id'])
+    if verify_id is not None:
+        anchor = next((row for row in rows if log_id(row) == verify_id), None)
+        if anchor is not None and line_hash(anchor) != cursor.get('last_hash'):
+            # Same id, different line: numbering restarted after a reboot
+            return rows, True
+    if rows and max(log_id_value(log_id(row)) for row in rows) < last_value:
+        return rows, True
+    return [row for row in rows if log_id_value(log_id(row)) > last_value], False
+
+
+def id_queries(ids):
+    """Query words selecting exactly ``ids`` (OR-ed on the router)"""
+    return any_of(*(equals('.id', value) for value in ids))
+
+
+def fetch_new_logs(snapshot, cursor):
+    """Fetch only the log lines newer than ``cursor`` through a snapshot"""
+    ids = [log_id(row) for row in snapshot.query(RouterQuery('/log', ('.id',)))]
+    wanted, verify_id = plan_fetch(ids, cursor)
+
+    if wanted is None:
+        rows = snapshot.query(RouterQuery('/log', LOG_COLUMNS))
+    else:
+        lookup = wanted + ([verify_id] if verify_id else [])
+        rows = []
+        for start in range(0, len(lookup), FETCH_CHUNK):
+            chunk = lookup[start:start + FETCH_CHUNK]
+            rows.extend(snapshot.query(RouterQuery('/log', LOG_COLUMNS, id_queries(chunk))))
+
+    new_rows, reset = select_new_rows(rows, cursor, verify_id)
+    if reset and wanted is not None:
+        rows = snapshot.query(RouterQuery('/log', LOG_COLUMNS))
+        new_rows = sorted(rows, key=lambda row: log_id_value(log_id(row)))
+    return new_rows
+
+
+def store_logs(conn, router_id, rows, cursor=None):
+    """Insert new log lines and advance the cursor.
+
+    ``cursor`` is the one ``rows`` were selected against. The stored cursor
+    is read again here: if another poll (the collector and the
+    ``/router_logs`` page, say) moved it meanwhile, only the lines past it
+    are inserted, so the same lines are never stored twice.
+
+    Does not commit: the caller owns the transaction, which must hold the
+    write lock from the start (``BEGIN IMMEDIATE``, as the ingest writer
+    does), so lines and cursor always land together.
+    """
+    current = load_cursor(conn, router_id)
+    if current != cursor and current and current.get('last_id'):
+        last_value = log_id_value(current['last_id'])
+        rows = [row for row in rows if log_id_value(log_id(row)) > last_value]
+    if not rows:
+        return 0
+    stored_at = int(time.time())
+    batch = []
+    for row in rows:
+        message = row.get('message', '')
+        batch.append((router_id, row.get('time', ''), row.get('topics', ''), message,
+                      classify_severity(message), stored_at))
+    last = rows[-1]
+    conn.executemany('''
+        INSERT INTO router_logs (router_id, timestamp, topics, message, severity, stored_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', batch)
+    conn.execute('''
+        INSERT INTO router_log_cursors (router_id, last_id, last_time, last_hash, updated_at)
+        VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+        ON CONFLICT(router_id) DO UPDATE SET
+            last_id = excluded.last_id, last_time = excluded.last_time,
+            last_hash = excluded.last_hash, updated_at = excluded.updated_at
+    ''', (router_id, log_id(last), last.get('time', ''), line_hash(last)))
+    return len(batch)
+
+
+def save_logs(db, router_id, rows, writer=None, cursor=None):
+    """Store log lines in their own transaction (``db`` is a ``ConnectionPool``), or queue them on ``writer``"""
+    if not rows:
+        return 0
+    if writer is not None:
+        writer.submit_call(lambda conn: store_logs(conn, router_id, rows, cursor))
+        return len(rows)
+    with db.write() as conn:
+        conn.execute('BEGIN IMMEDIATE')
+        return store_logs(conn, router_id, rows, cursor)
+
+
+def collect_new_logs(db, router_id, snapshot, writer=None):
+    """Transfer and store only log lines the router emitted since last poll"""
+    with db.read() as conn:
+        cursor = load_cursor(conn, router_id)
+    rows = fetch_new_logs(snapshot, cursor)
+    return save_logs(db, router_id, rows, writer, cursor)
+
+
+class LogFollower:
+    """Streams ``/log`` of one router into the database as lines arrive.
+
+    Runs on the asyncio engine with its own session; after a disconnect it
+    reconnects with backoff and catches up through the cursor first.
+    """
+
+    def __init__(self, engine, db, router_id, host, port, username, password,
+                 flush_interval=1.0, max_backoff=60.0, writer=None):
+        self.engine = engine
+        self.db = db
+        self.writer = writer
+        self.router_id = router_id
+        self.credentials = (host, port, username, password)
+        self.flush_interval = flush_interval
+        self.max_backoff = max_backoff
+        self.lines_ingested = 0
+        self._future = None
+        # Keeps catch-up and buffered stores in order
+        self._store_lock = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        self._future = asyncio.run_coroutine_threadsafe(self._run(), self.engine.loop)
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._future is not None:
+            self._future.cancel()
+
+    async def _run(self):
+        from routeros_async import AsyncRouterOsClient
+
+        backoff = 1.0
+        loop = asyncio.get_running_loop()
+        self._store_lock = asyncio.Lock()
+        while not self._stopped.is_set():
+            host, port, username, password = self.credentials
+            client = AsyncRouterOsClient(host, port, username, password)
+            try:
+                await client.connect()
+                backoff = 1.0
+                await self._catch_up(client, loop)
+                await self._follow(client, loop)
+            except asyncio.CancelledError:
+                await client.close()
+                raise
+            except Exception as e:
+                print(f"Log follower for router {self.router_id} disconnected: {e}")
+            await client.close()
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, self.max_backoff)
+
+    async def _catch_up(self, client, loop):
+        with self.db.read() as conn:
+            cursor = load_cursor(conn, self.router_id)
+        ids = [log_id(row) for row in await client.print('/log', proplist=('.id',))]
+        wanted, verify_id = plan_fetch(ids, cursor)
+        if wanted is None:
+            rows = await client.print('/log', proplist=LOG_COLUMNS)
+        else:
+            lookup = wanted + ([verify_id] if verify_id else [])
+            rows = []
+            for start in range(0, len(lookup), FETCH_CHUNK):
+                queries = ['?' + word for word in id_queries(lookup[start:start + FETCH_CHUNK])]
+                rows.extend(await client.print('/log', proplist=LOG_COLUMNS, queries=queries))
+        new_rows, reset = select_new_rows(rows, cursor, verify_id)
+        if reset and wanted is not None:
+            new_rows = sorted(await client.print('/log', proplist=LOG_COLUMNS),
+                              key=lambda row: log_id_value(log_id(row)))
+        async with self._store_lock:
+            await loop.run_in_executor(None, self._store, new_rows, cursor)
+
+    async def _flush(self, batch, loop):
+        """Store the buffered lines, if any"""
+        async with self._store_lock:
+            rows = batch[:]
+            del batch[:]
+            if rows:
+                await loop.run_in_executor(None, self._store, rows)
+
+    async def _flush_idle(self, batch, loop, done):
+        """Store lines left in the buffer when the router goes quiet after a burst"""
+        while not done.is_set():
+            try:
+                await asyncio.wait_for(done.wait(), max(self.flush_interval, 0.05))
+            except asyncio.TimeoutError:
+                await self._flush(batch, loop)
+
+    async def _follow(self, client, loop):
+        batch = []
+        last_flush = time.monotonic()
+        stream = client.stream('/log/print', {'follow-only': '', '.proplist': ','.join(LOG_COLUMNS)})
+        # Stopped rather than cancelled, so a store it started always finishes first
+        done = asyncio.Event()
+        flusher = asyncio.ensure_future(self._flush_idle(batch, loop, done))
+        try:
+            async for row in stream:
+                batch.append(row)
+                if time.monotonic() - last_flush >= self.flush_interval:
+                    await self._flush(batch, loop)
+                    last_flush = time.monotonic()
+        finally:
+            done.set()
+            await flusher
+            await self._flush(batch, loop)
+            await stream.aclose()
+
+    def _store(self, rows, cursor=None):
+        # Streamed lines carry no cursor: whatever is stored already bounds them
+        self.lines_ingested += save_logs(self.db, self.router_id, rows, self.writer, cursor)
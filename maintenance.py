@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+Background retention and space reclamation for the time-series tables.
+
+``MaintenanceService`` runs in the collector every
+``MAINTENANCE_INTERVAL`` seconds (in one process only when the collector
+is sharded, see ``leader``):
+
+- Raw bandwidth day partitions past the longest raw retention are
+  dropped whole. Routers with a shorter retention (the default, or a row
+  in ``bandwidth_retention_settings``) have their older rows deleted from
+  the days that are kept.
+- With an archive, the remaining days past the hot window move into its
+  column files (see ``bandwidth_archive``), and archived days past
+  ``BANDWIDTH_ARCHIVE_RETENTION_DAYS`` (or a router's raw retention
+  override) are deleted.
+- Rollup buckets past their tier's retention are deleted per router.
+- ``router_logs`` keep each router's ``log_retention_settings`` (7 days
+  when unset).
+- ``router_status_cache`` keeps the newest row per configured router.
+
+Deletes run in chunks, each its own statement through the ingest writer
+when one is given. A chunk that takes longer than
+``MAINTENANCE_CHUNK_SECONDS`` halves the next one and a fast one doubles
+it, so the writer is never held for long and sample batches interleave.
+
+Freed pages are then returned to the file system with ``PRAGMA
+incremental_vacuum``, also in chunks, and ``ANALYZE`` refreshes the planner
+statistics every ``MAINTENANCE_ANALYZE_INTERVAL`` seconds. Each run
+reports the rows deleted, partitions dropped and bytes reclaimed.
+
+Incremental vacuum needs ``auto_vacuum=INCREMENTAL``, which only a new
+database or a full ``VACUUM`` can switch on: ``enable_incremental_vacuum``
+does that at startup for databases up to ``MAINTENANCE_CONVERT_MAX_MB``.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from bandwidth_archive import ARCHIVE_COLUMNS, BANDWIDTH_ARCHIVE_RETENTION_DAYS, archive_closed_days
+from bandwidth_partitions import DAY, PARTITIONED_TABLES, drop_partitions_before, list_partitions, partition_day
+from bandwidth_rollup import BANDWIDTH_RAW_RETENTION_DAYS, ROLLUP_TIERS
+from db_pool import ConnectionPool
+
+# Seconds between maintenance runs
+MAINTENANCE_INTERVAL = float(os.environ.get('MAINTENANCE_INTERVAL', '3600'))
+# Rows deleted by the first chunk; adjusted to the time budget afterwards
+MAINTENANCE_CHUNK_ROWS = int(os.environ.get('MAINTENANCE_CHUNK_ROWS', '2000'))
+# Longest a single delete chunk should hold the write lock, in seconds
+MAINTENANCE_CHUNK_SECONDS = float(os.environ.get('MAINTENANCE_CHUNK_SECONDS', '0.1'))
+# Pages returned to the file system per incremental_vacuum step
+MAINTENANCE_VACUUM_PAGES = int(os.environ.get('MAINTENANCE_VACUUM_PAGES', '2048'))
+# Seconds between ANALYZE passes
+MAINTENANCE_ANALYZE_INTERVAL = float(os.environ.get('MAINTENANCE_ANALYZE_INTERVAL', '86400'))
+# Largest existing database switched to incremental vacuum with a full VACUUM at startup
+MAINTENANCE_CONVERT_MAX_MB = float(os.environ.get('MAINTENANCE_CONVERT_MAX_MB', '256'))
+
+# Log retention when a router has no log_retention_settings row
+DEFAULT_LOG_RETENTION_DAYS = 7
+
+BANDWIDTH_RETENTION_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS bandwidth_retention_settings (
+        router_id INTEGER PRIMARY KEY,
+        raw_retention_days REAL NOT NULL,
+        FOREIGN KEY (router_id) REFERENCES routers (id)
+    )
+'''
+
+# Smallest and largest chunk the time budget may settle on
+_MIN_CHUNK_ROWS = 100
+_MAX_CHUNK_ROWS = 100000
+
+_AUTO_VACUUM_INCREMENTAL = 2
+
+
+def enable_incremental_vacuum(conn, max_bytes=None):
+    """Switch the database to ``auto_vacuum=INCREMENTAL`` (call before creating tables).
+
+    Takes effect at once on a new database. An existing one is rebuilt
+    with ``VACUUM`` if it is no larger than ``max_bytes``; larger ones are
+    left alone with a hint, since VACUUM rewrites the whole file.
+    """
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == _AUTO_VACUUM_INCREMENTAL:
+        return True
+    conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == _AUTO_VACUUM_INCREMENTAL:
+        return True
+    limit = max_bytes if max_bytes is not None else MAINTENANCE_CONVERT_MAX_MB * 1024 * 1024
+    size = database_bytes(conn)
+    if size > limit:
+        print(f"Database is {size / 1024 / 1024:.0f} MB; run VACUUM once while the collector is stopped "
+              f"to enable incremental vacuum")
+        return False
+    conn.commit()
+    try:
+        conn.execute('VACUUM')
+    except sqlite3.OperationalError as e:
+        # Another process holds the database; try again next start
+        print(f"Could not VACUUM to enable incremental vacuum: {e}")
+        return False
+    return conn.execute('PRAGMA auto_vacuum').fetchone()[0] == _AUTO_VACUUM_INCREMENTAL
+
+
+def database_bytes(conn):
+    page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+    return conn.execute('PRAGMA page_count').fetchone()[0] * page_size
+
+
+def _table_exists(conn, table):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()
+
+
+def _settings(conn, table, column):
+    """{router_id: value} from a per-router settings table, newest row winning"""
+    if not _table_exists(conn, table):
+        return {}
+    return {router_id: value for router_id, value in conn.execute(
+        f'SELECT router_id, {column} FROM {table} ORDER BY rowid') if value}
+
+
+class MaintenanceService:
+    """Retention, incremental vacuum and ANALYZE on a schedule"""
+
+    def __init__(self, db_path, writer=None, archive=None, chunk_rows=None, chunk_seconds=None, vacuum_pages=None,
+                 analyze_interval=None, db=None, leader=None):
+        self.db_path = db_path
+        self.db = db or ConnectionPool(db_path)
+        self.writer = writer
+        self.archive = archive
+        self.chunk_rows = chunk_rows or MAINTENANCE_CHUNK_ROWS
+        self.chunk_seconds = chunk_seconds or MAINTENANCE_CHUNK_SECONDS
+        self.vacuum_pages = vacuum_pages or MAINTENANCE_VACUUM_PAGES
+        self.analyze_interval = analyze_interval if analyze_interval is not None else MAINTENANCE_ANALYZE_INTERVAL
+        # Called before each scheduled run; the run is skipped unless it returns True
+        self.leader = leader
+        self._last_analyze = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, interval=None):
+        """Run ``run_once`` every ``interval`` seconds on a daemon thread"""
+        interval = interval or MAINTENANCE_INTERVAL
+        self._thread = threading.Thread(target=self._loop, args=(interval,), name='maintenance', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self, interval):
+        while not self._stop.is_set():
+            try:
+                if self.leader is None or self.leader():
+                    self.run_once()
+            except Exception as e:
+                print(f"[{datetime.now()}] Maintenance run failed: {e}")
+            self._stop.wait(interval)
+
+    def run_once(self, now=None):
+        """One maintenance pass.
+
+        Returns {'deleted', 'dropped', 'archived', 'bytes_reclaimed',
+        'analyzed', 'seconds'}.
+        """
+        started = time.time()
+        now = now if now is not None else started
+        size_before = self._read(database_bytes)
+
+        deleted = {}
+        routers = self._read(lambda conn: [row[0] for row in conn.execute('SELECT id FROM routers')]
+                             if _table_exists(conn, 'routers') else [])
+        dropped = self._raw_retention(now, routers, deleted)
+        archived = self._archive(now, routers) if self.archive is not None else 0
+        self._rollup_retention(now, routers, deleted)
+        self._log_retention(now, routers, deleted)
+        self._status_retention(deleted)
+        self._vacuum()
+
+        analyzed = time.time() - self._last_analyze >= self.analyze_interval
+        if analyzed:
+            self._write(self._analyze)
+            self._last_analyze = time.time()
+
+        report = {
+            'deleted': {table: count for table, count in deleted.items() if count},
+            'dropped': dropped,
+            'archived': archived,
+            'bytes_reclaimed': max(0, size_before - self._read(database_bytes)),
+            'analyzed': analyzed,
+            'seconds': time.time() - started,
+        }
+        summary = ', '.join(f"{table}: {count}" for table, count in report['deleted'].items()) or 'nothing'
+        print(f"[{datetime.now()}] Maintenance deleted {summary}; dropped {dropped} partitions, "
+              f"archived {archived} rows, reclaimed {report['bytes_reclaimed'] / 1024 / 1024:.1f} MB in {report['seconds']:.1f}s")
+        return report
+
+    def _raw_retention(self, now, routers, deleted):
+        """Drop whole raw days past the longest retention, then trim shorter ones per router"""
+        overrides = self._read(lambda conn: _settings(conn, 'bandwidth_retention_settings', 'raw_retention_days'))
+        days_by_router = {router_id: overrides.get(router_id, BANDWIDTH_RAW_RETENTION_DAYS) for router_id in routers}
+        longest = max([BANDWIDTH_RAW_RETENTION_DAYS, *days_by_router.values()])
+
+        dropped = 0
+        for table in PARTITIONED_TABLES:
+            dropped += self._write(lambda conn, table=table: len(
+                drop_partitions_before(conn, table, now - longest * DAY)))
+            partitions = self._read(lambda conn, table=table: list_partitions(conn, table))
+            for router_id, days in days_by_router.items():
+                if days >= longest:
+                    continue
+                cutoff = now - days * DAY
+                for day, name in partitions:
+                    if day > partition_day(cutoff):
+                        break
+                    deleted[table] = deleted.get(table, 0) + self._delete_in_chunks(f'''
+                        DELETE FROM {name} WHERE rowid IN (
+                            SELECT rowid FROM {name} WHERE router_id = ? AND timestamp < ? LIMIT ?)
+                    ''', (router_id, int(cutoff)))
+        return dropped
+
+    def _archive(self, now, routers):
+        """Move closed days past the hot window into the archive; returns rows archived"""
+        def drop(table, name):
+            self._write(lambda conn: conn.execute(f'DROP TABLE {name}'))
+        archived = self._read(lambda conn: archive_closed_days(conn, self.archive, now, drop))
+
+        overrides = self._read(lambda conn: _settings(conn, 'bandwidth_retention_settings', 'raw_retention_days'))
+        for table in ARCHIVE_COLUMNS:
+            # Also the routers deleted since, at the default retention
+            for router_id in set(routers) | set(self.archive.routers(table)):
+                days = overrides.get(router_id, BANDWIDTH_ARCHIVE_RETENTION_DAYS)
+                self.archive.drop_days_before(table, router_id, now - days * DAY)
+        return archived
+
+    def _rollup_retention(self, now, routers, deleted):
+        for table, id_column in (('ip_bandwidth_rollup', 'host_id'), ('interface_bandwidth_rollup', 'interface_id')):
+            if not self._read(lambda conn, table=table: _table_exists(conn, table)):
+                continue
+            for tier in ROLLUP_TIERS:
+                key = f'router_id, resolution, {id_column}, bucket'
+                for router_id in routers:
+                    deleted[table] = deleted.get(table, 0) + self._delete_in_chunks(f'''
+                        DELETE FROM {table} WHERE ({key}) IN (
+                            SELECT {key} FROM {table}
+                            WHERE router_id = ? AND resolution = ? AND bucket < ? LIMIT ?)
+                    ''', (router_id, tier.seconds, tier.bucket(now - tier.retention)))
+
+    def _log_retention(self, now, routers, deleted):
+        if not self._read(lambda conn: _table_exists(conn, 'router_logs')):
+            return
+        overrides = self._read(lambda conn: _settings(conn, 'log_retention_settings', 'retention_days'))
+        for router_id in routers:
+            days = overrides.get(router_id, DEFAULT_LOG_RETENTION_DAYS)
+            deleted['router_logs'] = deleted.get('router_logs', 0) + self._delete_in_chunks('''
+                DELETE FROM router_logs WHERE id IN (
+                    SELECT id FROM router_logs WHERE router_id = ? AND stored_at < ? LIMIT ?)
+            ''', (router_id, int(now - days * DAY)))
+
+    def _status_retention(self, deleted):
+        if not self._read(lambda conn: _table_exists(conn, 'router_status_cache')):
+            return
+        deleted['router_status_cache'] = self._delete_in_chunks('''
+            DELETE FROM router_status_cache WHERE id IN (
+                SELECT s.id FROM router_status_cache s
+                WHERE s.id < (SELECT MAX(n.id) FROM router_status_cache n WHERE n.router_id = s.router_id)
+                   OR s.router_id NOT IN (SELECT id FROM routers)
+                LIMIT ?)
+        ''', ())
+
+    def _vacuum(self):
+        """Hand free pages back to the file system, ``vacuum_pages`` at a time"""
+        if self._read(lambda conn: conn.execute('PRAGMA auto_vacuum').fetchone()[0]) != _AUTO_VACUUM_INCREMENTAL:
+            return
+        while self._read(lambda conn: conn.execute('PRAGMA freelist_count').fetchone()[0]):
+            self._write(lambda conn: conn.execute(f'PRAGMA incremental_vacuum({self.vacuum_pages})').fetchall())
+
+    def _analyze(self, conn):
+        # Sample each index instead of reading it whole
+        conn.execute('PRAGMA analysis_limit = 1000')
+        conn.execute('ANALYZE')
+
+    def _delete_in_chunks(self, sql, params):
+        """Repeat a ``DELETE ... LIMIT ?`` until a chunk comes up short; returns rows deleted"""
+        total = 0
+        while True:
+            limit = self.chunk_rows
+
+            def chunk(conn):
+                started = time.time()
+                count = conn.execute(sql, (*params, limit)).rowcount
+                return count, time.time() - started
+            count, elapsed = self._write(chunk)
+            total += count
+            # Keep each chunk inside the time budget
+            if elapsed > self.chunk_seconds:
+                self.chunk_rows = max(_MIN_CHUNK_ROWS, limit // 2)
+            elif elapsed < self.chunk_seconds / 4 and count == limit:
+                self.chunk_rows = min(_MAX_CHUNK_ROWS, limit * 2)
+            if count < limit:
+                return total
+
+    def _write(self, function):
+        """Run ``function(conn)`` as one write (through the writer if there is one); returns its result"""
+        result = []
+        if self.writer is not None:
+            self.writer.submit_call(lambda conn: result.append(function(conn)), wait=True)
+        else:
+            with self.db.write() as conn:
+                result.append(function(conn))
+        return result[0]
+
+    def _read(self, function):
+        with self.db.read() as conn:
+            return function(conn)
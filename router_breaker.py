@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Per-router circuit breaker shared by the collector and the web app.
+
+A router starts ``closed`` (calls go through). After ``failure_threshold``
+consecutive connection failures it turns ``open``: callers are refused
+immediately instead of waiting for a connect timeout. Once the backoff has
+elapsed exactly one caller is let through as a ``half_open`` probe; if it
+succeeds the breaker closes, if it fails the breaker opens again with the
+backoff doubled (up to ``max_backoff``).
+
+State lives in the ``router_circuit_breakers`` table so both processes see
+the same picture: when the collector finds a router dead, page views stop
+blocking on it, and a successful probe from either side brings it back.
+"""
+
+import os
+import time
+
+from db_pool import ConnectionPool
+
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get('BREAKER_FAILURE_THRESHOLD', '3'))
+BREAKER_BASE_BACKOFF = float(os.environ.get('BREAKER_BASE_BACKOFF', '30'))
+BREAKER_MAX_BACKOFF = float(os.environ.get('BREAKER_MAX_BACKOFF', '1800'))
+# A half-open probe that has not reported back by then is given to someone else
+BREAKER_PROBE_TIMEOUT = float(os.environ.get('BREAKER_PROBE_TIMEOUT', '60'))
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+BREAKER_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS router_circuit_breakers (
+        router_id INTEGER PRIMARY KEY,
+        state TEXT NOT NULL DEFAULT 'closed',
+        failures INTEGER NOT NULL DEFAULT 0,
+        trips INTEGER NOT NULL DEFAULT 0,
+        retry_at REAL,
+        last_error TEXT,
+        updated_at REAL,
+        FOREIGN KEY (router_id) REFERENCES routers (id)
+    )
+'''
+
+
+class RouterCircuitBreaker:
+    """Circuit breaker state machine persisted in SQLite"""
+
+    def __init__(self, db_path, failure_threshold=None, base_backoff=None, max_backoff=None,
+                 probe_timeout=None, clock=time.time, db=None, writer=None):
+        self.db_path = db_path
+        self.db = db or ConnectionPool(db_path)
+        # The collector's single writer; the web app has none and writes directly
+        self.writer = writer
+        self.failure_threshold = failure_threshold or BREAKER_FAILURE_THRESHOLD
+        self.base_backoff = base_backoff or BREAKER_BASE_BACKOFF
+        self.max_backoff = max_backoff or BREAKER_MAX_BACKOFF
+        self.probe_timeout = probe_timeout or BREAKER_PROBE_TIMEOUT
+        self.clock = clock
+
+    def allow(self, router_id):
+        """True if a call to the router may go ahead now.
+
+        An open breaker whose backoff has elapsed hands out a single
+        half-open probe; concurrent callers are refused until it reports.
+        Only that claim writes: closed and backing-off breakers are answered
+        from a plain read.
+        """
+        now = self.clock()
+        info = self.state(router_id)
+        if info['state'] == CLOSED:
+            return True
+        if info['retry_at'] is not None and now < info['retry_at']:
+            return False
+
+        def claim(conn):
+            row = conn.execute('SELECT state, retry_at FROM router_circuit_breakers WHERE router_id = ?',
+                               (router_id,)).fetchone()
+            if row is None or row[0] == CLOSED:
+                return True
+            state, retry_at = row
+            if retry_at is not None and now < retry_at:
+                # Another caller claimed the probe since the read
+                return False
+            # Backoff over (or the previous probe went missing): probe now
+            conn.execute('''
+                UPDATE router_circuit_breakers SET state = ?, retry_at = ?, updated_at = ?
+                WHERE router_id = ?
+            ''', (HALF_OPEN, now + self.probe_timeout, now, router_id))
+            return True
+        return self._write(claim)
+
+    def is_open(self, router_id):
+        """True if calls are currently refused (read-only; never claims a probe)"""
+        info = self.state(router_id)
+        return info['state'] != CLOSED and info['retry_at'] is not None and self.clock() < info['retry_at']
+
+    def record_success(self, router_id):
+        """Close the breaker; a no-op (no write) if it is closed with no failures counted"""
+        info = self.state(router_id)
+        if info['state'] == CLOSED and not info['failures']:
+            return
+        now = self.clock()
+        self._write(lambda conn: conn.execute('''
+            INSERT INTO router_circuit_breakers (router_id, state, failures, trips, retry_at, last_error, updated_at)
+            VALUES (?, ?, 0, 0, NULL, NULL, ?)
+            ON CONFLICT(router_id) DO UPDATE SET
+                state = excluded.state, failures = 0, trips = 0, retry_at = NULL,
+                last_error = NULL, updated_at = excluded.updated_at
+        ''', (router_id, CLOSED, now)))
+
+    def record_failure(self, router_id, error=None):
+        """Count a failed call; returns the resulting state"""
+        now = self.clock()
+
+        def count(conn):
+            row = conn.execute('SELECT state, failures, trips FROM router_circuit_breakers WHERE router_id = ?',
+                               (router_id,)).fetchone()
+            state, failures, trips = row or (CLOSED, 0, 0)
+            failures += 1
+            retry_at = None
+            if state == HALF_OPEN or failures >= self.failure_threshold:
+                # Trip (again): each consecutive trip doubles the backoff
+                trips += 1
+                state = OPEN
+                retry_at = now + min(self.base_backoff * 2 ** (trips - 1), self.max_backoff)
+            conn.execute('''
+                INSERT INTO router_circuit_breakers (router_id, state, failures, trips, retry_at, last_error, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(router_id) DO UPDATE SET
+                    state = excluded.state, failures = excluded.failures, trips = excluded.trips,
+                    retry_at = excluded.retry_at, last_error = excluded.last_error,
+                    updated_at = excluded.updated_at
+            ''', (router_id, state, failures, trips, retry_at, str(error) if error else None, now))
+            return state
+        return self._write(count)
+
+    def reset(self, router_id):
+        """Forget a router's failures (e.g. a user asked to retry it now)"""
+        self.record_success(router_id)
+
+    def state(self, router_id):
+        with self.db.read() as conn:
+            row = conn.execute('''
+                SELECT state, failures, trips, retry_at, last_error
+                FROM router_circuit_breakers WHERE router_id = ?
+            ''', (router_id,)).fetchone()
+        if row is None:
+            return {'state': CLOSED, 'failures': 0, 'trips': 0, 'retry_at': None, 'last_error': None}
+        return dict(zip(('state', 'failures', 'trips', 'retry_at', 'last_error'), row))
+
+    def _write(self, function):
+        """Run ``function(conn)`` under the write lock (on the writer if there is one); returns its result"""
+        result = []
+        if self.writer is not None:
+            self.writer.submit_call(lambda conn: result.append(function(conn)), wait=True)
+        else:
+            with self.db.write() as conn:
+                conn.execute('BEGIN IMMEDIATE')
+                result.append(function(conn))
+        return result[0]
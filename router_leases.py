@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Router ownership leases for running several collector processes.
+
+In sharded mode every collector process (on one machine or several sharing
+the database) is a worker with a heartbeat row in ``collector_workers``.
+Routers are split between the live workers by rendezvous hashing, so
+adding or losing a worker only moves that worker's share. A worker polls
+a router only while it holds the router's row in ``router_leases``. The
+lease expires unless renewed, so the routers of a dead worker are picked
+up by the others within one TTL.
+
+Each lease also records the grid tick of the last poll. A poll is only
+started after an atomic update that checks ownership and that the tick
+is newer than the recorded one. Since every worker computes the same tick
+grid for a router, a router handed over mid-interval is not polled twice
+for the same interval.
+
+Work that must run in one process only (database maintenance) is guarded
+by a role in ``collector_roles``: the worker that claims it keeps it while
+it renews it, and another worker takes it over once it has expired.
+"""
+
+import hashlib
+import os
+import socket
+import sqlite3
+import time
+
+COLLECTOR_SHARDED = os.environ.get('COLLECTOR_SHARDED', '0') == '1'
+COLLECTOR_WORKER_ID = os.environ.get('COLLECTOR_WORKER_ID')
+# Collector processes to start on this machine (implies sharded mode when > 1)
+COLLECTOR_PROCESSES = int(os.environ.get('COLLECTOR_PROCESSES', '1'))
+# Seconds a lease (and a worker heartbeat) stays valid without renewal
+LEASE_TTL = float(os.environ.get('LEASE_TTL', '90'))
+
+LEASE_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS router_leases (
+        router_id INTEGER PRIMARY KEY,
+        owner TEXT NOT NULL,
+        expires_at REAL NOT NULL,
+        last_tick REAL,
+        FOREIGN KEY (router_id) REFERENCES routers (id)
+    )
+'''
+
+WORKER_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS collector_workers (
+        worker_id TEXT PRIMARY KEY,
+        heartbeat_at REAL NOT NULL,
+        started_at REAL NOT NULL
+    )
+'''
+
+ROLE_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS collector_roles (
+        role TEXT PRIMARY KEY,
+        owner TEXT NOT NULL,
+        expires_at REAL NOT NULL
+    )
+'''
+
+
+def default_worker_id():
+    return f'{socket.gethostname()}-{os.getpid()}'
+
+
+def rendezvous_owner(router_id, workers):
+    """Worker with the highest hash for this router (stable under churn)"""
+    def weight(worker_id):
+        return hashlib.sha1(f'{worker_id}:{router_id}'.encode()).digest()
+    return max(workers, key=weight) if workers else None
+
+
+class RouterLeaseManager:
+    """Claims, renews and releases router leases for one collector worker"""
+
+    def __init__(self, db_path, worker_id=None, ttl=None, clock=time.time):
+        self.db_path = db_path
+        self.worker_id = worker_id or COLLECTOR_WORKER_ID or default_worker_id()
+        self.ttl = ttl or LEASE_TTL
+        self.clock = clock
+        self.owned = set()
+        self.acquired = set()
+        self.stats = {'claimed': 0, 'released': 0, 'lost': 0, 'fenced': 0}
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+
+    def rebalance(self, router_ids):
+        """Heartbeat, then renew/claim/release leases; returns the routers owned.
+
+        ``acquired`` is left holding the routers that were not owned before
+        this call, whose in-memory state may be out of date.
+        """
+        now = self.clock()
+        known = set(router_ids)
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('''
+                INSERT INTO collector_workers (worker_id, heartbeat_at, started_at) VALUES (?, ?, ?)
+                ON CONFLICT(worker_id) DO UPDATE SET heartbeat_at = excluded.heartbeat_at
+            ''', (self.worker_id, now, now))
+            conn.execute('DELETE FROM collector_workers WHERE heartbeat_at < ?', (now - self.ttl,))
+            workers = [row[0] for row in conn.execute('SELECT worker_id FROM collector_workers')]
+            leases = {row[0]: (row[1], row[2]) for row in
+                      conn.execute('SELECT router_id, owner, expires_at FROM router_leases')}
+
+            owned = set()
+            for router_id in router_ids:
+                owner, expires_at = leases.get(router_id, (None, 0))
+                mine = owner == self.worker_id and expires_at > now
+                if rendezvous_owner(router_id, workers) != self.worker_id:
+                    if mine:
+                        # Hand over to the router's rightful worker (last_tick is kept)
+                        conn.execute('UPDATE router_leases SET expires_at = 0 WHERE router_id = ? AND owner = ?',
+                                     (router_id, self.worker_id))
+                        self.stats['released'] += 1
+                    continue
+                if mine or owner is None or expires_at <= now:
+                    conn.execute('''
+                        INSERT INTO router_leases (router_id, owner, expires_at) VALUES (?, ?, ?)
+                        ON CONFLICT(router_id) DO UPDATE SET owner = excluded.owner,
+                            expires_at = excluded.expires_at
+                    ''', (router_id, self.worker_id, now + self.ttl))
+                    if not mine:
+                        self.stats['claimed'] += 1
+                    owned.add(router_id)
+
+            # Leases of routers that were deleted
+            for router_id, (owner, _) in leases.items():
+                if router_id not in known and owner == self.worker_id:
+                    conn.execute('DELETE FROM router_leases WHERE router_id = ?', (router_id,))
+            conn.execute('COMMIT')
+        except Exception:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+        self.stats['lost'] += len((self.owned - owned) & known)
+        self.acquired = owned - self.owned
+        self.owned = owned
+        return owned
+
+    def begin_poll(self, router_id, tick):
+        """Fence one poll: True only if we still hold the lease and ``tick`` is new"""
+        now = self.clock()
+        conn = self._connect()
+        try:
+            cursor = conn.execute('''
+                UPDATE router_leases SET last_tick = ?
+                WHERE router_id = ? AND owner = ? AND expires_at > ?
+                  AND (last_tick IS NULL OR last_tick < ?)
+            ''', (tick, router_id, self.worker_id, now, tick))
+            allowed = cursor.rowcount == 1
+        finally:
+            conn.close()
+        if not allowed:
+            self.stats['fenced'] += 1
+        return allowed
+
+    def claim_role(self, role, hold):
+        """Take or renew ``role`` for ``hold`` seconds; True if this worker holds it"""
+        now = self.clock()
+        conn = self._connect()
+        try:
+            cursor = conn.execute('''
+                INSERT INTO collector_roles (role, owner, expires_at) VALUES (?, ?, ?)
+                ON CONFLICT(role) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+                WHERE collector_roles.owner = excluded.owner OR collector_roles.expires_at <= ?
+            ''', (role, self.worker_id, now + hold, now))
+            return cursor.rowcount == 1
+        finally:
+            conn.close()
+
+    def release_all(self):
+        """Give every lease and role back (clean shutdown) so others take over at once"""
+        conn = self._connect()
+        try:
+            conn.execute('UPDATE router_leases SET expires_at = 0 WHERE owner = ?', (self.worker_id,))
+            conn.execute('DELETE FROM collector_roles WHERE owner = ?', (self.worker_id,))
+            conn.execute('DELETE FROM collector_workers WHERE worker_id = ?', (self.worker_id,))
+        finally:
+            conn.close()
+        self.owned = set()
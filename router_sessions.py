@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+Persistent, shared RouterOS session pool keyed by router id.
+
+Instead of a fresh TCP connect and login on every page view and collection
+cycle, sessions are kept open per router and handed out exclusively to one
+caller at a time. Idle sessions are health-checked before reuse and evicted
+after a while, the number of sessions per router is capped, and a call that
+fails on a dead socket is transparently retried once on a new session.
+"""
+
+import os
+import socket
+import threading
+import time
+
+from routeros_api import exceptions as routeros_exceptions
+
+from routeros_async import RouterOsConnectionError, create_api_pool
+
+SESSION_MAX_PER_ROUTER = int(os.environ.get('ROUTER_SESSIONS_PER_ROUTER', '2'))
+SESSION_IDLE_TIMEOUT = float(os.environ.get('ROUTER_SESSION_IDLE_TIMEOUT', '300'))
+SESSION_HEALTH_INTERVAL = float(os.environ.get('ROUTER_SESSION_HEALTH_INTERVAL', '30'))
+SESSION_ACQUIRE_TIMEOUT = float(os.environ.get('ROUTER_SESSION_ACQUIRE_TIMEOUT', '30'))
+
+# Errors that mean the session itself is dead rather than the command failing
+CONNECTION_ERRORS = (OSError, routeros_exceptions.RouterOsApiConnectionError,
+                     routeros_exceptions.FatalRouterOsApiError, RouterOsConnectionError)
+
+
+class SessionCancelledError(RouterOsConnectionError):
+    """The session was cancelled while a caller was using it"""
+
+
+class RouterSession:
+    """One logged-in RouterOS connection owned by the pool"""
+
+    def __init__(self, router_id, key, socket_timeout=None):
+        self.router_id = router_id
+        self.key = key
+        self.socket_timeout = socket_timeout
+        self.connection = None
+        self.raw_api = None
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.broken = False
+        self.cancelled = False
+
+    def connect(self):
+        host, port, username, password = self.key
+        self.connection = create_api_pool(host, port, username, password)
+        if self.socket_timeout:
+            self.connection.socket_timeout = min(self.connection.socket_timeout, self.socket_timeout)
+        self.raw_api = self.connection.get_api()
+        self.broken = False
+        return self
+
+    def reconnect(self):
+        if self.cancelled:
+            raise SessionCancelledError(f"Session for router {self.router_id} was cancelled")
+        self.close()
+        return self.connect()
+
+    def is_healthy(self):
+        """Cheap round trip to prove the session still works"""
+        try:
+            self.raw_api.get_resource('/system/identity').get()
+            return True
+        except Exception:
+            return False
+
+    def cancel(self):
+        """Abort the session from another thread, unblocking its user"""
+        self.cancelled = True
+        self.broken = True
+        sock = getattr(getattr(self.connection, 'socket', None), 'socket', None)
+        try:
+            if sock is not None:
+                sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.close()
+
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.disconnect()
+            except Exception:
+                pass
+        self.connection = None
+        self.raw_api = None
+
+
+class PooledResource:
+    """``get_resource()`` result that reconnects once on a dead session"""
+
+    def __init__(self, session, path, on_contact=None):
+        self.session = session
+        self.path = path
+        self.on_contact = on_contact
+
+    def get(self, **kwargs):
+        return self._run(lambda resource: resource.get(**kwargs))
+
+    def call(self, *args, **kwargs):
+        return self._run(lambda resource: resource.call(*args, **kwargs))
+
+    def _run(self, operation):
+        try:
+            return self._contacted(operation(self.session.raw_api.get_resource(self.path)))
+        except CONNECTION_ERRORS:
+            if self.session.cancelled:
+                raise
+            try:
+                self.session.reconnect()
+            except Exception:
+                self.session.broken = True
+                raise
+        try:
+            return self._contacted(operation(self.session.raw_api.get_resource(self.path)))
+        except CONNECTION_ERRORS:
+            self.session.broken = True
+            raise
+
+    def _contacted(self, result):
+        # The router answered: tell the pool's listener (e.g. the circuit breaker)
+        if self.on_contact is not None:
+            self.on_contact(self.session.router_id)
+        return result
+
+
+class PooledApi:
+    """API object handed to callers; mirrors ``routeros_api.RouterOsApi``"""
+
+    def __init__(self, session, on_contact=None):
+        self.session = session
+        self.on_contact = on_contact
+
+    def get_resource(self, path):
+        return PooledResource(self.session, path, self.on_contact)
+
+
+class SessionLease:
+    """Returned in place of the raw pool; ``disconnect()`` gives the session back"""
+
+    def __init__(self, pool, session):
+        self.pool = pool
+        self.session = session
+        self.released = False
+
+    def disconnect(self):
+        if not self.released:
+            self.released = True
+            self.pool.release(self.session)
+
+    def discard(self):
+        self.session.broken = True
+        self.disconnect()
+
+
+class RouterSessionPool:
+    """Long-lived RouterOS sessions, at most ``max_per_router`` per router id"""
+
+    def __init__(self, max_per_router=None, idle_timeout=None, health_interval=None,
+                 acquire_timeout=None, socket_timeout=None, on_contact=None):
+        self.max_per_router = max_per_router or SESSION_MAX_PER_ROUTER
+        self.idle_timeout = idle_timeout or SESSION_IDLE_TIMEOUT
+        self.health_interval = health_interval or SESSION_HEALTH_INTERVAL
+        self.acquire_timeout = acquire_timeout or SESSION_ACQUIRE_TIMEOUT
+        self.socket_timeout = socket_timeout
+        # Called with the router id after each call the router answered
+        self.on_contact = on_contact
+        self._idle = {}
+        self._open = {}
+        self._cond = threading.Condition()
+        self._evictor = None
+        self.stats = {'created': 0, 'reused': 0, 'reconnected': 0, 'evicted': 0}
+
+    def acquire(self, router_id, host, port, username, password):
+        """Check out a session for ``router_id``; returns (api, lease)"""
+        key = (host, port, username, password)
+        deadline = time.monotonic() + self.acquire_timeout
+        self._start_evictor()
+
+        with self._cond:
+            self._drop_stale_credentials(router_id, key)
+            while True:
+                idle = self._idle.get(router_id)
+                if idle:
+                    session = idle.pop()
+                    break
+                if self._open.get(router_id, 0) < self.max_per_router:
+                    self._open[router_id] = self._open.get(router_id, 0) + 1
+                    session = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"No free RouterOS session for router {router_id}")
+                self._cond.wait(remaining)
+
+        try:
+            if session is None:
+                session = RouterSession(router_id, key, self.socket_timeout)
+                session.connect()
+                self.stats['created'] += 1
+            else:
+                self.stats['reused'] += 1
+                if time.monotonic() - session.last_used > self.health_interval and not session.is_healthy():
+                    session.reconnect()
+                    self.stats['reconnected'] += 1
+        except Exception:
+            if session is not None:
+                session.close()
+            with self._cond:
+                self._open[router_id] -= 1
+                self._cond.notify()
+            raise
+
+        return PooledApi(session, self.on_contact), SessionLease(self, session)
+
+    def release(self, session):
+        """Return a session to the idle list, or drop it if it is broken"""
+        with self._cond:
+            if session.broken or session.cancelled:
+                self._open[session.router_id] -= 1
+                session.close()
+            else:
+                session.last_used = time.monotonic()
+                self._idle.setdefault(session.router_id, []).append(session)
+            self._cond.notify()
+
+    def close_router(self, router_id):
+        """Close every idle session of a router (e.g. after it was deleted)"""
+        with self._cond:
+            for session in self._idle.pop(router_id, []):
+                self._open[router_id] -= 1
+                session.close()
+            self._cond.notify_all()
+
+    def evict_idle(self):
+        """Close sessions that have been idle longer than ``idle_timeout``"""
+        now = time.monotonic()
+        with self._cond:
+            for router_id, idle in list(self._idle.items()):
+                keep = []
+                for session in idle:
+                    if now - session.last_used > self.idle_timeout:
+                        self._open[router_id] -= 1
+                        session.close()
+                        self.stats['evicted'] += 1
+                    else:
+                        keep.append(session)
+                self._idle[router_id] = keep
+            self._cond.notify_all()
+
+    def _drop_stale_credentials(self, router_id, key):
+        # Router was edited: sessions logged in with old details are useless
+        idle = self._idle.get(router_id, [])
+        for session in [s for s in idle if s.key != key]:
+            idle.remove(session)
+            self._open[router_id] -= 1
+            session.close()
+
+    def _start_evictor(self):
+        if self._evictor is not None:
+            return
+        with self._cond:
+            if self._evictor is not None:
+                return
+            self._evictor = threading.Thread(target=self._evict_loop, name='router-session-evictor', daemon=True)
+            self._evictor.start()
+
+    def _evict_loop(self):
+        while True:
+            time.sleep(min(60, self.idle_timeout))
+            try:
+                self.evict_idle()
+            except Exception as e:
+                print(f"Error evicting idle router sessions: {e}")
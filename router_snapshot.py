@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Per-cycle RouterOS resource snapshot.
+
+A snapshot wraps a RouterOS API object and fetches each path at most once;
+every consumer in the same cycle (bandwidth, interface, log and status
+collection, or the several helpers behind one page view) reads the same
+parsed rows. It also counts round trips and reply bytes so the savings can
+be measured.
+
+``RouterQuery`` pushes ``.proplist`` projections and ``?`` row filters down
+to RouterOS so only the needed columns and rows travel over the wire.
+"""
+
+import ipaddress
+
+from routeros_async import encode_length
+
+# Columns the connection views and collectors read from /ip/firewall/connection
+CONNTRACK_COLUMNS = ('.id', 'protocol', 'src-address', 'dst-address', 'dst-port',
+                     'orig-bytes', 'repl-bytes', 'bytes', 'orig-time', 'sni')
+
+
+class _QueryWords:
+    """All query words of a ``/print`` as one ``routeros_api`` additional query.
+
+    ``routeros_api`` keeps a sentence's queries in a set, so separate query
+    objects reach the router in any order. The ``?#`` operators of the
+    RouterOS query stack act on the words sent before them, so the words
+    must go out as one object that keeps their order.
+    """
+
+    def __init__(self, words):
+        self.words = tuple(words)
+
+    def get_api_format(self):
+        return [word.encode('utf-8') for word in self.words]
+
+
+class RouterQuery:
+    """A ``/print`` whose projection and filters are evaluated by RouterOS.
+
+    ``where`` takes RouterOS API query words without the leading '?', e.g.
+    ``'protocol=tcp'`` or ``'>orig-bytes=1000'``; build them with the
+    ``equals``/``greater``/``less``/``any_of`` helpers.
+    """
+
+    def __init__(self, path, proplist=None, where=()):
+        self.path = path
+        self.proplist = tuple(proplist or ())
+        self.where = tuple(where)
+
+    @property
+    def key(self):
+        return (self.path, self.proplist, self.where)
+
+    def words(self):
+        return ['?' + word for word in self.where]
+
+    def run(self, api):
+        """Execute the query on a RouterOS API object and return its rows"""
+        arguments = {'.proplist': ','.join(self.proplist)} if self.proplist else {}
+        resource = api.get_resource(self.path)
+        words = self.words()
+        rows = resource.call('print', arguments, additional_queries=[_QueryWords(words)] if words else ())
+        return list(rows or [])
+
+
+def equals(key, value):
+    return f'{key}={value}'
+
+
+def greater(key, value):
+    return f'>{key}={value}'
+
+
+def less(key, value):
+    return f'<{key}={value}'
+
+
+def any_of(*conditions):
+    """OR the given conditions together with the RouterOS query stack"""
+    if len(conditions) < 2:
+        return conditions
+    return conditions + ('#' + '|' * (len(conditions) - 1),)
+
+
+def conntrack_query(proplist=CONNTRACK_COLUMNS, min_bytes=None, protocol=None):
+    """Connection-tracking query with only the columns and rows we use.
+
+    ``min_bytes`` keeps flows that moved more than that many bytes in either
+    direction. RouterOS API queries cannot match address prefixes, so subnet
+    filtering is done with ``address_in_networks`` on the projected rows.
+    """
+    where = ()
+    if protocol:
+        where += (equals('protocol', protocol),)
+    if min_bytes:
+        where += any_of(greater('orig-bytes', int(min_bytes)), greater('repl-bytes', int(min_bytes)))
+    return RouterQuery('/ip/firewall/connection', proplist, where)
+
+
+def compile_networks(networks):
+    """Pre-parse CIDR strings for ``address_in_networks``"""
+    return tuple(ipaddress.ip_network(network, strict=False) for network in networks)
+
+
+def address_in_networks(address, networks):
+    """True if a conntrack address ('ip' or 'ip:port') lies in any network"""
+    host = address.rsplit(':', 1)[0] if address.count(':') == 1 else address
+    try:
+        ip = ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return any(ip in network for network in networks)
+
+
+def connection_bytes(conn):
+    """(upload, download) bytes of a conntrack row from the client's view"""
+    if conn.get('orig-bytes') is not None or conn.get('repl-bytes') is not None:
+        return int(conn.get('orig-bytes') or 0), int(conn.get('repl-bytes') or 0)
+    bytes_field = conn.get('bytes', '0/0')
+    if '/' in bytes_field:
+        sent, received = bytes_field.split('/', 1)
+        return int(sent or 0), int(received or 0)
+    return 0, 0
+
+
+def estimate_sentence_bytes(row):
+    """Wire size of one ``!re`` reply sentence carrying ``row``"""
+    size = 1 + len('!re') + 1  # type word and terminating empty word
+    for key, value in row.items():
+        word = f'={key}={value}'.encode('utf-8')
+        size += len(encode_length(len(word))) + len(word)
+    return size
+
+
+class RouterSnapshot:
+    """RouterOS resources fetched once per router per cycle"""
+
+    def __init__(self, api, router_id=None):
+        self.api = api
+        self.router_id = router_id
+        self._cache = {}
+        self.round_trips = 0
+        self.bytes_received = 0
+        self.rows_received = 0
+
+    def get(self, path):
+        """Rows of ``path`` (e.g. '/interface'); fetched on first use only"""
+        if path not in self._cache:
+            self.round_trips += 1
+            try:
+                rows = self.api.get_resource(path).get() or []
+            except Exception as e:
+                self._cache[path] = e
+                raise
+            self._record(rows)
+            self._cache[path] = rows
+        cached = self._cache[path]
+        if isinstance(cached, Exception):
+            raise cached
+        return cached
+
+    def query(self, query):
+        """Rows of a ``RouterQuery``; identical queries are run once"""
+        if query.key not in self._cache:
+            self.round_trips += 1
+            try:
+                rows = query.run(self.api)
+            except Exception as e:
+                self._cache[query.key] = e
+                raise
+            self._record(rows)
+            self._cache[query.key] = rows
+        cached = self._cache[query.key]
+        if isinstance(cached, Exception):
+            raise cached
+        return cached
+
+    def first(self, path):
+        """First row of a single-row resource such as '/system/resource'"""
+        rows = self.get(path)
+        return rows[0] if rows else {}
+
+    def _record(self, rows):
+        # Count the reply sentences plus the closing !done
+        self.bytes_received += sum(estimate_sentence_bytes(row) for row in rows) + len('!done') + 2
+        self.rows_received += len(rows)
+
+    def stats(self):
+        return {
+            'round_trips': self.round_trips,
+            'bytes': self.bytes_received,
+            'rows': self.rows_received,
+            'paths': sorted(key if isinstance(key, str) else key[0] for key in self._cache)
+        }
+
+
+def as_snapshot(api):
+    """Return ``api`` as a snapshot, wrapping plain API objects"""
+    if isinstance(api, RouterSnapshot):
+        return api
+    return RouterSnapshot(api)
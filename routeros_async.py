@@ -0,0 +1,476 @@
+#!/usr/bin/env python3
+"""
+asyncio-native RouterOS API client engine.
+
+Speaks the RouterOS API wire protocol (length-prefixed words grouped into
+sentences) directly on top of asyncio streams, so a single event loop can
+keep thousands of router sessions in flight instead of tying up one thread
+per router. Every command is sent with its own ``.tag`` and replies are
+dispatched by tag, which lets several ``/print`` commands share one session
+concurrently.
+
+Synchronous callers (the Flask routes and the collector) use the engine
+through ``AsyncApiPool``, a drop-in replacement for
+``routeros_api.RouterOsApiPool`` that runs the client on a shared background
+event loop.
+"""
+
+import asyncio
+import binascii
+import hashlib
+import itertools
+import os
+import threading
+
+import routeros_api
+
+# Which RouterOS client to use: 'pool' (routeros_api, blocking) or 'async'
+ROUTEROS_ENGINE = os.environ.get('ROUTEROS_ENGINE', 'pool')
+
+DEFAULT_PORT = 8728
+DEFAULT_TIMEOUT = 15.0
+
+
+class RouterOsError(Exception):
+    """Base error for the asyncio RouterOS client"""
+
+
+class RouterOsConnectionError(RouterOsError):
+    """The TCP session failed, timed out or was closed"""
+
+
+class RouterOsTrapError(RouterOsError):
+    """The router answered a command with !trap"""
+
+    def __init__(self, message, category=None):
+        super().__init__(message)
+        self.category = category
+
+
+def encode_length(length):
+    """Encode a word length using the RouterOS variable-length scheme"""
+    if length < 0x80:
+        return bytes([length])
+    elif length < 0x4000:
+        return (length | 0x8000).to_bytes(2, 'big')
+    elif length < 0x200000:
+        return (length | 0xC00000).to_bytes(3, 'big')
+    elif length < 0x10000000:
+        return (length | 0xE0000000).to_bytes(4, 'big')
+    else:
+        return b'\xf0' + length.to_bytes(4, 'big')
+
+
+def encode_sentence(words):
+    """Encode a list of words into a sentence terminated by an empty word"""
+    encoded = bytearray()
+    for word in words:
+        if isinstance(word, str):
+            word = word.encode('utf-8')
+        encoded += encode_length(len(word))
+        encoded += word
+    encoded += b'\x00'
+    return bytes(encoded)
+
+
+async def read_length(reader):
+    """Read one variable-length word length from the stream"""
+    first = (await reader.readexactly(1))[0]
+    if first < 0x80:
+        return first
+    elif first < 0xC0:
+        rest = await reader.readexactly(1)
+        return int.from_bytes(bytes([first]) + rest, 'big') & 0x3FFF
+    elif first < 0xE0:
+        rest = await reader.readexactly(2)
+        return int.from_bytes(bytes([first]) + rest, 'big') & 0x1FFFFF
+    elif first < 0xF0:
+        rest = await reader.readexactly(3)
+        return int.from_bytes(bytes([first]) + rest, 'big') & 0xFFFFFFF
+    else:
+        return int.from_bytes(await reader.readexactly(4), 'big')
+
+
+async def read_sentence(reader):
+    """Read one sentence; returns (words, raw byte count)"""
+    words = []
+    size = 0
+    while True:
+        length = await read_length(reader)
+        size += len(encode_length(length)) + length
+        if length == 0:
+            return words, size
+        word = await reader.readexactly(length)
+        words.append(word.decode('utf-8', errors='replace'))
+
+
+def parse_sentence(words):
+    """Split a reply sentence into (reply type, attributes, tag)"""
+    reply_type = words[0] if words else ''
+    attributes = {}
+    tag = None
+    for word in words[1:]:
+        if word.startswith('.tag='):
+            tag = word[5:]
+        elif word.startswith('='):
+            key, _, value = word[1:].partition('=')
+            attributes[key] = value
+    return reply_type, attributes, tag
+
+
+class _PendingCommand:
+    """Replies collected for one tagged command"""
+
+    def __init__(self, loop, stream=False):
+        self.replies = []
+        self.done_attributes = {}
+        self.trap = None
+        self.future = loop.create_future()
+        # Streaming commands hand each !re to the consumer instead of buffering
+        self.queue = asyncio.Queue() if stream else None
+
+
+class AsyncRouterOsClient:
+    """One RouterOS API session driven by asyncio.
+
+    Commands are tagged and may be issued concurrently; a reader task routes
+    every reply sentence to the command that owns its tag. Byte and round
+    trip counters are kept so callers can measure what a cycle costs.
+    """
+
+    def __init__(self, host, port=DEFAULT_PORT, username='admin', password='', timeout=DEFAULT_TIMEOUT):
+        self.host = host
+        self.port = port or DEFAULT_PORT
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.round_trips = 0
+        self._reader = None
+        self._writer = None
+        self._reader_task = None
+        self._pending = {}
+        self._tags = itertools.count(1)
+        self._closed_error = None
+
+    @property
+    def connected(self):
+        return self._writer is not None and self._closed_error is None
+
+    async def connect(self):
+        """Open the TCP session and log in"""
+        try:
+            self._reader, self._writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port), self.timeout)
+        except asyncio.TimeoutError:
+            raise RouterOsConnectionError(f"Connection to {self.host}:{self.port} timed out")
+        except ConnectionRefusedError:
+            raise RouterOsConnectionError(f"Connection refused by {self.host}:{self.port}")
+        except OSError as e:
+            raise RouterOsConnectionError(str(e))
+
+        self._closed_error = None
+        self._reader_task = asyncio.get_running_loop().create_task(self._read_loop())
+        try:
+            await self.login()
+        except Exception:
+            await self.close()
+            raise
+        return self
+
+    async def login(self):
+        """Log in, falling back to the pre-6.43 MD5 challenge when asked"""
+        done = await self._command('/login', {'name': self.username, 'password': self.password})
+        if 'ret' in done:
+            challenge = binascii.unhexlify(done['ret'])
+            digest = hashlib.md5(b'\x00' + self.password.encode() + challenge).hexdigest()
+            await self._command('/login', {'name': self.username, 'response': '00' + digest})
+
+    async def talk(self, command, attributes=None, queries=()):
+        """Run a command and return its !re replies as a list of dicts"""
+        pending = await self._send(command, attributes, queries)
+        return pending.replies
+
+    async def print(self, path, proplist=None, queries=()):
+        """Run ``<path>/print``, optionally projecting columns and filtering rows"""
+        attributes = {}
+        if proplist:
+            attributes['.proplist'] = ','.join(proplist)
+        return await self.talk(path.rstrip('/') + '/print', attributes, queries)
+
+    async def stream(self, command, attributes=None, queries=()):
+        """Run a long-lived command (e.g. ``/log/print =follow-only=``) and
+        yield each !re reply as it arrives. Closing the generator sends
+        ``/cancel`` for the command's tag."""
+        tag, pending = self._start(command, attributes, queries, stream=True)
+        try:
+            await self._writer.drain()
+            while True:
+                item = await pending.queue.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+            if pending.trap is not None:
+                raise pending.trap
+        finally:
+            self._pending.pop(tag, None)
+            if self.connected and not pending.future.done():
+                try:
+                    await self._send('/cancel', {'tag': tag})
+                except RouterOsError:
+                    pass
+
+    async def print_many(self, paths):
+        """Issue several ``/print`` commands concurrently over this session"""
+        results = await asyncio.gather(*(self.print(path) for path in paths))
+        return dict(zip(paths, results))
+
+    async def close(self):
+        """Close the session and fail any command still waiting"""
+        self._fail_pending(RouterOsConnectionError('Connection closed'))
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except Exception:
+                pass
+        if self._reader_task is not None and self._reader_task is not asyncio.current_task():
+            self._reader_task.cancel()
+        self._writer = None
+        self._reader_task = None
+
+    async def _command(self, command, attributes=None, queries=()):
+        pending = await self._send(command, attributes, queries)
+        return pending.done_attributes
+
+    def _start(self, command, attributes=None, queries=(), stream=False):
+        if not self.connected:
+            raise self._closed_error or RouterOsConnectionError('Not connected')
+
+        tag = str(next(self._tags))
+        words = [command]
+        for key, value in (attributes or {}).items():
+            words.append(f'={key}={value}')
+        words.extend(queries)
+        words.append(f'.tag={tag}')
+
+        pending = _PendingCommand(asyncio.get_running_loop(), stream)
+        self._pending[tag] = pending
+        sentence = encode_sentence(words)
+        self._writer.write(sentence)
+        self.bytes_sent += len(sentence)
+        self.round_trips += 1
+        return tag, pending
+
+    async def _send(self, command, attributes=None, queries=()):
+        tag, pending = self._start(command, attributes, queries)
+        try:
+            await self._writer.drain()
+            await asyncio.wait_for(asyncio.shield(pending.future), self.timeout)
+        except asyncio.TimeoutError:
+            await self._cancel(tag)
+            raise RouterOsConnectionError(f"Command {command} on {self.host}:{self.port} timed out")
+        except (ConnectionError, OSError) as e:
+            raise RouterOsConnectionError(str(e))
+        finally:
+            self._pending.pop(tag, None)
+
+        if pending.trap is not None:
+            raise pending.trap
+        return pending
+
+    async def _cancel(self, tag):
+        """Stop a command nobody waits for any more, or drop the session if that fails.
+
+        The ``/cancel`` is sent untagged, so its own reply (like the
+        cancelled command's, whose tag is dropped) is simply discarded.
+        """
+        if not self.connected:
+            return
+        try:
+            sentence = encode_sentence(['/cancel', f'=tag={tag}'])
+            self._writer.write(sentence)
+            self.bytes_sent += len(sentence)
+            self.round_trips += 1
+            await asyncio.wait_for(self._writer.drain(), self.timeout)
+        except (asyncio.TimeoutError, ConnectionError, OSError):
+            await self.close()
+
+    async def _read_loop(self):
+        try:
+            while True:
+                words, size = await read_sentence(self._reader)
+                self.bytes_received += size
+                if not words:
+                    continue
+                reply_type, attributes, tag = parse_sentence(words)
+                if reply_type == '!fatal':
+                    message = words[1] if len(words) > 1 else 'fatal error'
+                    raise RouterOsConnectionError(f"Router closed the session: {message}")
+
+                pending = self._pending.get(tag)
+                if pending is None:
+                    continue
+                if reply_type == '!re':
+                    if pending.queue is not None:
+                        pending.queue.put_nowait(attributes)
+                    else:
+                        pending.replies.append(attributes)
+                elif reply_type == '!trap':
+                    pending.trap = RouterOsTrapError(attributes.get('message', 'unknown error'),
+                                                     attributes.get('category'))
+                elif reply_type == '!done':
+                    pending.done_attributes = attributes
+                    if pending.queue is not None:
+                        pending.queue.put_nowait(None)
+                    if not pending.future.done():
+                        pending.future.set_result(pending)
+        except asyncio.CancelledError:
+            raise
+        except asyncio.IncompleteReadError:
+            self._fail_pending(RouterOsConnectionError('Connection closed by router'))
+        except Exception as e:
+            error = e if isinstance(e, RouterOsError) else RouterOsConnectionError(str(e))
+            self._fail_pending(error)
+
+    def _fail_pending(self, error):
+        self._closed_error = error
+        for pending in list(self._pending.values()):
+            if pending.queue is not None:
+                pending.queue.put_nowait(error)
+            if not pending.future.done():
+                pending.future.set_exception(error)
+                # Streams report through their queue; don't warn about the future
+                if pending.queue is not None:
+                    pending.future.exception()
+        self._pending.clear()
+
+
+class RouterOsEngine:
+    """Shared event loop running in a daemon thread for synchronous callers"""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self._run, name='routeros-engine', daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def run(self, coro, timeout=None):
+        """Run a coroutine on the engine loop and wait for its result"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    """Return the process-wide engine, starting it on first use"""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = RouterOsEngine()
+        return _engine
+
+
+def _to_router_key(key):
+    if key.startswith('.'):
+        return key
+    key = key.replace('_', '-')
+    return '.' + key if key in ('id', 'proplist') else key
+
+
+def _to_python_key(key):
+    return key[1:] if key in ('.id', '.proplist') else key
+
+
+class EngineResource:
+    """Synchronous ``get_resource()`` result backed by the async engine"""
+
+    def __init__(self, api, path):
+        self.api = api
+        self.path = '/' + path.strip('/')
+
+    def get(self, **kwargs):
+        return self.call('print', queries=kwargs)
+
+    def call(self, command, arguments=None, queries=None, additional_queries=()):
+        """Same signature as ``routeros_api`` resources' ``call()``"""
+        attributes = {_to_router_key(key): value for key, value in (arguments or {}).items()}
+        words = [f'?{_to_router_key(key)}={value}' for key, value in (queries or {}).items()]
+        for query in additional_queries:
+            words.extend(word.decode() if isinstance(word, bytes) else word
+                         for word in query.get_api_format())
+        rows = self.api.run(self.api.client.talk(f'{self.path}/{command}', attributes, words))
+        return [{_to_python_key(key): value for key, value in row.items()} for row in rows]
+
+
+class EngineApi:
+    """Synchronous API object mirroring ``routeros_api.RouterOsApi``"""
+
+    def __init__(self, engine, client):
+        self.engine = engine
+        self.client = client
+
+    def run(self, coro):
+        return self.engine.run(coro)
+
+    def get_resource(self, path):
+        return EngineResource(self, path)
+
+
+class AsyncApiPool:
+    """Drop-in replacement for ``routeros_api.RouterOsApiPool`` on the async engine"""
+    socket_timeout = DEFAULT_TIMEOUT
+
+    def __init__(self, host, username='admin', password='', port=None, plaintext_login=True, use_ssl=False):
+        if use_ssl:
+            raise RouterOsError('The async engine does not support API-SSL yet')
+        self.host = host
+        self.username = username
+        self.password = password
+        self.port = port or DEFAULT_PORT
+        self.engine = get_engine()
+        self.client = None
+        self.api = None
+
+    @property
+    def connected(self):
+        return self.client is not None and self.client.connected
+
+    def get_api(self):
+        if not self.connected:
+            self.client = AsyncRouterOsClient(self.host, self.port, self.username, self.password,
+                                              timeout=self.socket_timeout)
+            self.engine.run(self.client.connect())
+            self.api = EngineApi(self.engine, self.client)
+        return self.api
+
+    def disconnect(self):
+        if self.client is not None:
+            try:
+                self.engine.run(self.client.close(), timeout=self.socket_timeout)
+            except Exception:
+                pass
+            self.client = None
+
+
+def create_api_pool(host, port, username, password):
+    """Return a RouterOS API pool for the configured ``ROUTEROS_ENGINE``"""
+    if ROUTEROS_ENGINE == 'async':
+        return AsyncApiPool(host, port=port, username=username, password=password,
+                            plaintext_login=True, use_ssl=False)
+    return routeros_api.RouterOsApiPool(
+        host=host,
+        port=port,
+        username=username,
+        password=password,
+        plaintext_login=True,
+        use_ssl=False
+    )
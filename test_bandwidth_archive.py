@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Tests for the columnar archive of cold raw bandwidth days
+"""
+
+import sqlite3
+
+import numpy as np
+
+from bandwidth_archive import BandwidthArchive
+from bandwidth_partitions import (DAY, ensure_partition, insert_sql, list_partitions, partition_day, partition_name,
+                                  raw_host_history, raw_host_totals, raw_interface_history)
+from maintenance import MaintenanceService
+
+# 2024-01-01 00:00:00 UTC
+BASE = 1704067200
+
+
+def make_db(tmp_path):
+    path = str(tmp_path / 'routers.db')
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE routers (id INTEGER PRIMARY KEY)')
+    conn.executemany('INSERT INTO routers (id) VALUES (?)', [(1,), (2,)])
+    conn.commit()
+    return path, conn
+
+
+def add_ip(conn, rows):
+    """rows of (router_id, host_id, epoch, rx, tx)"""
+    for router_id, host_id, epoch, rx, tx in rows:
+        name = ensure_partition(conn, 'ip_bandwidth_data', partition_name('ip_bandwidth_data', partition_day(epoch)))
+        conn.execute(insert_sql(name, ('router_id', 'host_id', 'timestamp', 'rx_bytes', 'tx_bytes')),
+                     (router_id, host_id, epoch, rx, tx))
+    conn.commit()
+
+
+def add_interface(conn, rows):
+    """rows of (router_id, interface_id, epoch, rx_bps, tx_bps)"""
+    for router_id, interface_id, epoch, rx_bps, tx_bps in rows:
+        name = ensure_partition(conn, 'interface_bandwidth_data',
+                                partition_name('interface_bandwidth_data', partition_day(epoch)))
+        conn.execute(insert_sql(name, ('router_id', 'interface_id', 'rx_bytes', 'tx_bytes', 'rx_bps', 'tx_bps',
+                                       'timestamp')),
+                     (router_id, interface_id, rx_bps * 60 // 8, tx_bps * 60 // 8, rx_bps, tx_bps, epoch))
+    conn.commit()
+
+
+def test_cold_days_move_to_column_files_and_reads_span_both(tmp_path):
+    path, conn = make_db(tmp_path)
+    archive = BandwidthArchive(str(tmp_path / 'archive'))
+    samples = [(1, 7, BASE + 60, 100, 10), (1, 8, BASE + 60, 5, 1), (1, 7, BASE + 120, 200, 20),
+               (2, 7, BASE + 60, 999, 999), (1, 7, BASE + 3 * DAY, 300, 30)]
+    add_ip(conn, samples)
+    add_interface(conn, [(1, 3, BASE + 60, 8000, 800), (1, 4, BASE + 120, 16000, 1600),
+                         (1, 3, BASE + 3 * DAY, 24000, 2400)])
+    before = (raw_host_totals(conn, 1, BASE), raw_host_history(conn, 1, [7, 8], BASE),
+              raw_interface_history(conn, 1, BASE))
+
+    report = MaintenanceService(path, archive=archive).run_once(BASE + 3 * DAY + 3600)
+    assert report['archived'] == 6
+    assert [day for day, _ in list_partitions(conn, 'ip_bandwidth_data')] == [partition_day(BASE + 3 * DAY)]
+    assert [day for day, _ in archive.days('ip_bandwidth_data', 2)] == [partition_day(BASE)]
+
+    # The same answers, now partly from the archive
+    assert sorted(raw_host_totals(conn, 1, BASE, archive)) == sorted(before[0])
+    assert raw_host_history(conn, 1, [7, 8], BASE, archive) == before[1]
+    assert raw_interface_history(conn, 1, BASE, archive) == before[2]
+    # A period inside the hot days does not look at the archive
+    assert raw_host_totals(conn, 1, BASE + 3 * DAY, archive) == [(7, 300, 30)]
+
+
+def test_range_reads_are_memory_mapped_slices(tmp_path):
+    path, conn = make_db(tmp_path)
+    archive = BandwidthArchive(str(tmp_path / 'archive'))
+    add_ip(conn, [(1, 7, BASE + minute * 60, minute, 0) for minute in range(1440)])
+    name = partition_name('ip_bandwidth_data', partition_day(BASE))
+    assert archive.write_partition(conn, 'ip_bandwidth_data', name, partition_day(BASE)) == 1440
+
+    data = archive.read('ip_bandwidth_data', 1, BASE + 600, BASE + 1200)
+    assert isinstance(data['rx_bytes'], np.memmap)
+    assert data['rx_bytes'].tolist() == list(range(10, 20))
+    assert archive.host_history(1, [7], BASE + 600, BASE + 720) == [
+        (BASE + 600, 10, 0), (BASE + 660, 11, 0)]
+
+
+def test_archived_days_follow_archive_retention(tmp_path):
+    path, conn = make_db(tmp_path)
+    archive = BandwidthArchive(str(tmp_path / 'archive'))
+    conn.execute('CREATE TABLE bandwidth_retention_settings (router_id INTEGER PRIMARY KEY, raw_retention_days REAL)')
+    conn.execute('INSERT INTO bandwidth_retention_settings VALUES (2, 60)')
+    conn.commit()
+    add_ip(conn, [(1, 7, BASE, 1, 1), (2, 7, BASE, 1, 1), (3, 7, BASE, 1, 1)])
+    service = MaintenanceService(path, archive=archive)
+    service.run_once(BASE + 3 * DAY)
+    assert archive.routers('ip_bandwidth_data') == [1, 2, 3]
+
+    # Past the raw retention (7 days) archived days are still there
+    service.run_once(BASE + 10 * DAY)
+    assert archive.routers('ip_bandwidth_data') == [1, 2, 3]
+
+    # Router 1 at the default 30 days, router 3 was deleted, router 2 keeps 60 days
+    service.run_once(BASE + 32 * DAY)
+    assert archive.routers('ip_bandwidth_data') == [2]
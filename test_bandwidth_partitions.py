@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Tests for day-partitioned raw bandwidth storage
+"""
+
+import sqlite3
+
+from bandwidth_partitions import (DAY, PARTITIONED_TABLES, drop_partitions_before, ensure_partition,
+                                  format_timestamp, insert_sql, list_partitions, migrate_legacy_tables,
+                                  overlapping_partitions, partition_day, partition_name, query_partitions)
+from dimension_catalog import HOST_SCHEMA, INTERFACE_SCHEMA
+
+# 2024-01-01 00:00:00 UTC
+BASE = 1704067200
+COLUMNS = PARTITIONED_TABLES['ip_bandwidth_data']['columns']
+
+
+def insert_sample(conn, epoch, host_id, rx_bytes, router_id=1):
+    name = ensure_partition(conn, 'ip_bandwidth_data', partition_name('ip_bandwidth_data', partition_day(epoch)))
+    conn.execute(insert_sql(name, COLUMNS), (router_id, host_id, epoch, rx_bytes, 0))
+
+
+def make_db():
+    conn = sqlite3.connect(':memory:')
+    conn.execute(HOST_SCHEMA)
+    conn.execute(INTERFACE_SCHEMA)
+    return conn
+
+
+def test_range_queries_only_read_overlapping_days():
+    conn = make_db()
+    for day in range(5):
+        insert_sample(conn, BASE + day * DAY + 3600, 1, 100 * (day + 1))
+
+    since = BASE + 3 * DAY
+    assert overlapping_partitions(conn, 'ip_bandwidth_data', since) == [
+        'ip_bandwidth_data_p20240104', 'ip_bandwidth_data_p20240105']
+    assert overlapping_partitions(conn, 'ip_bandwidth_data', BASE + DAY, BASE + DAY + 60) == [
+        'ip_bandwidth_data_p20240102']
+
+    # Days outside the window are not even part of the statement
+    conn.execute('DROP TABLE ip_bandwidth_data_p20240101')
+    rows = query_partitions(conn, 'ip_bandwidth_data', 'host_id, rx_bytes', 'router_id = ?', (1,), since,
+                            outer='SELECT host_id, SUM(rx_bytes) FROM ({source}) GROUP BY host_id')
+    assert rows == [(1, 900)]
+    assert query_partitions(conn, 'ip_bandwidth_data', 'rx_bytes', 'router_id = ?', (2,), since) == []
+    assert query_partitions(conn, 'ip_bandwidth_data', 'rx_bytes', 'router_id = ?', (1,), BASE + 10 * DAY) == []
+
+
+def test_retention_drops_whole_days():
+    conn = make_db()
+    for day in range(3):
+        insert_sample(conn, BASE + day * DAY, 1, 1)
+
+    dropped = drop_partitions_before(conn, 'ip_bandwidth_data', BASE + 2 * DAY + 60)
+    assert dropped == ['ip_bandwidth_data_p20240101', 'ip_bandwidth_data_p20240102']
+    assert [name for _, name in list_partitions(conn, 'ip_bandwidth_data')] == ['ip_bandwidth_data_p20240103']
+
+
+def test_legacy_table_is_split_into_days():
+    conn = make_db()
+    conn.execute('''
+        CREATE TABLE ip_bandwidth_data (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, router_id INTEGER NOT NULL, ip_address TEXT NOT NULL,
+            mac_address TEXT, hostname TEXT, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            rx_bytes INTEGER DEFAULT 0, tx_bytes INTEGER DEFAULT 0)
+    ''')
+    for epoch, mac_address in ((BASE + 60, None), (BASE + DAY - 1, 'AA:BB'), (BASE + DAY, None)):
+        conn.execute('''
+            INSERT INTO ip_bandwidth_data (router_id, ip_address, mac_address, timestamp, rx_bytes)
+            VALUES (1, '10.0.0.5', ?, ?, 5)
+        ''', (mac_address, format_timestamp(epoch)))
+
+    assert migrate_legacy_tables(conn) == 3
+    assert conn.execute("SELECT name FROM sqlite_master WHERE name = 'ip_bandwidth_data'").fetchone() is None
+    assert conn.execute('SELECT COUNT(*) FROM ip_bandwidth_data_p20240101').fetchone()[0] == 2
+    assert conn.execute('SELECT COUNT(*) FROM ip_bandwidth_data_p20240102').fetchone()[0] == 1
+    # Text dimensions become catalog ids
+    assert conn.execute('SELECT ip_address, mac_address FROM hosts ORDER BY id').fetchall() == [
+        ('10.0.0.5', ''), ('10.0.0.5', 'AA:BB')]
+    assert migrate_legacy_tables(conn) == 0
+
+
+def test_legacy_interface_counters_become_deltas():
+    conn = make_db()
+    conn.execute('''
+        CREATE TABLE interface_bandwidth_data (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, router_id INTEGER NOT NULL, interface_name TEXT NOT NULL,
+            rx_bytes INTEGER DEFAULT 0, tx_bytes INTEGER DEFAULT 0, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)
+    ''')
+    # Cumulative counters; the third sample was reset and the last follows a long gap
+    for offset, rx_bytes in [(0, 10), (60, 70), (120, 30), (180, 90), (3780, 200)]:
+        conn.execute("INSERT INTO interface_bandwidth_data (router_id, interface_name, rx_bytes, timestamp) "
+                     "VALUES (1, 'ether1', ?, ?)", (rx_bytes, format_timestamp(BASE + offset)))
+
+    assert migrate_legacy_tables(conn) == 2
+    assert conn.execute('''
+        SELECT router_id, interface_id, rx_bytes, rx_bps, timestamp FROM interface_bandwidth_data_p20240101
+        ORDER BY timestamp
+    ''').fetchall() == [(1, 1, 60, 8.0, BASE + 60), (1, 1, 60, 8.0, BASE + 180)]
+    assert conn.execute("SELECT name FROM interfaces WHERE id = 1").fetchone() == ('ether1',)
+    # Served from the covering index with integer window bounds
+    plan = ' '.join(row[3] for row in conn.execute(
+        'EXPLAIN QUERY PLAN SELECT interface_id, rx_bps FROM interface_bandwidth_data_p20240101 '
+        'WHERE router_id = ? AND timestamp >= ?', (1, BASE)))
+    assert 'COVERING INDEX idx_interface_bandwidth_data_p20240101_router_time_rates' in plan
+    assert migrate_legacy_tables(conn) == 0
+
+
+def test_status_and_log_timestamps_become_epoch_seconds():
+    conn = make_db()
+    conn.execute('CREATE TABLE router_status_cache (id INTEGER PRIMARY KEY, router_id INTEGER, '
+                 'last_checked TIMESTAMP DEFAULT CURRENT_TIMESTAMP)')
+    conn.execute('CREATE INDEX idx_router_status_time ON router_status_cache (last_checked)')
+    conn.execute('CREATE TABLE router_logs (id INTEGER PRIMARY KEY, router_id INTEGER, '
+                 'stored_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)')
+    # The collector's local datetime.now() (with microseconds), SQLite's UTC text, and rows already converted
+    local = conn.execute("SELECT datetime(?, 'unixepoch', 'localtime')", (BASE,)).fetchone()[0]
+    conn.execute('INSERT INTO router_status_cache (router_id, last_checked) VALUES (1, ?)', (f'{local}.250000',))
+    conn.execute('INSERT INTO router_status_cache (router_id, last_checked) VALUES (2, ?)', (BASE + 60,))
+    conn.execute('INSERT INTO router_logs (router_id, stored_at) VALUES (1, ?)', (format_timestamp(BASE + 120),))
+    conn.execute('INSERT INTO router_logs (router_id, stored_at) VALUES (1, ?)', (BASE + 180,))
+
+    assert migrate_legacy_tables(conn) == 2
+    assert conn.execute('SELECT typeof(last_checked), last_checked FROM router_status_cache ORDER BY id').fetchall() == [
+        ('integer', BASE), ('integer', BASE + 60)]
+    assert conn.execute('SELECT stored_at FROM router_logs WHERE stored_at >= ? ORDER BY id',
+                        (BASE + 100,)).fetchall() == [(BASE + 120,), (BASE + 180,)]
+    assert migrate_legacy_tables(conn) == 0
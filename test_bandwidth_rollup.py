@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Tests for the bandwidth rollup tiers
+"""
+
+import sqlite3
+
+from bandwidth_partitions import ensure_partition, partition_day, partition_name, raw_host_totals
+from bandwidth_rollup import (DAY, INTERFACE_ROLLUP_SCHEMA, INTERFACE_ROLLUP_UPSERT, IP_ROLLUP_SCHEMA,
+                              IP_ROLLUP_UPSERT, ROLLUP_TIERS, backfill_rollups, chart_tier, choose_tier,
+                              host_history, host_totals, host_totals_by_window, interface_history,
+                              interface_rollup_rows, ip_rollup_rows)
+from dimension_catalog import HOST_SCHEMA, INTERFACE_SCHEMA
+
+# 2024-01-01 00:00:00 UTC, aligned to every tier
+BASE = 1704067200
+
+
+def make_db():
+    conn = sqlite3.connect(':memory:')
+    conn.execute(HOST_SCHEMA)
+    conn.execute(INTERFACE_SCHEMA)
+    conn.execute(IP_ROLLUP_SCHEMA)
+    conn.execute(INTERFACE_ROLLUP_SCHEMA)
+    return conn
+
+
+def raw_partition(conn, table, epoch):
+    return ensure_partition(conn, table, partition_name(table, partition_day(epoch)))
+
+
+def tier(name):
+    return next(tier for tier in ROLLUP_TIERS if tier.name == name)
+
+
+def test_samples_fold_into_every_tier():
+    conn = make_db()
+    for minute, (rx, tx) in enumerate([(100, 10), (300, 30), (200, 20)]):
+        conn.executemany(IP_ROLLUP_UPSERT, ip_rollup_rows([(1, 7, rx, tx)], BASE + minute * 60))
+
+    for name in ('5m', '1h', '1d'):
+        row = conn.execute('''
+            SELECT bucket, host_id, rx_sum, rx_min, rx_max, tx_sum, samples FROM ip_bandwidth_rollup
+            WHERE resolution = ?
+        ''', (tier(name).seconds,)).fetchone()
+        assert row == (BASE, 7, 600, 100, 300, 60, 3)
+
+    # The sixth minute opens a new 5-minute bucket but stays in the same hour;
+    # host 8 is the same IP seen with another MAC, so histories add them up
+    conn.executemany(IP_ROLLUP_UPSERT, ip_rollup_rows([(1, 8, 50, 5)], BASE + 300))
+    assert host_history(conn, 1, [7, 8], tier('5m'), BASE) == [(BASE, 600, 60), (BASE + 300, 50, 5)]
+    assert host_history(conn, 1, [7, 8], tier('1h'), BASE) == [(BASE, 650, 65)]
+    assert host_history(conn, 1, [], tier('1h'), BASE) == []
+    assert sorted(host_totals(conn, 1, tier('1h'), BASE)) == [(7, 600, 60), (8, 50, 5)]
+
+
+def test_interface_tiers_hold_counter_deltas():
+    conn = make_db()
+    conn.executemany(INTERFACE_ROLLUP_UPSERT, interface_rollup_rows(1, {3: (1000, 100)}, BASE))
+    conn.executemany(INTERFACE_ROLLUP_UPSERT, interface_rollup_rows(1, {3: (3000, 300)}, BASE + 60))
+    assert interface_history(conn, 1, tier('5m'), BASE) == [(3, BASE, 4000, 400)]
+
+
+def test_choose_tier_prefers_the_coarsest_detailed_enough_tier():
+    assert choose_tier(3600, min_points=100) is None
+    assert choose_tier(DAY, min_points=100).name == '5m'
+    assert choose_tier(3 * DAY, min_points=100).name == '5m'
+    assert choose_tier(7 * DAY, min_points=100).name == '1h'
+    assert choose_tier(365 * DAY, min_points=100).name == '1d'
+
+
+def test_wide_charts_read_raw_samples_as_far_back_as_they_reach():
+    assert chart_tier(DAY, max_points=50).name == '5m'
+    assert chart_tier(3 * DAY, max_points=1000, raw_days=30) is None
+    assert chart_tier(7 * DAY, max_points=1000, raw_days=30).name == '5m'
+    # Raw samples are gone past the archive retention
+    assert chart_tier(3 * DAY, max_points=5000, raw_days=2).name == '5m'
+
+
+def test_backfill_matches_live_rollups():
+    conn = make_db()
+    ip_partition = raw_partition(conn, 'ip_bandwidth_data', BASE)
+    interface_partition = raw_partition(conn, 'interface_bandwidth_data', BASE)
+    for minute, (rx, tx) in enumerate([(100, 10), (300, 30)]):
+        conn.execute(f'''
+            INSERT INTO {ip_partition} (router_id, host_id, rx_bytes, tx_bytes, timestamp)
+            VALUES (1, 7, ?, ?, ?)
+        ''', (rx, tx, BASE + minute * 60))
+    # Interface rows hold per-poll deltas
+    for offset, rx in [(60, 500), (120, 200), (3600, 300)]:
+        conn.execute(f'''
+            INSERT INTO {interface_partition} (router_id, interface_id, rx_bytes, tx_bytes, timestamp)
+            VALUES (1, 3, ?, 0, ?)
+        ''', (rx, BASE + offset))
+
+    assert backfill_rollups(conn) > 0
+    assert host_history(conn, 1, [7], tier('5m'), BASE) == [(BASE, 400, 40)]
+    assert interface_history(conn, 1, tier('1h'), BASE) == [(3, BASE, 700, 0), (3, BASE + 3600, 300, 0)]
+    # Only runs while the tiers are empty
+    assert backfill_rollups(conn) == 0
+
+
+def test_all_periods_in_one_pass_match_one_query_each():
+    conn = make_db()
+    partition = raw_partition(conn, 'ip_bandwidth_data', BASE)
+    for minute in range(1440):
+        epoch = BASE + minute * 60
+        samples = [(1, host_id, minute * host_id, host_id) for host_id in range(1, 4) if minute % host_id == 0]
+        conn.executemany(f'INSERT INTO {partition} (router_id, host_id, timestamp, rx_bytes, tx_bytes) '
+                         'VALUES (?, ?, ?, ?, ?)', [(r, h, epoch, rx, tx) for r, h, rx, tx in samples])
+        conn.executemany(IP_ROLLUP_UPSERT, ip_rollup_rows(samples, epoch))
+
+    now = BASE + DAY - 90
+    periods = {'1m': 60, '5m': 300, '1h': 3600, '12h': 12 * 3600, '24h': DAY}
+    windows = host_totals_by_window(conn, 1, periods, now)
+    assert list(windows) == list(periods)
+    for name, seconds in periods.items():
+        chosen = choose_tier(seconds)
+        expected = (host_totals(conn, 1, chosen, now - seconds) if chosen
+                    else raw_host_totals(conn, 1, now - seconds))
+        assert sorted(windows[name]) == sorted(expected), name
+    # Host 2 only reports every other minute and host 3 every third
+    assert sorted(host_id for host_id, _, _ in windows['1m']) == [1, 2]
+
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""
+Tests for chart series downsampling
+"""
+
+import math
+
+from chart_downsample import chart_max_points, lttb_indices
+
+# 2024-01-01 00:00:00 UTC
+BASE = 1704067200
+
+
+def series(count):
+    times = [BASE + minute * 60 for minute in range(count)]
+    values = [[10 + 5 * math.sin(minute / 50), 1.0] for minute in range(count)]
+    return times, values
+
+
+def test_short_series_are_kept_whole():
+    times, values = series(50)
+    assert lttb_indices(times, values, 100) == list(range(50))
+    assert lttb_indices(times, values, None) == list(range(50))
+    assert chart_max_points(300) == 300
+    assert chart_max_points(None) == chart_max_points(0) == chart_max_points(-5)
+
+
+def test_week_of_minutes_keeps_ends_and_peaks():
+    times, values = series(10080)
+    # A one-minute download spike and a one-minute upload spike
+    values[4000][0] = 900.0
+    values[7000][1] = 300.0
+
+    kept = lttb_indices(times, values, 500)
+    assert len(kept) == 500
+    assert kept[0] == 0 and kept[-1] == 10079
+    assert 4000 in kept and 7000 in kept
+    assert kept == sorted(set(kept))
+    # One point per bucket: the kept points stay evenly spread over the week
+    assert max(b - a for a, b in zip(kept, kept[1:])) < 2 * 10080 / 498
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Tests for the array-based chart series
+"""
+
+import random
+
+from bandwidth_partitions import format_timestamp
+from chart_series import bucket_rates, chart_points, counter_rates, history_arrays, split_series
+
+# 2024-01-01 00:00:00 UTC
+BASE = 1704067200
+
+
+def loop_points(rows):
+    """The per-row rate loop the arrays replace"""
+    points = []
+    for i, (timestamp, rx_bytes, tx_bytes) in enumerate(rows):
+        download_mbps = upload_mbps = 0
+        if i:
+            seconds = timestamp - rows[i - 1][0]
+            if seconds > 0:
+                download_mbps = ((rx_bytes or 0) * 8) / seconds / 1000000
+                upload_mbps = ((tx_bytes or 0) * 8) / seconds / 1000000
+        points.append({'timestamp': format_timestamp(timestamp), 'download_mbps': download_mbps,
+                       'upload_mbps': upload_mbps, 'total_mbps': download_mbps + upload_mbps})
+    return points
+
+
+def test_counter_rates_match_the_row_loop():
+    rng = random.Random(3)
+    rows = []
+    timestamp = BASE
+    for _ in range(2000):
+        # Uneven polls, a missed one now and then and a repeated second
+        timestamp += rng.choice((0, 59, 60, 61, 120, 3600))
+        rows.append((timestamp, rng.randrange(10 ** 10), rng.choice((None, rng.randrange(10 ** 8)))))
+
+    times, rx_bytes, tx_bytes = history_arrays(rows, 3)
+    download, upload = counter_rates(times, rx_bytes, tx_bytes)
+    assert chart_points(times, download, upload) == loop_points(rows)
+
+    thinned = chart_points(times, download, upload, max_points=100)
+    assert len(thinned) == 100
+    assert thinned[0] == loop_points(rows)[0] and thinned[-1] == loop_points(rows)[-1]
+
+
+def test_empty_history_and_rollup_rates():
+    times, rx_bytes, tx_bytes = history_arrays([], 3)
+    assert chart_points(times, *counter_rates(times, rx_bytes, tx_bytes)) == []
+
+    times, rx_bytes, tx_bytes = history_arrays([(BASE, 37500000, 3750000)], 3)
+    assert chart_points(times, *bucket_rates(rx_bytes, tx_bytes, 300)) == [{
+        'timestamp': '2024-01-01 00:00:00', 'download_mbps': 1.0, 'upload_mbps': 0.1,
+        'total_mbps': 1.0 + 0.1}]
+
+
+def test_series_split_per_interface():
+    rows = [(1, BASE, 8, 80), (1, BASE + 60, 9, 90), (4, BASE, 1, 10)]
+    interface_ids, times, rx_bps, tx_bps = history_arrays(rows, 4, ints=2)
+    series = [(interface_id, stamps.tolist(), rx.tolist())
+              for interface_id, stamps, rx, _ in split_series(interface_ids, times, rx_bps, tx_bps)]
+    assert series == [(1, [BASE, BASE + 60], [8.0, 9.0]), (4, [BASE], [1.0])]
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Tests for the timing-wheel collection scheduler
+"""
+
+import threading
+
+from collection_scheduler import CollectionScheduler, TimingWheel, next_due, router_phase
+
+INTERVALS = {'bandwidth': 60.0, 'interface': 60.0, 'logs': 300.0, 'status': 60.0}
+
+
+class FakeClock:
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def make_scheduler(routers, clock, poll=None, intervals=INTERVALS, **kwargs):
+    calls = []
+
+    def record(router, jobs, cancelled):
+        calls.append((clock.now, router[0], frozenset(jobs)))
+
+    scheduler = CollectionScheduler(poll=poll or record, load_routers=lambda: routers,
+                                    cancel=lambda router_id: None, intervals=intervals,
+                                    max_workers=4, clock=clock, **kwargs)
+    return scheduler, calls
+
+
+def drive(scheduler, clock, until, step=1.0):
+    while clock.now < until:
+        clock.now += step
+        for _, _, future in scheduler.run_pending():
+            future.result()
+
+
+def test_phases_are_spread_and_logs_align_with_base_ticks():
+    phases = [router_phase(router_id, 60.0, 60.0) for router_id in range(1, 11)]
+    assert all(0 <= phase < 60 for phase in phases)
+    # Ten routers never share a second of the minute
+    assert len({int(phase) for phase in phases}) == 10
+
+    for router_id in range(1, 11):
+        log_phase = router_phase(router_id, 300.0, 60.0)
+        assert 0 <= log_phase < 300
+        offset = (log_phase - router_phase(router_id, 60.0, 60.0)) % 60
+        assert min(offset, 60 - offset) < 1e-9
+
+
+def test_missed_ticks_catch_up_or_skip():
+    assert next_due(60.0, 60.0, 61.0, max_catch_up=1) == (120.0, 0)
+    assert next_due(60.0, 60.0, 125.0, max_catch_up=1) == (120.0, 0)
+    # Three ticks behind with one allowed replay: jump to the next future slot
+    assert next_due(60.0, 60.0, 250.0, max_catch_up=1) == (300.0, 3)
+
+
+def test_timing_wheel_survives_long_stalls():
+    wheel = TimingWheel(tick=1.0, size=8)
+    wheel.advance(0.0)
+    for due in (3.0, 12.0, 30.0):
+        wheel.schedule(due, due)
+    assert wheel.advance(5.0) == [(3.0, 3.0)]
+    assert wheel.advance(100.0) == [(12.0, 12.0), (30.0, 30.0)]
+    assert wheel.count == 0
+
+
+def test_jobs_run_on_their_own_intervals_and_share_polls():
+    clock = FakeClock(1000.0)
+    routers = [(1, 'r1', 'h1', 8728, 'u', 'p')]
+    scheduler, calls = make_scheduler(routers, clock)
+    drive(scheduler, clock, until=1000.0 + 600)
+
+    polls = [jobs for _, _, jobs in calls]
+    assert len(polls) == 10
+    # Bandwidth, interface and status ride one poll; logs join every fifth
+    assert all({'bandwidth', 'interface', 'status'} <= jobs for jobs in polls)
+    assert sum('logs' in jobs for jobs in polls) == 2
+    times = [when for when, _, _ in calls]
+    assert all(round(b - a) == 60 for a, b in zip(times, times[1:]))
+
+
+def test_slow_poll_does_not_overlap_or_drift():
+    clock = FakeClock(0.0)
+    release = threading.Event()
+    started = []
+
+    def slow(router, jobs, cancelled):
+        started.append(clock.now)
+        release.wait(5)
+
+    scheduler, _ = make_scheduler([(1, 'r1', 'h1', 8728, 'u', 'p')], clock, poll=slow,
+                                  intervals={'bandwidth': 60.0})
+    futures = []
+    while clock.now < 200:
+        clock.now += 1
+        futures += [future for _, _, future in scheduler.run_pending()]
+    release.set()
+    for future in futures:
+        future.result()
+
+    assert len(started) == 1
+    assert scheduler.stats['overlaps'] == 2
+    scheduler.stop()
+
+
+def test_overlapping_ticks_are_not_passed_to_the_gate():
+    clock = FakeClock(0.0)
+    release = threading.Event()
+    gated = []
+
+    def gate(router_id, tick):
+        gated.append(tick)
+        return True
+
+    scheduler, _ = make_scheduler([(1, 'r1', 'h1', 8728, 'u', 'p')], clock,
+                                  poll=lambda router, jobs, cancelled: release.wait(5),
+                                  intervals={'bandwidth': 60.0}, gate=gate)
+    futures = []
+    while clock.now < 200:
+        clock.now += 1
+        futures += [future for _, _, future in scheduler.run_pending()]
+    release.set()
+    for future in futures:
+        future.result()
+
+    # Ticks skipped as overlaps are never recorded in the lease
+    assert len(gated) == 1
+    assert scheduler.stats['overlaps'] == 2 and scheduler.stats['fenced'] == 0
+    scheduler.stop()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Tests for persisted collector counter state
+"""
+
+import sqlite3
+
+from counter_state import COUNTER_STATE_SCHEMA, COUNTER_WRAP, CounterStateStore, parse_uptime
+from ingest_writer import IngestWriter
+
+
+def make_db(tmp_path):
+    path = str(tmp_path / 'routers.db')
+    conn = sqlite3.connect(path)
+    conn.execute(COUNTER_STATE_SCHEMA)
+    conn.commit()
+    conn.close()
+    return path
+
+
+def test_deltas_resume_after_restart(tmp_path):
+    db = make_db(tmp_path)
+    before = CounterStateStore(db, max_age=300)
+    assert before.advance(1, {'ether1': (1000, 2000)}, now=1000.0) is None
+
+    # A new process reloads the sample and gets a delta on its first poll
+    after = CounterStateStore(db, max_age=300)
+    assert after.load(now=1060.0) == 1
+    assert after.advance(1, {'ether1': (1500, 2600)}, now=1060.0) == {'ether1': (500, 600)}
+
+
+def test_stale_samples_start_a_new_baseline(tmp_path):
+    db = make_db(tmp_path)
+    CounterStateStore(db, max_age=300).advance(1, {'ether1': (1000, 2000)}, now=1000.0)
+
+    store = CounterStateStore(db, max_age=300)
+    assert store.load(now=2000.0) == 0
+    assert store.advance(1, {'ether1': (9000, 9000)}, now=2000.0) is None
+    assert store.advance(1, {'ether1': (9100, 9200)}, now=2060.0) == {'ether1': (100, 200)}
+
+
+def test_counter_reset_and_new_interfaces_are_rebaselined(tmp_path):
+    store = CounterStateStore(make_db(tmp_path), max_age=300)
+    store.advance(1, {'ether1': (1000, 2000), 'ether2': (500, 500)}, now=0.0)
+    deltas = store.advance(1, {'ether1': (10, 20), 'ether2': (800, 900), 'wlan1': (5, 5)}, now=60.0)
+    assert deltas == {'ether2': (300, 400)}
+
+
+def test_wraps_and_reboots_are_told_apart_by_uptime(tmp_path):
+    db = make_db(tmp_path)
+    store = CounterStateStore(db, max_age=300)
+    store.advance(1, {'ether1': (COUNTER_WRAP - 100, 1000)}, now=0.0, uptime=86400)
+
+    # The rx counter wrapped past 2**64; the sample also survives a restart
+    store = CounterStateStore(db, max_age=300)
+    store.load(now=60.0)
+    deltas = store.advance(1, {'ether1': (400, 1600)}, now=60.0, uptime=86460)
+    assert deltas == {'ether1': (500, 600)}
+    assert deltas.seconds == 60.0
+    assert deltas.rates() == {'ether1': (500 * 8 / 60, 600 * 8 / 60)}
+
+    # Up for 20s of the last minute: everything counted since boot, over 20s
+    deltas = store.advance(1, {'ether1': (100, 50), 'wlan1': (20, 0)}, now=120.0, uptime=20)
+    assert deltas == {'ether1': (100, 50), 'wlan1': (20, 0)}
+    assert deltas.rates()['ether1'] == (40.0, 20.0)
+
+
+def test_taking_a_router_over_reloads_its_sample(tmp_path):
+    db = make_db(tmp_path)
+    first, second = CounterStateStore(db, max_age=300), CounterStateStore(db, max_age=300)
+    first.advance(1, {'ether1': (1000, 1000)}, now=0.0)
+    first.advance(2, {'ether1': (50, 50)}, now=0.0)
+
+    # Router 1 moved to the second worker for two polls, then came back
+    second.load(now=60.0, router_id=1)
+    second.advance(1, {'ether1': (2000, 2000)}, now=60.0)
+    second.advance(1, {'ether1': (3000, 3000)}, now=120.0)
+    assert first.load(now=180.0, router_id=1) == 1
+    assert first.advance(1, {'ether1': (3500, 3600)}, now=180.0) == {'ether1': (500, 600)}
+    assert first.previous(2, now=180.0).counters == {'ether1': (50, 50)}
+
+def test_full_reload_replaces_expired_samples(tmp_path):
+    db = make_db(tmp_path)
+    CounterStateStore(db, max_age=300).advance(1, {'ether1': (1000, 1000)}, now=0.0)
+    CounterStateStore(db, max_age=300).advance(2, {'ether1': (50, 50)}, now=200.0)
+
+    store = CounterStateStore(db, max_age=300)
+    assert store.load(now=250.0) == 2
+    # Router 1's sample has expired by the second reload and must not survive it
+    assert store.load(now=400.0) == 1
+    assert store.previous(1, now=0.0) is None
+    assert store.previous(2, now=400.0).counters == {'ether1': (50, 50)}
+
+def test_parse_uptime():
+    assert parse_uptime('2w1d5h33m12s') == 2 * 604800 + 86400 + 5 * 3600 + 33 * 60 + 12
+    assert parse_uptime('1d05:33:12') == 86400 + 5 * 3600 + 33 * 60 + 12
+    assert parse_uptime('45s') == 45
+    assert parse_uptime('') is None
+    assert parse_uptime('N/A') is None
+
+
+def test_samples_are_saved_through_the_ingest_writer(tmp_path):
+    db = make_db(tmp_path)
+    writer = IngestWriter(db)
+    try:
+        store = CounterStateStore(db, max_age=300, writer=writer)
+        store.advance(1, {'ether1': (1000, 2000)}, now=1000.0)
+        writer.flush()
+    finally:
+        writer.stop()
+    after = CounterStateStore(db, max_age=300)
+    assert after.load(now=1060.0) == 1
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Tests for the pooled SQLite connections
+"""
+
+import sqlite3
+import threading
+
+import pytest
+
+from db_pool import ConnectionPool
+
+
+def make_pool(tmp_path, size=None):
+    path = str(tmp_path / 'routers.db')
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE routers (id INTEGER PRIMARY KEY, name TEXT)')
+    conn.commit()
+    conn.close()
+    return ConnectionPool(path, size=size)
+
+
+def test_connections_are_reused_with_their_pragmas(tmp_path):
+    pool = make_pool(tmp_path)
+    with pool.read() as first:
+        assert first.execute('PRAGMA query_only').fetchone()[0] == 1
+        assert first.execute('PRAGMA temp_store').fetchone()[0] == 2
+        assert first.execute('PRAGMA cache_size').fetchone()[0] < 0
+    with pool.read() as second:
+        assert second is first
+    with pool.write() as writer:
+        assert writer is not first
+        assert writer.execute('PRAGMA query_only').fetchone()[0] == 0
+    assert pool.opened == 2
+
+    # Threads each get a connection of their own while they hold one
+    held = []
+    barrier = threading.Barrier(3)
+
+    def read():
+        with pool.read() as conn:
+            held.append(conn)
+            barrier.wait()
+    threads = [threading.Thread(target=read) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len({id(conn) for conn in held}) == 3
+
+
+def test_reads_cannot_write_and_writes_commit_or_roll_back(tmp_path):
+    pool = make_pool(tmp_path)
+    with pytest.raises(sqlite3.OperationalError):
+        with pool.read() as conn:
+            conn.execute("INSERT INTO routers (name) VALUES ('core')")
+
+    with pool.write() as conn:
+        conn.execute("INSERT INTO routers (name) VALUES ('core')")
+    with pytest.raises(ValueError):
+        with pool.write() as conn:
+            conn.execute("INSERT INTO routers (name) VALUES ('edge')")
+            raise ValueError
+    with pool.read() as conn:
+        assert conn.execute('SELECT name FROM routers').fetchall() == [('core',)]
+
+
+def test_idle_connections_beyond_the_pool_size_are_closed(tmp_path):
+    pool = make_pool(tmp_path, size=1)
+    first = pool.acquire()
+    second = pool.acquire()
+    pool.release(first)
+    pool.release(second)
+    with pytest.raises(sqlite3.ProgrammingError):
+        second.execute('SELECT 1')
+    assert pool.acquire() is first
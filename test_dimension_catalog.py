@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""
+Tests for the host and interface dimension catalog
+"""
+
+import sqlite3
+
+from dimension_catalog import HOST_SCHEMA, INTERFACE_SCHEMA, DimensionCatalog
+
+
+def make_db(tmp_path):
+    path = str(tmp_path / 'routers.db')
+    conn = sqlite3.connect(path)
+    conn.execute(HOST_SCHEMA)
+    conn.execute(INTERFACE_SCHEMA)
+    conn.commit()
+    conn.close()
+    return path
+
+
+def test_ids_are_stable_and_shared_between_processes(tmp_path):
+    path = make_db(tmp_path)
+    collector = DimensionCatalog(path)
+    first = collector.host_ids([('10.0.0.5', 'AA:BB', None), ('10.0.0.6', None, 'laptop')])
+    assert collector.host_ids([('10.0.0.5', 'AA:BB', '')]) == first[:1]
+    assert collector.interface_ids(['ether1', 'ether2', 'ether1']) == {'ether1': 1, 'ether2': 2}
+
+    # A second catalog (the web app) picks the rows up from the database
+    web = DimensionCatalog(path)
+    assert web.host(first[1]) == ('10.0.0.6', None, 'laptop')
+    assert web.interface_name(2) == 'ether2'
+    assert web.host_ids([('10.0.0.6', None, 'laptop')]) == first[1:]
+
+
+def test_totals_fold_every_host_of_an_ip(tmp_path):
+    path = make_db(tmp_path)
+    catalog = DimensionCatalog(path)
+    old, new, other = catalog.host_ids([('10.0.0.5', 'AA:BB', None), ('10.0.0.5', 'CC:DD', 'phone'),
+                                        ('10.0.0.6', None, None)])
+
+    assert catalog.host_ids_for_ip('10.0.0.5') == [old, new]
+    assert catalog.host_ids_for_ip('10.0.0.9') == []
+    assert catalog.totals_by_ip([(old, 100, 10), (other, 50, 5), (new, 20, 2)]) == [
+        ('10.0.0.5', 'CC:DD', 'phone', 120, 12), ('10.0.0.6', None, None, 50, 5)]
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Tests for the per-flow conntrack delta engine
+"""
+
+from flow_delta import FlowDeltaEngine, rollup_by_ip
+from router_snapshot import compile_networks
+
+
+def flow(src, dst, orig, repl, protocol='tcp'):
+    return {'protocol': protocol, 'src-address': src, 'dst-address': dst,
+            'orig-bytes': str(orig), 'repl-bytes': str(repl)}
+
+
+def test_first_cycle_is_baseline_then_true_deltas():
+    engine = FlowDeltaEngine()
+    assert engine.update([flow('192.168.1.10:5000', '1.1.1.1:443', 100, 1000)]) == {}
+
+    deltas = engine.update([
+        flow('192.168.1.10:5000', '1.1.1.1:443', 150, 1800),
+        flow('192.168.1.11:6000', '8.8.8.8:53', 60, 120, 'udp'),
+    ])
+    assert deltas == {
+        ('tcp', '192.168.1.10:5000', '1.1.1.1:443'): (50, 800),
+        ('udp', '192.168.1.11:6000', '8.8.8.8:53'): (60, 120),
+    }
+    assert engine.stats['new'] == 1
+
+
+def test_unchanged_expired_and_reset_flows():
+    engine = FlowDeltaEngine()
+    engine.update([flow('192.168.1.10:5000', '1.1.1.1:443', 100, 1000),
+                   flow('192.168.1.10:5001', '1.1.1.1:443', 10, 10)])
+
+    # Unchanged flow reports nothing; the second flow expired
+    assert engine.update([flow('192.168.1.10:5000', '1.1.1.1:443', 100, 1000)]) == {}
+    assert engine.stats['expired'] == 1
+
+    # Same 5-tuple reused by a new connection: counters restart
+    deltas = engine.update([flow('192.168.1.10:5000', '1.1.1.1:443', 40, 70)])
+    assert deltas == {('tcp', '192.168.1.10:5000', '1.1.1.1:443'): (40, 70)}
+    assert engine.stats['reset'] == 1
+
+
+def test_rollup_follows_flow_direction():
+    deltas = {
+        ('tcp', '192.168.1.10:5000', '1.1.1.1:443'): (50, 800),
+        ('tcp', '203.0.113.5:40000', '192.168.1.20:22'): (300, 40),
+        ('udp', '192.168.1.10:6000', '192.168.1.20:53'): (10, 20),
+    }
+    traffic = rollup_by_ip(deltas, {'192.168.1.10', '192.168.1.20'})
+    assert traffic == {'192.168.1.10': [820, 60], '192.168.1.20': [310, 60]}
+
+
+def test_rollup_counts_hosts_in_router_networks():
+    deltas = {
+        ('tcp', '10.0.0.7:5000', '1.1.1.1:443'): (50, 800),
+        ('tcp', '192.168.1.10:5000', '1.1.1.1:443'): (5, 80),
+        ('tcp', '172.16.0.9:5000', '1.1.1.1:443'): (1, 2),
+    }
+    traffic = rollup_by_ip(deltas, {'192.168.1.10'}, compile_networks(['10.0.0.1/24']))
+    assert traffic == {'10.0.0.7': [800, 50], '192.168.1.10': [80, 5]}
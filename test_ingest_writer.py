@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Tests for the single-writer ingestion queue
+"""
+
+import sqlite3
+import threading
+
+import pytest
+
+from ingest_writer import IngestWriter
+
+INSERT = 'INSERT INTO samples (router_id, value) VALUES (?, ?)'
+
+
+def make_db(tmp_path):
+    path = str(tmp_path / 'routers.db')
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE samples (router_id INTEGER NOT NULL, value INTEGER NOT NULL)')
+    conn.commit()
+    conn.close()
+    return path
+
+
+def count(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute('SELECT COUNT(*) FROM samples').fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_writes_in_one_window_share_a_commit(tmp_path):
+    db = make_db(tmp_path)
+    writer = IngestWriter(db, batch_size=1000, max_latency=0.5)
+    for router_id in range(20):
+        writer.submit(INSERT, [(router_id, value) for value in range(10)])
+    writer.flush(timeout=5)
+
+    metrics = writer.metrics()
+    assert count(db) == 200
+    assert metrics['rows'] == 201  # plus the flush marker
+    assert metrics['commits'] <= 2
+    assert metrics['queue_depth'] == 0
+
+    conn = sqlite3.connect(db)
+    assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    conn.close()
+    writer.stop()
+
+
+def test_batch_size_bounds_a_transaction(tmp_path):
+    db = make_db(tmp_path)
+    writer = IngestWriter(db, batch_size=50, max_latency=5)
+    for router_id in range(10):
+        writer.submit(INSERT, [(router_id, value) for value in range(10)])
+    writer.flush(timeout=5)
+    assert count(db) == 100
+    assert writer.metrics()['commits'] >= 2
+    writer.stop()
+
+
+def test_failed_write_does_not_drop_the_window(tmp_path):
+    db = make_db(tmp_path)
+    writer = IngestWriter(db, batch_size=1000, max_latency=0.2)
+    writer.submit(INSERT, [(1, 1)])
+    writer.submit(INSERT, [(2, None)])  # NOT NULL violation
+    writer.submit(INSERT, [(3, 3)])
+    writer.flush(timeout=5)
+    assert count(db) == 2
+    assert writer.metrics()['failed'] == 1
+
+    try:
+        writer.submit_call(lambda conn: conn.execute('INSERT INTO missing VALUES (1)'), wait=True, timeout=5)
+    except sqlite3.OperationalError:
+        pass
+    else:
+        raise AssertionError('a waited write must re-raise its error')
+    writer.stop()
+
+
+def test_writer_failure_is_raised_to_every_waiter(tmp_path):
+    writer = IngestWriter(str(tmp_path / 'missing' / 'routers.db'), max_latency=0)
+    for _ in range(2):
+        with pytest.raises(sqlite3.OperationalError):
+            writer.submit_call(lambda conn: None, wait=True, timeout=5)
+    with pytest.raises(sqlite3.OperationalError):
+        writer.submit(INSERT, [(1, 1)])
+    writer.stop()
+
+
+def test_wait_is_bounded(tmp_path):
+    db = make_db(tmp_path)
+    writer = IngestWriter(db, max_latency=0)
+    release = threading.Event()
+    writer.submit_call(lambda conn: release.wait(5))
+    with pytest.raises(TimeoutError):
+        writer.submit_call(lambda conn: None, wait=True, timeout=0.1)
+    release.set()
+    writer.stop()
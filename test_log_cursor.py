@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Tests for incremental log collection and log follow mode
+"""
+
+import sqlite3
+import time
+
+from db_pool import ConnectionPool
+from log_cursor import (LOG_CURSOR_SCHEMA, LogFollower, collect_new_logs, fetch_new_logs, load_cursor, plan_fetch,
+                        save_logs)
+from router_snapshot import RouterSnapshot
+from routeros_async import AsyncApiPool
+from test_routeros_async import FakeRouterOs
+
+
+def make_db(tmp_path):
+    path = str(tmp_path / 'routers.db')
+    conn = sqlite3.connect(path)
+    conn.execute('''
+        CREATE TABLE router_logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            router_id INTEGER NOT NULL,
+            timestamp TEXT NOT NULL,
+            topics TEXT,
+            message TEXT NOT NULL,
+            severity TEXT,
+            stored_at INTEGER
+        )
+    ''')
+    conn.execute(LOG_CURSOR_SCHEMA)
+    conn.commit()
+    conn.close()
+    return ConnectionPool(path)
+
+
+def log_row(number, message):
+    return {'.id': f'*{number:X}', 'time': f'12:00:{number:02d}', 'topics': 'system,info', 'message': message}
+
+
+def stored_messages(db):
+    with db.read() as conn:
+        return [row[0] for row in conn.execute('SELECT message FROM router_logs ORDER BY id')]
+
+
+def start_fake(pool, tables):
+    async def start():
+        return await FakeRouterOs(tables).start()
+
+    server = pool.engine.run(start())
+    pool.port = server.port
+    return server
+
+
+def test_plan_fetch_handles_cursor_states():
+    ids = ['*1', '*2', '*A']
+    assert plan_fetch([], None) == ([], None)
+    assert plan_fetch(ids, None) == (None, None)
+    assert plan_fetch(ids, {'last_id': '*2'}) == (['*A'], '*2')
+    # Ids restarted below the cursor: take the whole buffer again
+    assert plan_fetch(ids, {'last_id': '*FF'}) == (None, None)
+
+
+def test_only_new_lines_are_fetched_and_stored(tmp_path):
+    db = make_db(tmp_path)
+    pool = AsyncApiPool('127.0.0.1', username='admin', password='secret')
+    server = start_fake(pool, {'/log': [log_row(1, 'boot'), log_row(2, 'link up')]})
+    try:
+        api = pool.get_api()
+        assert collect_new_logs(db, 1, RouterSnapshot(api, 1)) == 2
+        assert collect_new_logs(db, 1, RouterSnapshot(api, 1)) == 0
+
+        server.tables['/log'].append(log_row(3, 'login failure'))
+        del server.commands[:]
+        assert collect_new_logs(db, 1, RouterSnapshot(api, 1)) == 1
+
+        # One id listing plus one lookup of the new line and the cursor line
+        fetches = [words for words in server.commands if words[0] == '/log/print']
+        assert len(fetches) == 2
+        assert '?.id=*3' in fetches[1] and '?.id=*2' in fetches[1]
+        assert stored_messages(db) == ['boot', 'link up', 'login failure']
+
+        # Reboot: numbering restarts, so the cursor line no longer matches
+        server.tables['/log'] = [log_row(1, 'boot again'), log_row(2, 'dhcp lease'), log_row(3, 'ntp sync'),
+                                 log_row(4, 'link down')]
+        assert collect_new_logs(db, 1, RouterSnapshot(api, 1)) == 4
+        assert stored_messages(db)[-4:] == ['boot again', 'dhcp lease', 'ntp sync', 'link down']
+    finally:
+        pool.disconnect()
+        pool.engine.run(server.stop())
+
+
+def test_concurrent_polls_store_each_line_once(tmp_path):
+    db = make_db(tmp_path)
+    save_logs(db, 1, [log_row(1, 'boot')])
+    with db.read() as conn:
+        cursor = load_cursor(conn, 1)
+
+    # The page and the collector both fetched against the same cursor
+    new_rows = [log_row(2, 'link up'), log_row(3, 'login failure')]
+    assert save_logs(db, 1, new_rows, cursor=cursor) == 2
+    assert save_logs(db, 1, new_rows + [log_row(4, 'ntp sync')], cursor=cursor) == 1
+    assert stored_messages(db) == ['boot', 'link up', 'login failure', 'ntp sync']
+
+
+def test_follower_catches_up_and_streams_new_lines(tmp_path):
+    db = make_db(tmp_path)
+    pool = AsyncApiPool('127.0.0.1', username='admin', password='secret')
+    server = start_fake(pool, {'/log': [log_row(1, 'boot')]})
+    follower = LogFollower(pool.engine, db, 1, '127.0.0.1', server.port, 'admin', 'secret',
+                           flush_interval=0).start()
+    try:
+        deadline = time.monotonic() + 5
+        while not server.followers and time.monotonic() < deadline:
+            time.sleep(0.02)
+        pool.engine.run(server.emit('/log', log_row(2, 'link up')))
+        while follower.lines_ingested < 2 and time.monotonic() < deadline:
+            time.sleep(0.02)
+        assert stored_messages(db) == ['boot', 'link up']
+    finally:
+        follower.stop()
+        pool.engine.run(server.stop())
+
+
+def test_follower_flushes_a_burst_once_the_router_goes_quiet(tmp_path):
+    db = make_db(tmp_path)
+    pool = AsyncApiPool('127.0.0.1', username='admin', password='secret')
+    server = start_fake(pool, {'/log': [log_row(1, 'boot')]})
+    follower = LogFollower(pool.engine, db, 1, '127.0.0.1', server.port, 'admin', 'secret',
+                           flush_interval=0.2).start()
+    try:
+        deadline = time.monotonic() + 5
+        while not server.followers and time.monotonic() < deadline:
+            time.sleep(0.02)
+        # The last lines of the burst arrive within the flush interval and nothing follows them
+        for number, message in ((2, 'link up'), (3, 'link down'), (4, 'link up')):
+            pool.engine.run(server.emit('/log', log_row(number, message)))
+        while follower.lines_ingested < 4 and time.monotonic() < deadline:
+            time.sleep(0.02)
+        assert stored_messages(db) == ['boot', 'link up', 'link down', 'link up']
+    finally:
+        follower.stop()
+        pool.engine.run(server.stop())
+
+
+def test_id_lookups_reach_routeros_api_in_order():
+    from routeros_api.api import RouterOsApi
+    from routeros_api.api_communicator import ApiCommunicator
+
+    class LogSocket:
+        """routeros_api base answering /log prints from a list of rows"""
+
+        def __init__(self, rows):
+            self.rows = rows
+            self.sent = []
+            self.replies = []
+
+        def send_sentence(self, words):
+            self.sent.append(words)
+            tag = words[-1]
+            for row in self.rows:
+                self.replies.append([b'!re'] + [f'={key}={value}'.encode() for key, value in row.items()] + [tag])
+            self.replies.append([b'!done', tag])
+
+        def receive_sentence(self):
+            return self.replies.pop(0)
+
+    socket = LogSocket([log_row(number, 'line') for number in range(1, 8)])
+    api = RouterOsApi(ApiCommunicator(socket))
+    fetch_new_logs(RouterSnapshot(api, 1), {'last_id': '*3', 'last_hash': ''})
+    lookup = socket.sent[1]
+    assert lookup[:2] == [b'/log/print', b'=.proplist=.id,time,topics,message']
+    assert lookup[2:-1] == [b'?.id=*4', b'?.id=*5', b'?.id=*6', b'?.id=*7', b'?.id=*3', b'?#||||']
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Tests for the retention and vacuum maintenance service
+"""
+
+import sqlite3
+
+from bandwidth_partitions import ensure_partition, list_partitions, partition_day, partition_name
+from bandwidth_rollup import DAY, INTERFACE_ROLLUP_SCHEMA, IP_ROLLUP_SCHEMA, IP_ROLLUP_UPSERT, ip_rollup_rows
+from dimension_catalog import HOST_SCHEMA, INTERFACE_SCHEMA
+from maintenance import BANDWIDTH_RETENTION_SCHEMA, MaintenanceService, enable_incremental_vacuum
+
+# 2024-01-01 00:00:00 UTC
+BASE = 1704067200
+
+
+def make_db(tmp_path, routers=(1,)):
+    path = str(tmp_path / 'routers.db')
+    conn = sqlite3.connect(path)
+    enable_incremental_vacuum(conn)
+    conn.execute('CREATE TABLE routers (id INTEGER PRIMARY KEY)')
+    conn.execute('''
+        CREATE TABLE router_status_cache (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, router_id INTEGER NOT NULL, status TEXT NOT NULL)
+    ''')
+    conn.execute('''
+        CREATE TABLE router_logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, router_id INTEGER, message TEXT, stored_at INTEGER)
+    ''')
+    conn.execute('CREATE TABLE log_retention_settings (id INTEGER PRIMARY KEY, router_id INTEGER, retention_days INTEGER)')
+    for schema in (BANDWIDTH_RETENTION_SCHEMA, HOST_SCHEMA, INTERFACE_SCHEMA, IP_ROLLUP_SCHEMA, INTERFACE_ROLLUP_SCHEMA):
+        conn.execute(schema)
+    conn.executemany('INSERT INTO routers (id) VALUES (?)', [(router_id,) for router_id in routers])
+    conn.commit()
+    return path, conn
+
+
+def add_raw(conn, router_id, epoch, count=1):
+    table = ensure_partition(conn, 'ip_bandwidth_data', partition_name('ip_bandwidth_data', partition_day(epoch)))
+    conn.executemany(f'INSERT INTO {table} (router_id, host_id, rx_bytes, tx_bytes, timestamp) VALUES (?, 1, 1, 1, ?)',
+                     [(router_id, epoch + i) for i in range(count)])
+    conn.commit()
+
+
+def count(conn, table, where='1'):
+    return conn.execute(f'SELECT COUNT(*) FROM {table} WHERE {where}').fetchone()[0]
+
+
+def test_each_retention_is_applied(tmp_path):
+    path, conn = make_db(tmp_path)
+    now = BASE + 400 * DAY
+    conn.executemany(IP_ROLLUP_UPSERT, ip_rollup_rows([(1, 7, 1, 1)], BASE))
+    conn.executemany(IP_ROLLUP_UPSERT, ip_rollup_rows([(1, 7, 1, 1)], now - 60))
+    conn.commit()
+    add_raw(conn, 1, BASE)
+    add_raw(conn, 1, now - 60)
+
+    report = MaintenanceService(path, analyze_interval=0).run_once(now)
+    assert report['dropped'] == 1
+    assert [day for day, _ in list_partitions(conn, 'ip_bandwidth_data')] == [partition_day(now - 60)]
+    # 5m and 1h buckets from 400 days ago are gone, daily ones are kept for years
+    assert report['deleted'] == {'ip_bandwidth_rollup': 2}
+    assert count(conn, 'ip_bandwidth_rollup', f'resolution = {DAY}') == 2
+    assert report['analyzed']
+    assert count(conn, 'sqlite_master', "name = 'sqlite_stat1'") == 1
+
+
+def test_router_override_trims_inside_kept_days_in_chunks(tmp_path):
+    path, conn = make_db(tmp_path, routers=(1, 2))
+    now = BASE + 10 * DAY
+    # Router 2 keeps raw samples for 30 days, router 1 for the default 7
+    conn.execute('INSERT INTO bandwidth_retention_settings (router_id, raw_retention_days) VALUES (2, 30)')
+    conn.commit()
+    for router_id in (1, 2):
+        add_raw(conn, router_id, BASE, count=250)
+        add_raw(conn, router_id, now - 60)
+
+    service = MaintenanceService(path, chunk_rows=100)
+    report = service.run_once(now)
+    assert report['dropped'] == 0
+    assert report['deleted'] == {'ip_bandwidth_data': 250}
+    old = partition_name('ip_bandwidth_data', partition_day(BASE))
+    assert count(conn, old, 'router_id = 1') == 0
+    assert count(conn, old, 'router_id = 2') == 250
+    assert service.chunk_rows >= 100
+
+
+def test_logs_and_status_cache_are_trimmed(tmp_path):
+    path, conn = make_db(tmp_path, routers=(1, 2))
+    now = BASE + 10 * DAY
+    conn.execute('INSERT INTO log_retention_settings (router_id, retention_days) VALUES (2, 3)')
+    conn.execute('INSERT INTO log_retention_settings (router_id, retention_days) VALUES (2, 30)')
+    conn.executemany('INSERT INTO router_logs (router_id, message, stored_at) VALUES (?, ?, ?)', [
+        (1, 'old', now - 8 * DAY), (1, 'new', now - 6 * DAY), (2, 'kept', now - 8 * DAY)])
+    conn.executemany('INSERT INTO router_status_cache (router_id, status) VALUES (?, ?)',
+                     [(1, 'offline'), (1, 'online'), (2, 'online'), (9, 'online')])
+    conn.commit()
+
+    report = MaintenanceService(path).run_once(now)
+    assert report['deleted'] == {'router_logs': 1, 'router_status_cache': 2}
+    assert [row[0] for row in conn.execute('SELECT message FROM router_logs ORDER BY id')] == ['new', 'kept']
+    assert conn.execute('SELECT router_id, status FROM router_status_cache ORDER BY id').fetchall() == [
+        (1, 'online'), (2, 'online')]
+
+
+def test_freed_pages_are_returned_to_the_file_system(tmp_path):
+    path, conn = make_db(tmp_path)
+    assert conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2
+    add_raw(conn, 1, BASE, count=20000)
+    conn.close()
+
+    report = MaintenanceService(path, vacuum_pages=16).run_once(BASE + 30 * DAY)
+    assert report['dropped'] == 1
+    assert report['bytes_reclaimed'] > 0
+    conn = sqlite3.connect(path)
+    assert conn.execute('PRAGMA freelist_count').fetchone()[0] == 0
+
+
+def test_existing_database_is_converted_up_to_the_size_limit(tmp_path):
+    path = str(tmp_path / 'old.db')
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE t (x)')
+    conn.commit()
+
+    assert not enable_incremental_vacuum(conn, max_bytes=0)
+    assert conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 0
+    assert enable_incremental_vacuum(conn)
+    assert conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2
@@ -4,10 +4,21 @@ Performance test for MK-monitoring optimizations
 Tests the key performance improvements implemented
 """
 
+import os
+import sqlite3
+import tempfile
 import time
 import threading
 from collections import OrderedDict
 
+from bandwidth_partitions import (PARTITIONED_TABLES, ensure_partition, format_timestamp, insert_sql, partition_day,
+                                  partition_name, raw_host_totals)
+from bandwidth_rollup import (INTERFACE_ROLLUP_SCHEMA, IP_ROLLUP_SCHEMA, ROLLUP_INDEXES, choose_tier, host_totals,
+                              host_totals_by_window)
+from chart_series import chart_points, counter_rates, history_arrays
+from db_pool import ConnectionPool
+from router_leases import LEASE_SCHEMA, ROLE_SCHEMA, WORKER_SCHEMA, RouterLeaseManager
+
 def test_cache_performance():
     """Test LRU cache performance"""
     print("Testing LRU cache performance...")
@@ -79,6 +90,210 @@ def test_bytes_parsing():
     print(f"  10,000 bytes parses: {parse_time:.4f}s")
     print(f"  Total upload: {total_upload}, download: {total_download}")
 
+def run_sharded_fleet(db_path, workers, routers, poll_latency):
+    """Poll a simulated fleet once with ``workers`` lease-sharded collectors.
+
+    Returns (wall time, times each router was polled, polls per worker).
+    """
+    managers = [RouterLeaseManager(db_path, f'bench-{workers}-{index}', ttl=90) for index in range(workers)]
+    # Let heartbeats and handovers settle before the timed interval
+    for _ in range(3):
+        for manager in managers:
+            manager.rebalance(routers)
+    
+    polled = {}
+    shard_polls = {manager.worker_id: 0 for manager in managers}
+    polled_lock = threading.Lock()
+    tick = time.time()
+    
+    def worker(manager):
+        for router_id in sorted(manager.owned):
+            if manager.begin_poll(router_id, tick):
+                time.sleep(poll_latency)  # simulated RouterOS round trips
+                with polled_lock:
+                    polled[router_id] = polled.get(router_id, 0) + 1
+                    shard_polls[manager.worker_id] += 1
+    
+    threads = [threading.Thread(target=worker, args=(manager,)) for manager in managers]
+    start_time = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall_time = time.time() - start_time
+    
+    for manager in managers:
+        manager.release_all()
+    return wall_time, polled, shard_polls
+
+def test_sharded_collector_scaling():
+    """Test collector throughput against worker count with router leases"""
+    print("\nTesting sharded collector scaling...")
+    
+    routers = list(range(1, 161))
+    poll_latency = 0.005
+    throughput = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'routers.db')
+        conn = sqlite3.connect(db_path)
+        conn.execute(LEASE_SCHEMA)
+        conn.execute(WORKER_SCHEMA)
+        conn.execute(ROLE_SCHEMA)
+        conn.commit()
+        conn.close()
+        
+        for workers in (1, 2, 4):
+            wall_time, polled, shard_polls = run_sharded_fleet(db_path, workers, routers, poll_latency)
+            # Every router exactly once per interval, whatever the worker count
+            assert sorted(polled) == routers and set(polled.values()) == {1}
+            # Shards poll in parallel, so an interval lasts as long as the busiest shard's polls;
+            # wall time is only printed, it depends on how busy the machine is
+            throughput[workers] = len(routers) / max(shard_polls.values())
+            print(f"  {workers} worker(s): busiest shard polls {max(shard_polls.values())} routers "
+                  f"({throughput[workers] / throughput[1]:.2f}x), {len(routers) / wall_time:.0f} routers/s")
+    
+    # Rendezvous shares are uneven for small fleets; allow some slack
+    assert throughput[4] > 2.5 * throughput[1]
+
+def time_requests(run_query, requests):
+    """Median seconds of ``run_query()`` over ``requests`` calls"""
+    timings = []
+    for _ in range(requests):
+        start_time = time.perf_counter()
+        run_query()
+        timings.append(time.perf_counter() - start_time)
+    return sorted(timings)[len(timings) // 2]
+
+def test_pooled_connection_latency():
+    """Test per-request query latency with a fresh connection against a pooled one"""
+    print("\nTesting pooled SQLite connections...")
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'routers.db')
+        conn = sqlite3.connect(db_path)
+        conn.execute('CREATE TABLE routers (id INTEGER PRIMARY KEY, name TEXT)')
+        conn.execute('CREATE TABLE router_logs (id INTEGER PRIMARY KEY, router_id INTEGER, timestamp TEXT, '
+                     'message TEXT, severity TEXT)')
+        conn.execute('CREATE INDEX idx_router_logs_time ON router_logs (router_id, timestamp)')
+        conn.execute("INSERT INTO routers VALUES (1, 'core')")
+        conn.executemany('INSERT INTO router_logs (router_id, timestamp, message, severity) VALUES (1, ?, ?, ?)',
+                         [(f'2024-01-01 00:{i // 60:02d}:{i % 60:02d}', f'line {i}', 'info') for i in range(3000)])
+        conn.commit()
+        conn.close()
+        
+        # What a log page reads: the router, then one page of its logs
+        def log_page(conn):
+            conn.execute('SELECT name FROM routers WHERE id = ?', (1,)).fetchone()
+            conn.execute('SELECT * FROM router_logs WHERE router_id = ? ORDER BY timestamp DESC LIMIT 50',
+                         (1,)).fetchall()
+        
+        def direct():
+            conn = sqlite3.connect(db_path)
+            log_page(conn)
+            conn.close()
+        
+        pool = ConnectionPool(db_path)
+        
+        def pooled():
+            with pool.read() as conn:
+                log_page(conn)
+        
+        before = time_requests(direct, 500)
+        after = time_requests(pooled, 500)
+        pool.close()
+        print(f"  Connection per request: {before * 1000:.3f} ms")
+        print(f"  Pooled connection:      {after * 1000:.3f} ms ({before / after:.1f}x)")
+    
+    assert pool.opened == 1
+    assert after < before
+
+def seed_bandwidth_day(conn, ips, now):
+    """A router's last 6 hours of minute polls and 24 hours of 5-minute rollups for ``ips`` hosts"""
+    conn.execute(IP_ROLLUP_SCHEMA)
+    conn.execute(INTERFACE_ROLLUP_SCHEMA)
+    for index in ROLLUP_INDEXES:
+        conn.execute(index)
+    columns = PARTITIONED_TABLES['ip_bandwidth_data']['columns']
+    for minute in range(360):
+        epoch = now - 21600 + minute * 60
+        name = ensure_partition(conn, 'ip_bandwidth_data', partition_name('ip_bandwidth_data', partition_day(epoch)))
+        conn.executemany(insert_sql(name, columns),
+                         [(1, host_id, epoch, host_id * 1000 + minute, host_id) for host_id in range(1, ips + 1)])
+    conn.executemany('INSERT INTO ip_bandwidth_rollup VALUES (1, 300, ?, ?, ?, 0, 0, ?, 0, 0, 5)',
+                     [(host_id, bucket, host_id * 5000, host_id * 5)
+                      for bucket in range(now - 86400 - now % 300, now, 300) for host_id in range(1, ips + 1)])
+    conn.commit()
+
+def test_multi_window_stats():
+    """Test per-IP totals of several periods: one query per period against one pass per source"""
+    print("\nTesting multi-window bandwidth stats...")
+    
+    # 06:00 UTC, so the raw samples share one day partition
+    now = 1704067200 + 21600
+    periods = {'5m': 300, '15m': 900, '1h': 3600, '6h': 21600, '24h': 86400}
+    
+    def per_period(conn):
+        totals = {}
+        for name, seconds in periods.items():
+            tier = choose_tier(seconds)
+            if tier:
+                totals[name] = host_totals(conn, 1, tier, now - seconds)
+            else:
+                totals[name] = raw_host_totals(conn, 1, now - seconds)
+        return totals
+    
+    for ips in (10, 100, 1000):
+        conn = sqlite3.connect(':memory:')
+        seed_bandwidth_day(conn, ips, now)
+        
+        before = per_period(conn)
+        after = host_totals_by_window(conn, 1, periods, now)
+        assert {name: sorted(rows) for name, rows in before.items()} == \
+            {name: sorted(rows) for name, rows in after.items()}
+        
+        requests = max(5, 1000 // ips)
+        loop_time = time_requests(lambda: per_period(conn), requests)
+        single_time = time_requests(lambda: host_totals_by_window(conn, 1, periods, now), requests)
+        print(f"  {ips:4d} IPs: per period {loop_time * 1000:.2f} ms, "
+              f"single pass {single_time * 1000:.2f} ms ({loop_time / single_time:.2f}x)")
+        conn.close()
+
+def loop_chart_points(rows):
+    """The per-row rate loop chart history used before chart_series"""
+    points = []
+    for i, (timestamp, rx_bytes, tx_bytes) in enumerate(rows):
+        download_mbps = upload_mbps = 0
+        if i:
+            seconds = timestamp - rows[i - 1][0]
+            if seconds > 0:
+                download_mbps = ((rx_bytes or 0) * 8) / seconds / 1000000
+                upload_mbps = ((tx_bytes or 0) * 8) / seconds / 1000000
+        points.append({'timestamp': format_timestamp(timestamp), 'download_mbps': download_mbps,
+                       'upload_mbps': upload_mbps, 'total_mbps': download_mbps + upload_mbps})
+    return points
+
+def array_chart_points(rows, max_points=None):
+    times, rx_bytes, tx_bytes = history_arrays(rows, 3)
+    download, upload = counter_rates(times, rx_bytes, tx_bytes)
+    return chart_points(times, download, upload, max_points)
+
+def test_vectorized_chart_rates():
+    """Test chart history rates: per-row loop against NumPy columns"""
+    print("\nTesting chart history rate computation...")
+    
+    for count in (1000, 100000, 1000000):
+        rows = [(1704067200 + i * 60, (i * 7919) % 10 ** 9, (i * 104729) % 10 ** 8) for i in range(count)]
+        requests = max(1, 10000 // count)
+        
+        if count <= 100000:
+            assert array_chart_points(rows) == loop_chart_points(rows)
+        loop_time = time_requests(lambda: loop_chart_points(rows), requests)
+        array_time = time_requests(lambda: array_chart_points(rows), requests)
+        thinned_time = time_requests(lambda: array_chart_points(rows, 1000), requests)
+        print(f"  {count:7d} rows: loop {loop_time * 1000:.1f} ms, arrays {array_time * 1000:.1f} ms "
+              f"({loop_time / array_time:.2f}x), arrays + 1000 points {thinned_time * 1000:.1f} ms "
+              f"({loop_time / thinned_time:.2f}x)")
+
 if __name__ == "__main__":
     print("MK-Monitoring Performance Tests")
     print("=" * 50)
@@ -86,6 +301,10 @@ if __name__ == "__main__":
     test_cache_performance()
     test_ip_classification()
     test_bytes_parsing()
+    test_sharded_collector_scaling()
+    test_pooled_connection_latency()
+    test_multi_window_stats()
+    test_vectorized_chart_rates()
     
     print("\n" + "=" * 50)
     print("Performance tests completed successfully!")
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Query plan regression tests for the hot bandwidth reads
+"""
+
+import re
+import sqlite3
+
+from bandwidth_indexes import build_missing_indexes, index_statements
+from bandwidth_partitions import (ensure_partition, partition_day, partition_name, raw_host_history,
+                                  raw_host_totals, raw_host_window_totals, raw_interface_history)
+from bandwidth_rollup import (INTERFACE_ROLLUP_SCHEMA, IP_ROLLUP_SCHEMA, ROLLUP_TIERS, host_buckets, host_history,
+                              host_totals, host_window_totals, interface_history)
+from dimension_catalog import HOST_SCHEMA, INTERFACE_SCHEMA
+
+# 2024-01-01 00:00:00 UTC
+BASE = 1704067200
+BANDWIDTH_TABLE = re.compile(r'\b(ip|interface)_bandwidth_(data_p\d{8}|rollup)\b')
+
+
+class RecordingConnection:
+    """Passes statements through, keeping them for EXPLAIN QUERY PLAN"""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.statements = []
+
+    def execute(self, sql, params=()):
+        self.statements.append((sql, tuple(params)))
+        return self.conn.execute(sql, params)
+
+
+def make_db(tmp_path):
+    path = str(tmp_path / 'routers.db')
+    conn = sqlite3.connect(path)
+    for schema in (HOST_SCHEMA, INTERFACE_SCHEMA, IP_ROLLUP_SCHEMA, INTERFACE_ROLLUP_SCHEMA):
+        conn.execute(schema)
+    for day in range(2):
+        for table in ('ip_bandwidth_data', 'interface_bandwidth_data'):
+            ensure_partition(conn, table, partition_name(table, partition_day(BASE + day * 86400)))
+    conn.commit()
+    return path, conn
+
+
+def hot_queries(conn):
+    tier = ROLLUP_TIERS[0]
+    raw_host_totals(conn, 1, BASE)
+    raw_host_history(conn, 1, [3, 4], BASE)
+    raw_interface_history(conn, 1, BASE)
+    host_totals(conn, 1, tier, BASE)
+    host_history(conn, 1, [3, 4], tier, BASE)
+    host_buckets(conn, 1, tier, BASE)
+    raw_host_window_totals(conn, 1, [BASE, BASE + 3600])
+    host_window_totals(conn, 1, tier, [BASE, BASE + 3600])
+    interface_history(conn, 1, tier, BASE)
+
+
+def table_reads(conn):
+    """(plan line) for every step reading a bandwidth table in the hot queries"""
+    recorder = RecordingConnection(conn)
+    hot_queries(recorder)
+    reads = []
+    for sql, params in recorder.statements:
+        for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params):
+            detail = row[-1]
+            if BANDWIDTH_TABLE.search(detail):
+                reads.append(detail)
+    return reads
+
+
+def test_hot_queries_only_search_covering_indexes(tmp_path):
+    path, conn = make_db(tmp_path)
+    build_missing_indexes(path)
+
+    reads = table_reads(conn)
+    assert len(reads) >= 9
+    for detail in reads:
+        assert detail.startswith('SEARCH'), detail
+        assert 'COVERING INDEX' in detail or 'PRIMARY KEY' in detail, detail
+
+
+def test_missing_indexes_are_found_and_obsolete_ones_dropped(tmp_path):
+    path, conn = make_db(tmp_path)
+    name = partition_name('ip_bandwidth_data', partition_day(BASE))
+    conn.execute(f'DROP INDEX idx_{name}_router_time_cover')
+    conn.execute(f'CREATE INDEX idx_{name}_router_time ON {name} (router_id, timestamp)')
+    conn.commit()
+
+    # Without its covering index the totals query reads table rows
+    assert any('COVERING INDEX' not in detail for detail in table_reads(conn))
+
+    statements = index_statements(conn)
+    assert f'DROP INDEX IF EXISTS idx_{name}_router_time' in statements
+    assert any(f'idx_{name}_router_time_cover' in statement for statement in statements)
+    assert build_missing_indexes(path) == len(statements)
+    # A new connection: EXPLAIN does not notice schema changes made elsewhere
+    conn = sqlite3.connect(path)
+    assert index_statements(conn) == []
+    assert all('COVERING INDEX' in detail or 'PRIMARY KEY' in detail for detail in table_reads(conn))
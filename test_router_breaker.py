@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Tests for the shared per-router circuit breaker
+"""
+
+import sqlite3
+
+from ingest_writer import IngestWriter
+from router_breaker import BREAKER_SCHEMA, CLOSED, HALF_OPEN, OPEN, RouterCircuitBreaker
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def make_breaker(tmp_path, clock):
+    path = str(tmp_path / 'routers.db')
+    conn = sqlite3.connect(path)
+    conn.execute(BREAKER_SCHEMA)
+    conn.commit()
+    conn.close()
+    return RouterCircuitBreaker(path, failure_threshold=2, base_backoff=30, max_backoff=100,
+                                probe_timeout=60, clock=clock)
+
+
+def test_breaker_opens_after_threshold_and_backs_off(tmp_path):
+    clock = FakeClock()
+    breaker = make_breaker(tmp_path, clock)
+
+    assert breaker.record_failure(1, 'timeout') == CLOSED
+    assert breaker.allow(1)
+    assert breaker.record_failure(1, 'timeout') == OPEN
+    assert not breaker.allow(1) and breaker.is_open(1)
+
+    # Backoff over: exactly one half-open probe is handed out
+    clock.now += 30
+    assert breaker.allow(1)
+    assert breaker.state(1)['state'] == HALF_OPEN
+    assert not breaker.allow(1)
+
+    # Failed probe reopens with the backoff doubled, capped at max_backoff
+    breaker.record_failure(1, 'timeout')
+    assert breaker.state(1)['retry_at'] == clock.now + 60
+    clock.now += 60
+    assert breaker.allow(1)
+    breaker.record_failure(1, 'timeout')
+    assert breaker.state(1)['retry_at'] == clock.now + 100
+
+
+def test_successful_probe_closes_breaker(tmp_path):
+    clock = FakeClock()
+    breaker = make_breaker(tmp_path, clock)
+    breaker.record_failure(1)
+    breaker.record_failure(1)
+    clock.now += 30
+    assert breaker.allow(1)
+    breaker.record_success(1)
+    assert breaker.state(1)['state'] == CLOSED
+    assert breaker.allow(1) and breaker.allow(1)
+
+
+def test_lost_probe_is_handed_out_again(tmp_path):
+    clock = FakeClock()
+    breaker = make_breaker(tmp_path, clock)
+    breaker.record_failure(1)
+    breaker.record_failure(1)
+    clock.now += 30
+    assert breaker.allow(1)
+    clock.now += 61
+    assert breaker.allow(1)
+
+
+def test_breaker_writes_through_the_ingest_writer(tmp_path):
+    clock = FakeClock()
+    path = make_breaker(tmp_path, clock).db_path
+    writer = IngestWriter(path)
+    try:
+        breaker = RouterCircuitBreaker(path, failure_threshold=2, base_backoff=30, clock=clock, writer=writer)
+        breaker.record_failure(1)
+        assert breaker.record_failure(1) == OPEN
+        assert not breaker.allow(1)
+        clock.now += 30
+        assert breaker.allow(1) and breaker.state(1)['state'] == HALF_OPEN
+    finally:
+        writer.stop()
+
+
+def test_closed_breaker_is_read_without_writing(tmp_path):
+    clock = FakeClock()
+    breaker = make_breaker(tmp_path, clock)
+    breaker.record_failure(1)
+    breaker.record_success(1)
+
+    def updated_at():
+        with breaker.db.read() as conn:
+            return conn.execute('SELECT updated_at FROM router_circuit_breakers WHERE router_id = 1').fetchone()[0]
+
+    closed_at = updated_at()
+    clock.now += 10
+    assert breaker.allow(1) and breaker.allow(2)
+    breaker.record_success(1)
+    breaker.record_success(2)
+    assert updated_at() == closed_at
+    assert breaker.state(2)['state'] == CLOSED
+    with breaker.db.read() as conn:
+        assert conn.execute('SELECT COUNT(*) FROM router_circuit_breakers').fetchone()[0] == 1
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Tests for router ownership leases used by sharded collectors
+"""
+
+import sqlite3
+
+from router_leases import LEASE_SCHEMA, ROLE_SCHEMA, WORKER_SCHEMA, RouterLeaseManager
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def make_db(tmp_path):
+    path = str(tmp_path / 'routers.db')
+    conn = sqlite3.connect(path)
+    conn.execute(LEASE_SCHEMA)
+    conn.execute(WORKER_SCHEMA)
+    conn.execute(ROLE_SCHEMA)
+    conn.commit()
+    conn.close()
+    return path
+
+
+def settle(managers, router_ids, rounds=3):
+    for _ in range(rounds):
+        owned = [manager.rebalance(router_ids) for manager in managers]
+    return owned
+
+
+def test_workers_split_routers_without_overlap(tmp_path):
+    db, clock = make_db(tmp_path), FakeClock()
+    routers = list(range(1, 41))
+    first = RouterLeaseManager(db, 'worker-a', ttl=90, clock=clock)
+    assert first.rebalance(routers) == set(routers)
+
+    second = RouterLeaseManager(db, 'worker-b', ttl=90, clock=clock)
+    owned_a, owned_b = settle([first, second], routers)
+    assert owned_a.isdisjoint(owned_b)
+    assert owned_a | owned_b == set(routers)
+    assert 10 <= len(owned_b) <= 30
+
+
+def test_dead_worker_routers_are_taken_over(tmp_path):
+    db, clock = make_db(tmp_path), FakeClock()
+    routers = list(range(1, 21))
+    first = RouterLeaseManager(db, 'worker-a', ttl=90, clock=clock)
+    second = RouterLeaseManager(db, 'worker-b', ttl=90, clock=clock)
+    settle([first, second], routers)
+
+    # worker-b stops renewing; its leases and heartbeat expire
+    clock.now += 91
+    assert first.rebalance(routers) == set(routers)
+
+
+def test_handover_never_repeats_a_tick(tmp_path):
+    db, clock = make_db(tmp_path), FakeClock()
+    first = RouterLeaseManager(db, 'worker-a', ttl=90, clock=clock)
+    first.rebalance([7])
+    assert first.begin_poll(7, 960.0)
+    assert not first.begin_poll(7, 960.0)
+
+    # Hand the router to another worker: the same tick stays fenced
+    first.release_all()
+    second = RouterLeaseManager(db, 'worker-b', ttl=90, clock=clock)
+    assert second.rebalance([7]) == {7}
+    assert not first.begin_poll(7, 1020.0)
+    assert not second.begin_poll(7, 960.0)
+    assert second.begin_poll(7, 1020.0)
+
+
+def test_newly_owned_routers_are_reported_once(tmp_path):
+    db, clock = make_db(tmp_path), FakeClock()
+    routers = list(range(1, 21))
+    first = RouterLeaseManager(db, 'worker-a', ttl=90, clock=clock)
+    first.rebalance(routers)
+    assert first.acquired == set(routers)
+    first.rebalance(routers)
+    assert first.acquired == set()
+
+    # worker-b comes and goes: only its share is new to worker-a again
+    second = RouterLeaseManager(db, 'worker-b', ttl=90, clock=clock)
+    _, share_b = settle([first, second], routers)
+    second.release_all()
+    first.rebalance(routers)
+    assert share_b and first.acquired == share_b
+    assert first.owned == set(routers)
+
+
+def test_one_worker_holds_a_role_until_it_expires(tmp_path):
+    db, clock = make_db(tmp_path), FakeClock()
+    first = RouterLeaseManager(db, 'worker-a', ttl=90, clock=clock)
+    second = RouterLeaseManager(db, 'worker-b', ttl=90, clock=clock)
+    assert first.claim_role('maintenance', 100)
+    assert not second.claim_role('maintenance', 100)
+
+    # Renewed while worker-a keeps running, taken over once it stops
+    clock.now += 90
+    assert first.claim_role('maintenance', 100)
+    clock.now += 90
+    assert not second.claim_role('maintenance', 100)
+    clock.now += 11
+    assert second.claim_role('maintenance', 100)
+    assert not first.claim_role('maintenance', 100)
+
+    # A clean shutdown hands it over at once
+    second.release_all()
+    assert first.claim_role('maintenance', 100)
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Tests for the persistent RouterOS session pool
+"""
+
+import routeros_async
+from router_sessions import RouterSessionPool
+from routeros_async import get_engine
+from test_routeros_async import INTERFACES, FakeRouterOs
+
+
+def start_fake_router():
+    async def start():
+        return await FakeRouterOs({'/interface': INTERFACES, '/system/identity': [{'name': 'r1'}]}).start()
+    return get_engine().run(start())
+
+
+def login_count(server):
+    return sum(1 for words in server.commands if words[0] == '/login')
+
+
+def test_session_is_reused_across_checkouts(monkeypatch):
+    monkeypatch.setattr(routeros_async, 'ROUTEROS_ENGINE', 'async')
+    server = start_fake_router()
+    contacted = []
+    pool = RouterSessionPool(max_per_router=2, health_interval=60, on_contact=contacted.append)
+    try:
+        for _ in range(3):
+            api, lease = pool.acquire(1, '127.0.0.1', server.port, 'admin', 'secret')
+            assert len(api.get_resource('/interface').get()) == 2
+            lease.disconnect()
+        assert login_count(server) == 1
+        assert pool.stats['created'] == 1 and pool.stats['reused'] == 2
+
+        # Only answered calls count as contact, not handing out a pooled session
+        api, lease = pool.acquire(1, '127.0.0.1', server.port, 'admin', 'secret')
+        lease.disconnect()
+        assert contacted == [1, 1, 1]
+    finally:
+        pool.close_router(1)
+        get_engine().run(server.stop())
+
+
+def test_max_sessions_per_router_blocks(monkeypatch):
+    monkeypatch.setattr(routeros_async, 'ROUTEROS_ENGINE', 'async')
+    server = start_fake_router()
+    pool = RouterSessionPool(max_per_router=1, acquire_timeout=0.2)
+    try:
+        api, lease = pool.acquire(1, '127.0.0.1', server.port, 'admin', 'secret')
+        try:
+            pool.acquire(1, '127.0.0.1', server.port, 'admin', 'secret')
+        except TimeoutError:
+            pass
+        else:
+            raise AssertionError('second checkout must wait for the first to be released')
+        lease.disconnect()
+        api, lease = pool.acquire(1, '127.0.0.1', server.port, 'admin', 'secret')
+        lease.disconnect()
+    finally:
+        pool.close_router(1)
+        get_engine().run(server.stop())
+
+
+def test_dead_session_reconnects_transparently(monkeypatch):
+    monkeypatch.setattr(routeros_async, 'ROUTEROS_ENGINE', 'async')
+    server = start_fake_router()
+    pool = RouterSessionPool(max_per_router=1, health_interval=60)
+    try:
+        api, lease = pool.acquire(1, '127.0.0.1', server.port, 'admin', 'secret')
+        lease.disconnect()
+        get_engine().run(server.drop_connections())
+
+        api, lease = pool.acquire(1, '127.0.0.1', server.port, 'admin', 'secret')
+        assert api.get_resource('/interface').get()[0]['name'] == 'ether1'
+        lease.disconnect()
+        assert login_count(server) == 2
+    finally:
+        pool.close_router(1)
+        get_engine().run(server.stop())
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Tests for the per-cycle RouterOS resource snapshot
+"""
+
+from router_snapshot import RouterSnapshot, as_snapshot
+
+
+class CountingApi:
+    """Stand-in RouterOS API that counts fetches per path"""
+
+    def __init__(self, tables):
+        self.tables = tables
+        self.fetches = {}
+
+    def get_resource(self, path):
+        api = self
+
+        class Resource:
+            def get(self):
+                api.fetches[path] = api.fetches.get(path, 0) + 1
+                return api.tables[path]
+        return Resource()
+
+
+def test_each_path_is_fetched_once_per_snapshot():
+    api = CountingApi({
+        '/interface': [{'name': 'ether1', 'rx-byte': '10', 'tx-byte': '20'}],
+        '/system/resource': [{'uptime': '1d', 'cpu-load': '3'}],
+    })
+    snapshot = RouterSnapshot(api)
+    for _ in range(4):
+        assert snapshot.get('/interface')[0]['name'] == 'ether1'
+        assert snapshot.first('/system/resource')['uptime'] == '1d'
+
+    assert api.fetches == {'/interface': 1, '/system/resource': 1}
+    stats = snapshot.stats()
+    assert stats['round_trips'] == 2
+    assert stats['rows'] == 2
+    assert stats['bytes'] > 0
+    assert as_snapshot(snapshot) is snapshot
+
+
+def test_conntrack_query_is_pushed_down_to_router():
+    from routeros_async import AsyncRouterOsClient, EngineApi, get_engine
+    from router_snapshot import conntrack_query
+    from test_routeros_async import FakeRouterOs
+
+    connections = [
+        {'.id': '*1', 'protocol': 'tcp', 'src-address': '192.168.1.10:5000', 'dst-address': '1.1.1.1:443',
+         'orig-bytes': '500', 'repl-bytes': '90000', 'timeout': '23h59m', 'tcp-state': 'established'},
+        {'.id': '*2', 'protocol': 'udp', 'src-address': '192.168.1.11:5353', 'dst-address': '8.8.8.8:53',
+         'orig-bytes': '60', 'repl-bytes': '120', 'timeout': '10s'},
+    ]
+    engine = get_engine()
+
+    async def connect():
+        server = await FakeRouterOs({'/ip/firewall/connection': connections}).start()
+        client = await AsyncRouterOsClient('127.0.0.1', server.port, 'admin', 'secret').connect()
+        return server, client
+
+    server, client = engine.run(connect())
+    try:
+        snapshot = RouterSnapshot(EngineApi(engine, client))
+        rows = snapshot.query(conntrack_query(proplist=('src-address', 'repl-bytes'), protocol='tcp'))
+        assert rows == [{'src-address': '192.168.1.10:5000', 'repl-bytes': '90000'}]
+        print_words = [words for words in server.commands if words[0] == '/ip/firewall/connection/print'][0]
+        assert '=.proplist=src-address,repl-bytes' in print_words
+        assert '?protocol=tcp' in print_words
+    finally:
+        engine.run(client.close())
+        engine.run(server.stop())
+
+
+def test_query_words_reach_routeros_api_in_order():
+    from routeros_api.api import RouterOsApi
+    from routeros_api.api_communicator import ApiCommunicator
+    from router_snapshot import RouterQuery, any_of, conntrack_query, equals
+
+    class RecordingSocket:
+        """routeros_api base that records sent sentences and answers !done"""
+
+        def __init__(self):
+            self.sent = []
+
+        def send_sentence(self, words):
+            self.sent.append(words)
+
+        def receive_sentence(self):
+            return [b'!done', b'.tag=%d' % len(self.sent)]
+
+    socket = RecordingSocket()
+    api = RouterOsApi(ApiCommunicator(socket))
+    # routeros_api keeps separate query objects in a set; build many sentences to catch any reordering
+    for _ in range(50):
+        assert conntrack_query(proplist=('src-address',), min_bytes=1000, protocol='tcp').run(api) == []
+        RouterQuery('/log', ('.id', 'message'), any_of(*(equals('.id', f'*{n}') for n in range(1, 6)))).run(api)
+    for words in socket.sent[::2]:
+        assert words == [b'/ip/firewall/connection/print', b'=.proplist=src-address', b'?protocol=tcp',
+                         b'?>orig-bytes=1000', b'?>repl-bytes=1000', b'?#|', words[-1]]
+    for words in socket.sent[1::2]:
+        assert words[2:-1] == [b'?.id=*1', b'?.id=*2', b'?.id=*3', b'?.id=*4', b'?.id=*5', b'?#||||']
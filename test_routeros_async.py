@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+Tests for the asyncio RouterOS API engine against a local fake RouterOS server
+"""
+
+import asyncio
+
+from routeros_async import (AsyncApiPool, AsyncRouterOsClient, RouterOsConnectionError, RouterOsTrapError,
+                            encode_length, encode_sentence, parse_sentence, read_sentence)
+
+
+class FakeRouterOs:
+    """Minimal RouterOS API server: login plus ``/print`` over canned tables"""
+
+    def __init__(self, tables=None, username='admin', password='secret', delay=0.0):
+        self.tables = tables or {}
+        self.username = username
+        self.password = password
+        self.delay = delay
+        self.commands = []
+        self.writers = []
+        self.followers = {}
+        self.server = None
+        self.port = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, '127.0.0.1', 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def drop_connections(self):
+        """Simulate the router closing every session (reboot, idle timeout)"""
+        for writer in self.writers:
+            writer.close()
+        self.writers = []
+
+    async def emit(self, path, row):
+        """Append a row to a table and push it to ``follow-only`` prints"""
+        self.tables.setdefault(path, []).append(row)
+        for (follow_path, tag), follow_writer in list(self.followers.items()):
+            if follow_path == path:
+                follow_writer.write(encode_sentence(['!re'] + [f'={k}={v}' for k, v in row.items()]
+                                                    + [f'.tag={tag}']))
+                await follow_writer.drain()
+
+    async def _handle(self, reader, writer):
+        self.writers.append(writer)
+        try:
+            while True:
+                words, _ = await read_sentence(reader)
+                self.commands.append(words)
+                asyncio.get_running_loop().create_task(self._reply(words, writer))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+
+    async def _reply(self, words, writer):
+        command = words[0]
+        _, attributes, tag = parse_sentence(words)
+        queries = [word[1:] for word in words[1:] if word.startswith('?')]
+        suffix = [f'.tag={tag}'] if tag else []
+
+        if self.delay:
+            await asyncio.sleep(self.delay)
+
+        if command == '/login':
+            if attributes.get('name') == self.username and attributes.get('password') == self.password:
+                writer.write(encode_sentence(['!done'] + suffix))
+            else:
+                writer.write(encode_sentence(['!trap', '=message=invalid user name or password (6)'] + suffix))
+                writer.write(encode_sentence(['!done'] + suffix))
+        elif command == '/cancel':
+            for key in [key for key in self.followers if key[1] == attributes.get('tag')]:
+                follow_writer = self.followers.pop(key)
+                follow_writer.write(encode_sentence(['!trap', '=category=2', '=message=interrupted',
+                                                     f'.tag={key[1]}']))
+                follow_writer.write(encode_sentence(['!done', f'.tag={key[1]}']))
+            writer.write(encode_sentence(['!done'] + suffix))
+        elif command.endswith('/print') and 'follow-only' in attributes:
+            self.followers[(command[:-len('/print')], tag)] = writer
+        elif command.endswith('/print') and command[:-len('/print')] in self.tables:
+            proplist = attributes.get('.proplist')
+            for row in self.tables[command[:-len('/print')]]:
+                if not self._matches(row, queries):
+                    continue
+                if proplist:
+                    row = {key: value for key, value in row.items() if key in proplist.split(',')}
+                writer.write(encode_sentence(['!re'] + [f'={k}={v}' for k, v in row.items()] + suffix))
+            writer.write(encode_sentence(['!done'] + suffix))
+        else:
+            writer.write(encode_sentence(['!trap', '=message=no such command'] + suffix))
+            writer.write(encode_sentence(['!done'] + suffix))
+        await writer.drain()
+
+    @staticmethod
+    def _matches(row, queries):
+        # Evaluate the query words as RouterOS does: a stack of results,
+        # '#|' ORs the top two and whatever is left is ANDed together
+        stack = []
+        for query in queries:
+            if query.startswith('#'):
+                for op in query[1:]:
+                    right, left = stack.pop(), stack.pop()
+                    stack.append(left or right if op == '|' else left and right)
+            elif query.startswith('>'):
+                key, _, value = query[1:].partition('=')
+                stack.append(int(row.get(key, 0)) > int(value))
+            elif query.startswith('<'):
+                key, _, value = query[1:].partition('=')
+                stack.append(int(row.get(key, 0)) < int(value))
+            else:
+                key, _, value = query.partition('=')
+                stack.append(row.get(key) == value)
+        return all(stack)
+
+
+INTERFACES = [
+    {'.id': '*1', 'name': 'ether1', 'rx-byte': '1000', 'tx-byte': '2000'},
+    {'.id': '*2', 'name': 'ether2', 'rx-byte': '3000', 'tx-byte': '4000'},
+]
+
+
+def test_encode_length_boundaries():
+    assert encode_length(0x7F) == b'\x7f'
+    assert encode_length(0x80) == b'\x80\x80'
+    assert encode_length(0x3FFF) == b'\xbf\xff'
+    assert encode_length(0x4000) == b'\xc0\x40\x00'
+    assert encode_length(0x200000) == b'\xe0\x20\x00\x00'
+    assert encode_length(0x10000000) == b'\xf0\x10\x00\x00\x00'
+
+
+def test_login_and_print():
+    async def scenario():
+        server = await FakeRouterOs({'/interface': INTERFACES}).start()
+        client = AsyncRouterOsClient('127.0.0.1', server.port, 'admin', 'secret', timeout=5)
+        await client.connect()
+        rows = await client.print('/interface')
+        projected = await client.print('/interface', proplist=['name'], queries=['?name=ether2'])
+        await client.close()
+        await server.stop()
+        return rows, projected, client
+
+    rows, projected, client = asyncio.run(scenario())
+    assert [row['name'] for row in rows] == ['ether1', 'ether2']
+    assert rows[0]['.id'] == '*1'
+    assert projected == [{'name': 'ether2'}]
+    assert client.round_trips == 3
+    assert client.bytes_received > 0 and client.bytes_sent > 0
+
+
+def test_login_failure_raises_trap():
+    async def scenario():
+        server = await FakeRouterOs().start()
+        client = AsyncRouterOsClient('127.0.0.1', server.port, 'admin', 'wrong', timeout=5)
+        try:
+            await client.connect()
+        finally:
+            await server.stop()
+
+    try:
+        asyncio.run(scenario())
+    except RouterOsTrapError as e:
+        assert 'invalid user name or password' in str(e)
+    else:
+        raise AssertionError('login with a wrong password must fail')
+
+
+def test_tagged_commands_run_concurrently():
+    async def scenario():
+        server = await FakeRouterOs({'/interface': INTERFACES, '/ip/arp': []}, delay=0.2).start()
+        client = await AsyncRouterOsClient('127.0.0.1', server.port, 'admin', 'secret', timeout=5).connect()
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        results = await client.print_many(['/interface', '/ip/arp'] * 5)
+        elapsed = loop.time() - start
+        await client.close()
+        await server.stop()
+        return results, elapsed
+
+    results, elapsed = asyncio.run(scenario())
+    assert len(results['/interface']) == 2
+    # Ten 0.2s commands multiplexed over one session finish in ~one delay
+    assert elapsed < 1.0
+
+
+def test_timed_out_command_is_cancelled():
+    async def scenario():
+        server = await FakeRouterOs({'/interface': INTERFACES}).start()
+        client = await AsyncRouterOsClient('127.0.0.1', server.port, 'admin', 'secret', timeout=0.2).connect()
+        try:
+            # A follow-only print never finishes on its own
+            await client.talk('/log/print', {'follow-only': ''})
+        except RouterOsConnectionError as e:
+            error = e
+        await asyncio.sleep(0.1)
+        rows = await client.print('/interface')
+        await client.close()
+        await server.stop()
+        return error, rows, server, client
+
+    error, rows, server, client = asyncio.run(scenario())
+    assert 'timed out' in str(error)
+    assert ['/cancel', '=tag=2'] in server.commands
+    assert not server.followers
+    assert not client._pending
+    assert len(rows) == 2
+
+
+def test_sync_pool_is_drop_in_for_routeros_api():
+    async def start():
+        return await FakeRouterOs({'/interface': INTERFACES}).start()
+
+    pool = AsyncApiPool('127.0.0.1', username='admin', password='secret')
+    server = pool.engine.run(start())
+    pool.port = server.port
+    try:
+        api = pool.get_api()
+        rows = api.get_resource('/interface').get(name='ether1')
+        assert rows == [{'id': '*1', 'name': 'ether1', 'rx-byte': '1000', 'tx-byte': '2000'}]
+    finally:
+        pool.disconnect()
+        pool.engine.run(server.stop())
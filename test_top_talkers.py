@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Tests for the in-memory top talkers engine
+"""
+
+import random
+import sqlite3
+
+from bandwidth_partitions import (PARTITIONED_TABLES, ensure_partition, insert_sql, partition_day, partition_name,
+                                  raw_host_totals)
+from bandwidth_rollup import IP_ROLLUP_SCHEMA, IP_ROLLUP_UPSERT, choose_tier, host_totals, ip_rollup_rows
+from top_talkers import WINDOWS, TopTalkers
+
+# 2024-01-01 00:00:00 UTC
+BASE = 1704067200
+
+
+def make_db():
+    conn = sqlite3.connect(':memory:')
+    conn.execute('CREATE TABLE routers (id INTEGER PRIMARY KEY)')
+    conn.executemany('INSERT INTO routers (id) VALUES (?)', [(1,), (2,)])
+    conn.execute(IP_ROLLUP_SCHEMA)
+    conn.commit()
+    return conn
+
+
+def ingest(conn, router_id, epoch, samples):
+    """Write {host_id: (rx, tx)} like the collector: raw rows plus rollups"""
+    name = ensure_partition(conn, 'ip_bandwidth_data', partition_name('ip_bandwidth_data', partition_day(epoch)))
+    conn.executemany(insert_sql(name, PARTITIONED_TABLES['ip_bandwidth_data']['columns']),
+                     [(router_id, host_id, epoch, rx, tx) for host_id, (rx, tx) in samples.items()])
+    conn.executemany(IP_ROLLUP_UPSERT, ip_rollup_rows(
+        [(router_id, host_id, rx, tx) for host_id, (rx, tx) in samples.items()], epoch))
+    conn.commit()
+
+
+def sql_totals(conn, router_id, window, now):
+    seconds = WINDOWS[window] * 60
+    tier = choose_tier(seconds)
+    if tier:
+        rows = host_totals(conn, router_id, tier, now - seconds)
+    else:
+        rows = raw_host_totals(conn, router_id, now - seconds)
+    return sorted(rows)
+
+
+def test_running_totals_match_the_queries_they_replace():
+    conn = make_db()
+    rng = random.Random(7)
+    # Two days of one poll a minute, a few seconds into it
+    polls = [BASE + minute * 60 + 7 for minute in range(2 * 1440)]
+    start = len(polls) - 600
+    for epoch in polls[:start]:
+        ingest(conn, rng.choice((1, 2)), epoch, {host_id: (rng.randrange(1000), rng.randrange(100))
+                                                 for host_id in rng.sample(range(1, 30), 5)})
+
+    talkers = TopTalkers(sync_seconds=0)
+    assert talkers.warm(conn, now=polls[start - 1] + 30) == 2
+    # New samples arrive while the windows slide over the old ones
+    for epoch in polls[start:]:
+        ingest(conn, 1, epoch, {host_id: (rng.randrange(1000), rng.randrange(100))
+                                for host_id in rng.sample(range(1, 30), 5)})
+        if epoch % 97 == 0:
+            now = epoch + 30
+            for window in WINDOWS:
+                assert sorted(talkers.totals(conn, 1, window, now)) == sql_totals(conn, 1, window, now), window
+
+    now = polls[-1] + 30
+    for window in WINDOWS:
+        for router_id in (1, 2):
+            assert sorted(talkers.totals(conn, router_id, window, now)) == sql_totals(conn, router_id, window, now)
+
+
+def test_windows_forget_hosts_and_only_read_new_samples():
+    conn = make_db()
+    ingest(conn, 1, BASE + 10, {7: (100, 10)})
+    talkers = TopTalkers(sync_seconds=60)
+    assert talkers.totals(conn, 1, '5m', BASE + 20) == [(7, 100, 10)]
+
+    # Not read again until the sync interval has passed
+    ingest(conn, 1, BASE + 70, {8: (5, 5)})
+    assert talkers.totals(conn, 1, '5m', BASE + 75) == [(7, 100, 10)]
+    assert sorted(talkers.totals(conn, 1, '5m', BASE + 90)) == [(7, 100, 10), (8, 5, 5)]
+
+    # Host 7 has sent nothing for over five minutes
+    assert talkers.totals(conn, 1, '5m', BASE + 320) == [(8, 5, 5)]
+    assert sorted(talkers.totals(conn, 1, '1h', BASE + 320)) == [(7, 100, 10), (8, 5, 5)]
+    assert talkers.totals(conn, 1, '5m', BASE + 3600) == []
+
+    talkers.forget(1)
+    assert sorted(talkers.totals(conn, 1, '1w', BASE + 3600)) == [(7, 100, 10), (8, 5, 5)]
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+In-memory per-IP totals over the monitor page's standard windows.
+
+The monitor page and ``/api/monitor`` ask for per-host totals over one of
+``WINDOWS`` on every refresh. ``TopTalkers`` answers from running sums
+instead of aggregating raw samples or rollup buckets each time.
+
+Every router keeps a ring of buckets per resolution: minutes for the
+windows served from raw samples, and the rollup tier's bucket for the
+longer ones (the tier ``choose_tier`` picks for the period, as the SQL path
+did). Each window keeps per-host sums of the buckets inside it: samples are
+added as they come in and buckets leaving the window are subtracted, so a
+query only touches the buckets that moved since the last one.
+
+A window holds the buckets whose first sample falls inside it. With one
+poll per minute that is the raw ``timestamp >= since`` rule, and for the
+rolled-up windows the rollup ``bucket >= tier.bucket(since)`` one.
+
+Samples are written by the collector in another process, so a query first
+reads the router's samples newer than the last one seen, at most every
+``TOP_TALKERS_SYNC_SECONDS`` (an indexed range read of the newest day
+partition). Routers are warmed on first use, or all at once by ``warm`` at
+startup: the minute ring from raw samples, the others from the rollup
+tier.
+"""
+
+import os
+import threading
+import time
+from bisect import bisect_left, insort
+
+from bandwidth_partitions import query_partitions
+from bandwidth_rollup import choose_tier, host_buckets
+
+# Serve the monitor page's totals from memory ('0' reads them from SQLite instead)
+TOP_TALKERS_ENABLED = os.environ.get('TOP_TALKERS_ENABLED', '1') != '0'
+# Seconds between reads of a router's new samples from the database
+TOP_TALKERS_SYNC_SECONDS = float(os.environ.get('TOP_TALKERS_SYNC_SECONDS', '5'))
+
+# Standard windows of the monitor page, in minutes
+WINDOWS = {
+    '1m': 1,
+    '5m': 5,
+    '15m': 15,
+    '30m': 30,
+    '1h': 60,
+    '3h': 180,
+    '6h': 360,
+    '12h': 720,
+    '24h': 1440,
+    '3d': 4320,
+    '1w': 10080
+}
+
+# Bucket length of the windows served from raw samples
+MINUTE = 60
+
+
+class _Window:
+    """Running per-host [rx, tx, buckets] sums of one window"""
+
+    def __init__(self, seconds, tier):
+        self.seconds = seconds
+        self.tier = tier
+        # Start of the oldest bucket still counted
+        self.edge = 0
+        self.sums = {}
+
+    def start(self, now):
+        """Earliest first sample a bucket may have to stay in the window"""
+        since = now - self.seconds
+        return self.tier.bucket(since) if self.tier else since
+
+
+class _Ring:
+    """Buckets of one resolution and the windows summing them"""
+
+    def __init__(self, seconds, tier):
+        self.seconds = seconds
+        self.tier = tier
+        self.windows = {}
+        # bucket start -> [first sample epoch, {host_id: [rx, tx]}]
+        self.buckets = {}
+        self.starts = []
+
+    def add(self, host_id, epoch, rx_bytes, tx_bytes):
+        start = epoch - epoch % self.seconds
+        if all(start < window.edge for window in self.windows.values()):
+            return
+        bucket = self.buckets.get(start)
+        if bucket is None:
+            bucket = self.buckets[start] = [epoch, {}]
+            insort(self.starts, start)
+        bucket[0] = min(bucket[0], epoch)
+        sample = bucket[1].get(host_id)
+        if sample is None:
+            bucket[1][host_id] = [rx_bytes, tx_bytes]
+        else:
+            sample[0] += rx_bytes
+            sample[1] += tx_bytes
+        for window in self.windows.values():
+            if start < window.edge:
+                continue
+            total = window.sums.get(host_id)
+            if total is None:
+                window.sums[host_id] = [rx_bytes, tx_bytes, 1]
+            else:
+                total[0] += rx_bytes
+                total[1] += tx_bytes
+                total[2] += sample is None
+
+    def advance(self, now):
+        """Subtract the buckets that left each window, then forget those no window holds"""
+        for window in self.windows.values():
+            start = window.start(now)
+            i = bisect_left(self.starts, window.edge)
+            while i < len(self.starts) and self.buckets[self.starts[i]][0] < start:
+                for host_id, (rx_bytes, tx_bytes) in self.buckets[self.starts[i]][1].items():
+                    total = window.sums[host_id]
+                    total[0] -= rx_bytes
+                    total[1] -= tx_bytes
+                    total[2] -= 1
+                    if not total[2]:
+                        del window.sums[host_id]
+                i += 1
+            if i < len(self.starts):
+                window.edge = self.starts[i]
+            elif self.starts:
+                window.edge = self.starts[-1] + self.seconds
+        kept = bisect_left(self.starts, min(window.edge for window in self.windows.values()))
+        for start in self.starts[:kept]:
+            del self.buckets[start]
+        del self.starts[:kept]
+
+
+class _Router:
+    def __init__(self, rings):
+        self.rings = rings
+        # Newest raw sample timestamp read, and when
+        self.seen = 0
+        self.synced = 0
+
+
+class TopTalkers:
+    """Per-router running per-host totals over ``WINDOWS``"""
+
+    def __init__(self, windows=None, sync_seconds=None):
+        self.windows = windows or WINDOWS
+        self.sync_seconds = TOP_TALKERS_SYNC_SECONDS if sync_seconds is None else sync_seconds
+        self._routers = {}
+        self._lock = threading.Lock()
+
+    def _rings(self):
+        rings = {}
+        for name, minutes in self.windows.items():
+            tier = choose_tier(minutes * 60)
+            resolution = tier.seconds if tier else MINUTE
+            ring = rings.setdefault(resolution, _Ring(resolution, tier))
+            ring.windows[name] = _Window(minutes * 60, tier)
+        return rings
+
+    def _warm(self, conn, router_id, now):
+        router = _Router(self._rings())
+        router.seen = int(now)
+        # One snapshot, so no sample lands in both the rollups and the raw tail
+        began = not conn.in_transaction
+        if began:
+            conn.execute('BEGIN')
+        try:
+            for ring in router.rings.values():
+                since = min(window.start(now) for window in ring.windows.values())
+                if ring.tier:
+                    for bucket, host_id, rx_bytes, tx_bytes in host_buckets(conn, router_id, ring.tier, since):
+                        ring.add(host_id, bucket, rx_bytes or 0, tx_bytes or 0)
+                    continue
+                seen = 0
+                for host_id, timestamp, rx_bytes, tx_bytes in query_partitions(
+                        conn, 'ip_bandwidth_data', 'host_id, timestamp, rx_bytes, tx_bytes', 'router_id = ?',
+                        (router_id,), since):
+                    ring.add(host_id, timestamp, rx_bytes or 0, tx_bytes or 0)
+                    seen = max(seen, timestamp)
+                router.seen = seen or router.seen
+        finally:
+            if began:
+                conn.rollback()
+        router.synced = now
+        self._routers[router_id] = router
+        return router
+
+    def _sync(self, conn, router, router_id, now):
+        """Add the raw samples written since the last read to every ring"""
+        rows = query_partitions(conn, 'ip_bandwidth_data', 'host_id, timestamp, rx_bytes, tx_bytes', 'router_id = ?',
+                                (router_id,), router.seen + 1)
+        for host_id, timestamp, rx_bytes, tx_bytes in rows:
+            for ring in router.rings.values():
+                ring.add(host_id, timestamp, rx_bytes or 0, tx_bytes or 0)
+            router.seen = max(router.seen, timestamp)
+        router.synced = now
+
+    def warm(self, conn, router_ids=None, now=None):
+        """Load every router (or ``router_ids``) from the database; returns routers warmed"""
+        now = time.time() if now is None else now
+        if router_ids is None:
+            router_ids = [row[0] for row in conn.execute('SELECT id FROM routers')]
+        with self._lock:
+            for router_id in router_ids:
+                self._warm(conn, router_id, now)
+        return len(router_ids)
+
+    def totals(self, conn, router_id, window, now=None):
+        """[(host_id, rx, tx)] of a router over one of the windows"""
+        now = time.time() if now is None else now
+        with self._lock:
+            router = self._routers.get(router_id)
+            if router is None:
+                router = self._warm(conn, router_id, now)
+            elif now - router.synced >= self.sync_seconds:
+                self._sync(conn, router, router_id, now)
+            for ring in router.rings.values():
+                if window in ring.windows:
+                    ring.advance(now)
+                    return [(host_id, rx_bytes, tx_bytes)
+                            for host_id, (rx_bytes, tx_bytes, _) in ring.windows[window].sums.items()]
+        raise KeyError(window)
+
+    def forget(self, router_id):
+        """Drop a router's state (deleted routers)"""
+        with self._lock:
+            self._routers.pop(router_id, None)